@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+import argparse
+import asyncio
+import glob
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+import fakes
+
+# drives one full orchestrator cycle against local fakes of DefectDojo, GitLab, the registry and
+# Rocket.Chat, fake scanners and a throwaway Postgres; every inventory size runs in its own
+# process so peak RSS is measured per size:
+#   bench/benchmark.py --targets 10 100 1000 --latency 0.05 --scan-seconds 0.5
+#   bench/benchmark.py --targets 10000 --db-url postgresql://postgres@127.0.0.1/postgres
+
+BENCH_DIR       = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR        = os.path.dirname(BENCH_DIR)
+SRC_DIR         = os.path.join(REPO_DIR, "src")
+MIGRATIONS_GLOB = os.path.join(REPO_DIR, "scripts", "*.up.sql")
+FAKE_SCANNER    = os.path.join(BENCH_DIR, "fake_scanner.py")
+
+SERVICES        = ("defectdojo", "gitlab", "registry", "rocket")
+STAGES          = ("clone", "scan", "upload", "notify")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="end-to-end orchestrator benchmark against local fakes")
+    parser.add_argument("--targets", type=int, nargs="+", default=[10, 100, 1000], help="inventory sizes, projects plus images")
+    parser.add_argument("--images-per-project", type=int, default=1)
+    parser.add_argument("--teams", type=int, default=5, help="distinct teams, each gets its own rocket digest")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per fake API call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of fake API calls failing with 503")
+    parser.add_argument("--scan-seconds", type=float, default=0.5, help="simulated time per scanner run")
+    parser.add_argument("--findings", type=int, default=50, help="findings per generated report")
+    parser.add_argument("--repo-files", type=int, default=20, help="files in the cloned repository")
+    parser.add_argument("--sca", action="store_true", help="mark the project trivy scanner as SCA (all projects share manifests)")
+    parser.add_argument("--db-url", help="admin DSN to create a throwaway database in, default starts a local postgres")
+    parser.add_argument("--output", help="write results as json, e.g. to compare against a baseline")
+    parser.add_argument("--keep", action="store_true", help="keep work directories, traces and logs")
+    # internal: run a single size in this process
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: list[float], pct: int) -> float | None:
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[pct - 1]
+
+
+# ------------------------------------------------------------
+# Fixtures
+# ------------------------------------------------------------
+
+def make_tls_cert(workdir: str) -> tuple[str, str]:
+    cert, key = os.path.join(workdir, "registry.crt"), os.path.join(workdir, "registry.key")
+    subprocess.run([
+        "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+        "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1",
+        "-keyout", key, "-out", cert
+    ], check=True, capture_output=True)
+    return cert, key
+
+
+def make_git_template(workdir: str, files: int) -> str:
+    work, bare = os.path.join(workdir, "git-work"), os.path.join(workdir, "git-template")
+    git = ["git", "-c", "user.name=bench", "-c", "user.email=bench@localhost", "-c", "init.defaultBranch=main"]
+
+    os.makedirs(os.path.join(work, "src"))
+    with open(os.path.join(work, "requirements.txt"), "w") as f:
+        f.write("aiohttp==3.9.0\nrequests==2.31.0\n")
+    for idx in range(files):
+        with open(os.path.join(work, "src", f"file_{idx}.py"), "w") as f:
+            f.write(f"def handler_{idx}(request):\n    return eval(request.args['q'])\n" * 20)
+
+    subprocess.run(git + ["init", "-q", work], check=True)
+    subprocess.run(git + ["-C", work, "add", "."], check=True)
+    subprocess.run(git + ["-C", work, "commit", "-q", "-m", "bench"], check=True)
+    subprocess.run(git + ["clone", "-q", "--bare", work, bare], check=True)
+    # packed objects and server info make the repository clonable over dumb http
+    subprocess.run(git + ["-C", bare, "repack", "-a", "-d", "-q"], check=True)
+    subprocess.run(git + ["-C", bare, "update-server-info"], check=True)
+    shutil.rmtree(work)
+    return bare
+
+
+def make_shims(workdir: str) -> str:
+    # scan_image prefixes scans with `docker login`, the sca cache asks `trivy version`
+    bin_dir = os.path.join(workdir, "bin")
+    os.makedirs(bin_dir)
+    shims = {
+        "docker":   f'exec "{sys.executable}" "{FAKE_SCANNER}" login\n',
+        "trivy":    f'[ "$1" = version ] && exec "{sys.executable}" "{FAKE_SCANNER}" version\n'
+                    f'exec "{sys.executable}" "{FAKE_SCANNER}" trivy "$@"\n',
+    }
+    for name, body in shims.items():
+        path = os.path.join(bin_dir, name)
+        with open(path, "w") as f:
+            f.write("#!/bin/sh\n" + body)
+        os.chmod(path, 0o755)
+    return bin_dir
+
+
+def scanner_commands(sca: bool) -> dict[str, str]:
+    fake = f'"{sys.executable}" "{FAKE_SCANNER}"'
+    return {
+        "trivy-fs":     f"PROJECT: {fake} trivy {{PROJECT_PATH}} {{OUTPUT_PATH}}\nDD_SCAN_TYPE: Trivy Scan\nSCA: {str(sca).lower()}",
+        "semgrep":      f"PROJECT: {fake} semgrep {{PROJECT_PATH}} {{OUTPUT_PATH}}\nDD_SCAN_TYPE: Semgrep JSON Report",
+        "trivy-image":  f"IMAGE: {fake} trivy {{IMAGE_URL}} {{OUTPUT_PATH}}\nDD_SCAN_TYPE: Trivy Scan",
+    }
+
+
+def write_projects_config(workdir: str, projects: int, teams: int) -> None:
+    os.makedirs(os.path.join(workdir, "config"))
+    with open(os.path.join(workdir, "config", "projects.json"), "w") as f:
+        json.dump([{
+            "gitlab_url":           fakes.project_url(project_id),
+            "gitlab_branch":        "main",
+            "public_url":           "",
+            "dast_params":          "",
+            "team":                 f"bench-team-{project_id % teams}",
+            "scan_interval_days":   0,
+        } for project_id in range(1, projects + 1)], f)
+
+
+@asynccontextmanager
+async def throwaway_postgres(workdir: str, admin_url: str | None):
+    import asyncpg
+
+    if admin_url:
+        name = f"bench_{uuid.uuid4().hex[:12]}"
+        admin = await asyncpg.connect(admin_url)
+        await admin.execute(f"CREATE DATABASE {name}")
+        try:
+            yield admin_url.rsplit("/", 1)[0] + f"/{name}"
+        finally:
+            await admin.execute(f"DROP DATABASE IF EXISTS {name} WITH (FORCE)")
+            await admin.close()
+        return
+
+    bin_dirs = sorted(glob.glob("/usr/lib/postgresql/*/bin"), reverse=True)
+    initdb = shutil.which("initdb") or next((os.path.join(d, "initdb") for d in bin_dirs), None)
+    if not initdb or not os.path.exists(initdb):
+        raise SystemExit("no postgres found: install initdb/pg_ctl or pass --db-url")
+    pg_ctl = os.path.join(os.path.dirname(initdb), "pg_ctl")
+
+    data_dir, port = os.path.join(workdir, "pgdata"), free_port()
+    subprocess.run([initdb, "-D", data_dir, "-U", "postgres", "--auth=trust"], check=True, capture_output=True)
+    # durability is irrelevant here, only the query path is measured
+    options = f"-p {port} -k {data_dir} -c listen_addresses=127.0.0.1 -c fsync=off -c synchronous_commit=off -c full_page_writes=off"
+    subprocess.run([pg_ctl, "-D", data_dir, "-o", options, "-l", os.path.join(workdir, "postgres.log"), "-w", "start"],
+                   check=True, capture_output=True)
+    try:
+        yield f"postgresql://postgres@127.0.0.1:{port}/postgres"
+    finally:
+        subprocess.run([pg_ctl, "-D", data_dir, "-m", "immediate", "stop"], capture_output=True)
+
+
+async def apply_migrations(dsn: str) -> None:
+    import asyncpg
+
+    conn = await asyncpg.connect(dsn)
+    try:
+        for path in sorted(glob.glob(MIGRATIONS_GLOB)):
+            with open(path) as f:
+                await conn.execute(f.read())
+    finally:
+        await conn.close()
+
+
+# ------------------------------------------------------------
+# Single size, runs in its own process
+# ------------------------------------------------------------
+
+async def run_child(args: argparse.Namespace) -> dict:
+    workdir = args.workdir
+    os.chdir(workdir)
+
+    projects = max(1, args.child // (1 + args.images_per_project))
+    ports = {service: free_port() for service in SERVICES}
+    registry_host = f"127.0.0.1:{ports['registry']}"
+
+    write_projects_config(workdir, projects, args.teams)
+    os.environ["PATH"] = make_shims(workdir) + os.pathsep + os.environ["PATH"]
+    options = fakes.FakeOptions(
+        projects            = projects,
+        images_per_project  = args.images_per_project,
+        latency             = args.latency,
+        error_rate          = args.error_rate,
+        findings_count      = args.findings,
+        registry_host       = registry_host,
+        scanner_commands    = scanner_commands(args.sca),
+        git_template        = make_git_template(workdir, args.repo_files),
+    )
+
+    ready = multiprocessing.get_context("spawn").Event()
+    fakes_process = multiprocessing.get_context("spawn").Process(
+        target=fakes.run_forever,
+        args=(options, ports, os.environ["BENCH_TLS_CERT"], os.environ["BENCH_TLS_KEY"], ready),
+        daemon=True
+    )
+    fakes_process.start()
+    if not ready.wait(30):
+        raise SystemExit("fakes did not start")
+
+    sys.path.insert(0, SRC_DIR)
+    import main as entrypoint
+    from modules.db import Database
+    from modules.defectdojo import DefectDojo
+    from modules.git import Gitlab
+    from modules.main import Main
+    from modules.rocket import Rocket
+    from modules.scanner import ScannRunner
+    from modules.scheduler import Scheduler
+    from modules.workspace import Workspace
+
+    try:
+        async with throwaway_postgres(workdir, args.db_url) as dsn:
+            await apply_migrations(dsn)
+
+            rocket  = Rocket(f"http://127.0.0.1:{ports['rocket']}", "bench", "bench", "bench-room")
+            dd      = DefectDojo(f"http://127.0.0.1:{ports['defectdojo']}", "bench")
+            gitlab  = Gitlab(f"http://127.0.0.1:{ports['gitlab']}", "bench")
+            scanner = ScannRunner(f"http://127.0.0.1:{ports['gitlab']}", "bench",
+                                  {registry_host: {"user": "bench", "password": "bench"}})
+            db      = Database(dsn)
+            await db.connect()
+            await scanner.start()
+            workspace = Workspace(os.path.join(workdir, ".tmp"), reserve_bytes=0, default_bytes=64 * 1024 ** 2)
+            m = Main(dd, gitlab, scanner, db, rocket, Scheduler(), workspace, "bench-runner", f"bench-{uuid.uuid4().hex[:8]}")
+
+            started_at = time.perf_counter()
+            try:
+                await entrypoint.run_cycle(m, db)
+            finally:
+                wall = time.perf_counter() - started_at
+                m.close()
+                await scanner.close()
+                await rocket.close()
+                await dd.close()
+                await gitlab.close()
+                await db.close()
+        children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    finally:
+        fakes_process.terminate()
+        fakes_process.join()
+
+    return summarize(args.child, projects, wall, children_rss)
+
+
+def summarize(size: int, projects: int, wall: float, children_rss: int) -> dict:
+    events = []
+    for path in glob.glob(os.path.join(os.environ["TRACE_DIR"], "*.json")):
+        with open(path) as f:
+            events.extend(json.load(f)["traceEvents"])
+
+    targets = [e for e in events if e.get("cat") == "target"]
+    finished = [e for e in targets if "error" not in e["args"]]
+    stages = {stage: [e["dur"] / 1e6 for e in events if e.get("cat") == "stage" and e["name"] == stage] for stage in STAGES}
+    http = [e for e in events if e.get("cat") == "http"]
+
+    return {
+        "targets":          size,
+        "projects":         projects,
+        "processed":        len(finished),
+        "failed":           len(targets) - len(finished),
+        "wall_seconds":     round(wall, 2),
+        "targets_per_hour": round(len(finished) / wall * 3600, 1) if wall else None,
+        "stages": {
+            stage: {"p50": percentile(values, 50), "p99": percentile(values, 99), "count": len(values)}
+            for stage, values in stages.items()
+        },
+        "target_p50":       percentile([e["dur"] / 1e6 for e in finished], 50),
+        "target_p99":       percentile([e["dur"] / 1e6 for e in finished], 99),
+        "http_calls":       len(http),
+        "http_errors":      sum(1 for e in http if not str(e["args"].get("status", "")).startswith("2")),
+        # ru_maxrss is in kilobytes on linux
+        "peak_rss_mb":          round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "peak_rss_children_mb": round(children_rss / 1024, 1),
+    }
+
+
+# ------------------------------------------------------------
+# Driver
+# ------------------------------------------------------------
+
+def run_size(args: argparse.Namespace, size: int, cert: str, key: str) -> dict | None:
+    workdir = tempfile.mkdtemp(prefix=f"cm-bench-{size}-")
+    result_path = os.path.join(workdir, "result.json")
+    log_path = os.path.join(workdir, "run.log")
+
+    env = dict(
+        os.environ,
+        LOG_LEVEL       = "warning",
+        TRACE_DIR       = os.path.join(workdir, "traces"),
+        SSL_CERT_FILE   = cert,
+        BENCH_TLS_CERT  = cert,
+        BENCH_TLS_KEY   = key,
+        BENCH_SCAN_SECONDS  = str(args.scan_seconds),
+        BENCH_FINDINGS      = str(args.findings),
+        BENCH_RESULT        = result_path,
+    )
+    command = [sys.executable, os.path.abspath(__file__), "--child", str(size), "--workdir", workdir] + forwarded_args(args)
+
+    try:
+        with open(log_path, "w") as log:
+            process = subprocess.run(command, env=env, stdout=log, stderr=subprocess.STDOUT)
+        if process.returncode != 0 or not os.path.exists(result_path):
+            print(f"size {size} failed with exit code {process.returncode}, log: {log_path}", file=sys.stderr)
+            args.keep = True
+            return None
+        with open(result_path) as f:
+            return json.load(f)
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+        else:
+            print(f"size {size}: work directory kept at {workdir}", file=sys.stderr)
+
+
+def forwarded_args(args: argparse.Namespace) -> list[str]:
+    forwarded = [
+        "--images-per-project", str(args.images_per_project),
+        "--teams", str(args.teams),
+        "--latency", str(args.latency),
+        "--error-rate", str(args.error_rate),
+        "--scan-seconds", str(args.scan_seconds),
+        "--findings", str(args.findings),
+        "--repo-files", str(args.repo_files),
+    ]
+    if args.sca:
+        forwarded.append("--sca")
+    if args.db_url:
+        forwarded += ["--db-url", args.db_url]
+    return forwarded
+
+
+def print_table(results: list[dict]) -> None:
+    def fmt(value: float | None) -> str:
+        return "-" if value == None else f"{value:.2f}"
+
+    header = ["targets", "done", "failed", "wall s", "targets/h"] + [f"{s} p50/p99 s" for s in STAGES] + ["http calls/err", "rss MB self/children"]
+    rows = []
+    for r in results:
+        rows.append([
+            str(r["targets"]), str(r["processed"]), str(r["failed"]), fmt(r["wall_seconds"]), fmt(r["targets_per_hour"]),
+            *[f"{fmt(r['stages'][s]['p50'])}/{fmt(r['stages'][s]['p99'])}" for s in STAGES],
+            f"{r['http_calls']}/{r['http_errors']}", f"{r['peak_rss_mb']}/{r['peak_rss_children_mb']}",
+        ])
+
+    widths = [max(len(row[idx]) for row in [header] + rows) for idx in range(len(header))]
+    for row in [header] + rows:
+        print("  ".join(cell.rjust(width) for cell, width in zip(row, widths)))
+
+
+def main() -> None:
+    args = parse_args()
+
+    if args.child:
+        result = asyncio.run(run_child(args))
+        with open(os.environ["BENCH_RESULT"], "w") as f:
+            json.dump(result, f)
+        return
+
+    certs_dir = tempfile.mkdtemp(prefix="cm-bench-tls-")
+    try:
+        cert, key = make_tls_cert(certs_dir)
+        results = [result for size in args.targets if (result := run_size(args, size, cert, key))]
+    finally:
+        shutil.rmtree(certs_dir, ignore_errors=True)
+
+    print_table(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"options": {k: v for k, v in vars(args).items() if k not in ("child", "workdir")}, "results": results}, f, indent=2)
+
+    if len(results) != len(args.targets):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
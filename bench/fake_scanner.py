@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+import hashlib
+import json
+import os
+import random
+import sys
+import time
+
+# stands in for trivy, semgrep and docker during benchmarks:
+#   fake_scanner.py trivy|semgrep <target> <output path>
+#   fake_scanner.py version         (as `trivy version --format json`)
+#   fake_scanner.py login           (as `docker login`)
+# BENCH_SCAN_SECONDS sets the simulated scan time, BENCH_FINDINGS the findings per report
+
+SEVERITIES_TRIVY    = ["LOW", "MEDIUM", "HIGH", "CRITICAL"]
+SEVERITIES_SEMGREP  = ["INFO", "WARNING", "ERROR"]
+
+
+def trivy_report(rng: random.Random, target: str, findings: int) -> dict:
+    return {
+        "SchemaVersion": 2,
+        "ArtifactName": target,
+        "Results": [{
+            "Target": "requirements.txt",
+            "Class": "lang-pkgs",
+            "Packages": [{"Name": f"pkg-{idx}", "Version": "1.0.0"} for idx in range(findings)],
+            "Vulnerabilities": [{
+                "VulnerabilityID":  f"CVE-2024-{rng.randrange(10000, 99999)}",
+                "PkgName":          f"pkg-{idx}",
+                "InstalledVersion": "1.0.0",
+                "FixedVersion":     "1.0.1",
+                "Severity":         rng.choice(SEVERITIES_TRIVY),
+                "Title":            "benchmark finding",
+                "Description":      "x" * rng.randrange(200, 2000),
+                "DataSource":       {"ID": "bench", "Name": "bench"},
+            } for idx in range(findings)],
+        }],
+    }
+
+def semgrep_report(rng: random.Random, target: str, findings: int) -> dict:
+    return {
+        "results": [{
+            "check_id": f"bench.rules.rule-{rng.randrange(50)}",
+            "path":     f"src/file_{idx}.py",
+            "start":    {"line": rng.randrange(1, 500), "col": 1},
+            "end":      {"line": rng.randrange(500, 600), "col": 1},
+            "extra":    {
+                "severity":         rng.choice(SEVERITIES_SEMGREP),
+                "message":          "benchmark finding",
+                "lines":            "x" * rng.randrange(40, 400),
+                "dataflow_trace":   {"taint_source": ["x" * 100]},
+            },
+        } for idx in range(findings)],
+        "errors": [],
+    }
+
+
+def main(argv: list[str]) -> int:
+    if argv[:1] == ["version"]:
+        print(json.dumps({"Version": "0.0.0-bench", "VulnerabilityDB": {"UpdatedAt": "2024-01-01T00:00:00Z"}}))
+        return 0
+    if argv[:1] == ["login"]:
+        return 0
+
+    kind, target, output = argv
+    time.sleep(float(os.getenv("BENCH_SCAN_SECONDS", "1")) * random.uniform(0.5, 1.5))
+
+    # same target, same findings, so repeated runs exercise unchanged-report paths
+    rng = random.Random(hashlib.sha256(f"{kind}:{os.path.basename(target.rstrip('/'))}".encode()).digest())
+    findings = int(os.getenv("BENCH_FINDINGS", "50"))
+    report = trivy_report(rng, target, findings) if kind == "trivy" else semgrep_report(rng, target, findings)
+
+    with open(output, "w") as f:
+        json.dump(report, f)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,211 @@
+import asyncio
+import hashlib
+import os
+import random
+import ssl
+from dataclasses import dataclass
+from aiohttp import web
+
+# local stand-ins for the external services the orchestrator talks to,
+# shaped after the endpoints modules/ actually calls
+
+SCANNERS_CONFIG_REPO    = 5425
+SCANNERS_COMMIT         = "0000000000000000000000000000000000bench"
+OLD_UPDATE              = "2000-01-01T00:00:00.000000Z"
+
+
+@dataclass
+class FakeOptions:
+    projects:           int
+    images_per_project: int
+    latency:            float   # seconds per API call, jittered +-50%
+    error_rate:         float   # share of API calls answered with 503
+    findings_count:     int
+    registry_host:      str
+    scanner_commands:   dict[str, str]
+    git_template:       str     # bare repository every project clones
+
+
+def project_url(project_id: int) -> str:
+    return f"bench/project-{project_id}"
+
+def image_url(registry_host: str, project_id: int, image_idx: int) -> str:
+    return f"{registry_host}/bench/app-{project_id}-{image_idx}"
+
+def image_engagement_id(project_id: int, image_idx: int) -> int:
+    return project_id * 1000 + image_idx
+
+
+def _fault_middleware(options: FakeOptions, exempt_prefixes: tuple[str, ...] = ()):
+    @web.middleware
+    async def middleware(request: web.Request, handler):
+        if request.path.startswith(exempt_prefixes):
+            return await handler(request)
+        if options.latency:
+            await asyncio.sleep(options.latency * random.uniform(0.5, 1.5))
+        if options.error_rate and random.random() < options.error_rate:
+            return web.json_response({"detail": "injected failure"}, status=503)
+        return await handler(request)
+    return middleware
+
+
+def _page(results: list) -> web.Response:
+    return web.json_response({"count": len(results), "next": None, "previous": None, "results": results})
+
+
+def defectdojo_app(options: FakeOptions) -> web.Application:
+    test_ids = iter(range(1, 1 << 62))
+
+    def engagements(product_id: int) -> list[dict]:
+        results = [{"id": product_id * 1000, "name": "prod_app", "branch_tag": "main", "updated": OLD_UPDATE}]
+        for image_idx in range(1, options.images_per_project + 1):
+            results.append({
+                "id":           image_engagement_id(product_id, image_idx),
+                "name":         f"prod_trivy_{image_url(options.registry_host, product_id, image_idx)}",
+                "branch_tag":   None,
+                "updated":      OLD_UPDATE,
+            })
+        return results
+
+    async def products(request: web.Request) -> web.Response:
+        name = request.query.get("name", "")
+        prefix = project_url(0)[:-1]
+        if not name.startswith(prefix) or not name[len(prefix):].isdigit() or int(name[len(prefix):]) > options.projects:
+            return _page([])
+        return _page([{"id": int(name[len(prefix):]), "name": name}])
+
+    async def product(request: web.Request) -> web.Response:
+        return web.json_response({"id": int(request.match_info["id"]), "findings_count": options.findings_count})
+
+    async def engagements_list(request: web.Request) -> web.Response:
+        return _page(engagements(int(request.query.get("product", 0))))
+
+    async def endpoints(request: web.Request) -> web.Response:
+        product_id = int(request.query.get("product", 0))
+        return _page([{"id": product_id, "protocol": "https", "host": f"project-{product_id}.bench"}])
+
+    async def tests(request: web.Request) -> web.Response:
+        return _page([])
+
+    async def import_scan(request: web.Request) -> web.Response:
+        # the upload is read in full, as DefectDojo would before parsing it
+        form = await request.post()
+        report = form.get("file")
+        size = len(report.file.read()) if report is not None else 0
+        test_id = int(form.get("test", 0)) or next(test_ids)
+        return web.json_response({"test_id": test_id, "scan_type": form.get("scan_type"), "size": size}, status=201)
+
+    app = web.Application(middlewares=[_fault_middleware(options)], client_max_size=1024 ** 3)
+    app.add_routes([
+        web.get("/api/v2/products", products),
+        web.get("/api/v2/products/{id}", product),
+        web.get("/api/v2/engagements", engagements_list),
+        web.get("/api/v2/endpoints", endpoints),
+        web.get("/api/v2/tests", tests),
+        web.post("/api/v2/import-scan/", import_scan),
+        web.post("/api/v2/reimport-scan/", import_scan),
+    ])
+    return app
+
+
+def gitlab_app(options: FakeOptions) -> web.Application:
+    scanner_files = {f"{name}.txt": content for name, content in options.scanner_commands.items()}
+
+    async def commits(request: web.Request) -> web.Response:
+        return web.json_response([{"id": SCANNERS_COMMIT}])
+
+    async def tree(request: web.Request) -> web.Response:
+        return web.json_response([{"path": path, "type": "blob"} for path in sorted(scanner_files)])
+
+    async def raw_file(request: web.Request) -> web.Response:
+        content = scanner_files.get(request.match_info["path"])
+        if content == None:
+            return web.Response(status=404)
+        return web.Response(text=content)
+
+    async def pipelines(request: web.Request) -> web.Response:
+        return web.json_response([])
+
+    async def git_dumb_http(request: web.Request) -> web.StreamResponse:
+        # every project is served from the same bare repository over git's dumb http protocol
+        path = os.path.normpath(os.path.join(options.git_template, request.match_info["path"]))
+        if not path.startswith(options.git_template) or not os.path.isfile(path):
+            return web.Response(status=404)
+        if request.match_info["path"] == "info/refs" and options.latency:
+            await asyncio.sleep(options.latency * random.uniform(0.5, 1.5))
+        return web.FileResponse(path, headers={"Content-Type": "application/octet-stream"})
+
+    app = web.Application(middlewares=[_fault_middleware(options, exempt_prefixes=("/bench/",))])
+    app.add_routes([
+        web.get(f"/api/v4/projects/{SCANNERS_CONFIG_REPO}/repository/commits", commits),
+        web.get(f"/api/v4/projects/{SCANNERS_CONFIG_REPO}/repository/tree", tree),
+        web.get(f"/api/v4/projects/{SCANNERS_CONFIG_REPO}/repository/files/{{path}}/raw", raw_file),
+        web.get("/projects/{project:.+}/pipelines", pipelines),
+        web.get(r"/bench/{project:[^/]+}/{path:(HEAD|info/refs|objects/.+)}", git_dumb_http),
+    ])
+    return app
+
+
+def registry_app(options: FakeOptions) -> web.Application:
+    async def tags(request: web.Request) -> web.Response:
+        return web.json_response({"name": request.match_info["image"], "tags": ["latest"]})
+
+    async def manifest(request: web.Request) -> web.Response:
+        image = request.match_info["image"]
+        digest = "sha256:" + hashlib.sha256(image.encode()).hexdigest()
+        return web.json_response(
+            {"schemaVersion": 2, "history": [{"v1Compatibility": '{"created": "2024-01-01T00:00:00Z"}'}]},
+            headers={"Docker-Content-Digest": digest}
+        )
+
+    async def harbor_tags(request: web.Request) -> web.Response:
+        return web.json_response([{"name": request.match_info["tag"], "push_time": "2024-01-01T00:00:00.000Z"}])
+
+    app = web.Application(middlewares=[_fault_middleware(options)])
+    app.add_routes([
+        web.get("/v2/{image:.+}/tags/list", tags),
+        web.get("/v2/{image:.+}/manifests/{tag}", manifest),
+        web.get("/api/v2.0/projects/{project}/repositories/{repository}/artifacts/{tag}/tags", harbor_tags),
+    ])
+    return app
+
+
+def rocket_app(options: FakeOptions) -> web.Application:
+    async def post_message(request: web.Request) -> web.Response:
+        body = await request.json()
+        return web.json_response({"success": True, "message": {"_id": hashlib.md5(body.get("text", "").encode()).hexdigest()}})
+
+    app = web.Application(middlewares=[_fault_middleware(options)])
+    app.add_routes([web.post("/api/v1/chat.postMessage", post_message)])
+    return app
+
+
+async def serve(options: FakeOptions, ports: dict[str, int], tls_cert: str, tls_key: str) -> list[web.AppRunner]:
+    registry_ssl = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    registry_ssl.load_cert_chain(tls_cert, tls_key)
+
+    apps = {
+        "defectdojo":   (defectdojo_app(options), None),
+        "gitlab":       (gitlab_app(options), None),
+        # the scanner only speaks https to registries
+        "registry":     (registry_app(options), registry_ssl),
+        "rocket":       (rocket_app(options), None),
+    }
+
+    runners = []
+    for name, (app, ssl_context) in apps.items():
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", ports[name], ssl_context=ssl_context).start()
+        runners.append(runner)
+    return runners
+
+
+def run_forever(options: FakeOptions, ports: dict[str, int], tls_cert: str, tls_key: str, ready) -> None:
+    # entry point of the fakes process, keeps their cpu off the measured event loop
+    async def main() -> None:
+        await serve(options, ports, tls_cert, tls_key)
+        ready.set()
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
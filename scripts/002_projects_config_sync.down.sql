@@ -0,0 +1,2 @@
+ALTER TABLE IF EXISTS projects DROP COLUMN IF EXISTS synced_at;
+ALTER TABLE IF EXISTS projects DROP COLUMN IF EXISTS config_hash;
\ No newline at end of file
@@ -0,0 +1,2 @@
+ALTER TABLE projects ADD COLUMN IF NOT EXISTS config_hash    TEXT        NULL;
+ALTER TABLE projects ADD COLUMN IF NOT EXISTS synced_at      TIMESTAMP   NULL;
\ No newline at end of file
@@ -0,0 +1,7 @@
+ALTER TABLE IF EXISTS images DROP COLUMN IF EXISTS last_run_id;
+ALTER TABLE IF EXISTS images DROP COLUMN IF EXISTS leased_until;
+ALTER TABLE IF EXISTS images DROP COLUMN IF EXISTS leased_by;
+
+ALTER TABLE IF EXISTS projects DROP COLUMN IF EXISTS last_run_id;
+ALTER TABLE IF EXISTS projects DROP COLUMN IF EXISTS leased_until;
+ALTER TABLE IF EXISTS projects DROP COLUMN IF EXISTS leased_by;
\ No newline at end of file
@@ -0,0 +1,7 @@
+ALTER TABLE projects ADD COLUMN IF NOT EXISTS leased_by      TEXT        NULL;
+ALTER TABLE projects ADD COLUMN IF NOT EXISTS leased_until   TIMESTAMPTZ NULL;
+ALTER TABLE projects ADD COLUMN IF NOT EXISTS last_run_id    TEXT        NULL;
+
+ALTER TABLE images ADD COLUMN IF NOT EXISTS leased_by        TEXT        NULL;
+ALTER TABLE images ADD COLUMN IF NOT EXISTS leased_until     TIMESTAMPTZ NULL;
+ALTER TABLE images ADD COLUMN IF NOT EXISTS last_run_id      TEXT        NULL;
\ No newline at end of file
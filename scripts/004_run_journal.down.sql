@@ -0,0 +1 @@
+DROP TABLE IF EXISTS run_journal;
\ No newline at end of file
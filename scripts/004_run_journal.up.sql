@@ -0,0 +1,8 @@
+CREATE TABLE IF NOT EXISTS run_journal (
+    run_id          TEXT        NOT NULL,
+    target_type     TEXT        NOT NULL,
+    target_id       BIGINT      NOT NULL,
+    stage           TEXT        NOT NULL,
+    updated_at      TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (run_id, target_type, target_id)
+);
\ No newline at end of file
@@ -0,0 +1,5 @@
+ALTER TABLE IF EXISTS images DROP COLUMN IF EXISTS findings_count;
+ALTER TABLE IF EXISTS images DROP COLUMN IF EXISTS scan_interval_days;
+
+ALTER TABLE IF EXISTS projects DROP COLUMN IF EXISTS findings_count;
+ALTER TABLE IF EXISTS projects DROP COLUMN IF EXISTS scan_interval_days;
\ No newline at end of file
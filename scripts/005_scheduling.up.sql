@@ -0,0 +1,5 @@
+ALTER TABLE projects ADD COLUMN IF NOT EXISTS scan_interval_days INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE projects ADD COLUMN IF NOT EXISTS findings_count     INTEGER NULL;
+
+ALTER TABLE images ADD COLUMN IF NOT EXISTS scan_interval_days   INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE images ADD COLUMN IF NOT EXISTS findings_count       INTEGER NULL;
\ No newline at end of file
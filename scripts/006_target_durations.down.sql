@@ -0,0 +1,7 @@
+ALTER TABLE IF EXISTS images DROP COLUMN IF EXISTS upload_seconds;
+ALTER TABLE IF EXISTS images DROP COLUMN IF EXISTS scan_seconds;
+ALTER TABLE IF EXISTS images DROP COLUMN IF EXISTS clone_seconds;
+
+ALTER TABLE IF EXISTS projects DROP COLUMN IF EXISTS upload_seconds;
+ALTER TABLE IF EXISTS projects DROP COLUMN IF EXISTS scan_seconds;
+ALTER TABLE IF EXISTS projects DROP COLUMN IF EXISTS clone_seconds;
\ No newline at end of file
@@ -0,0 +1,7 @@
+ALTER TABLE projects ADD COLUMN IF NOT EXISTS clone_seconds  REAL        NULL;
+ALTER TABLE projects ADD COLUMN IF NOT EXISTS scan_seconds   REAL        NULL;
+ALTER TABLE projects ADD COLUMN IF NOT EXISTS upload_seconds REAL        NULL;
+
+ALTER TABLE images ADD COLUMN IF NOT EXISTS clone_seconds    REAL        NULL;
+ALTER TABLE images ADD COLUMN IF NOT EXISTS scan_seconds     REAL        NULL;
+ALTER TABLE images ADD COLUMN IF NOT EXISTS upload_seconds   REAL        NULL;
\ No newline at end of file
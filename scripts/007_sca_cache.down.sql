@@ -0,0 +1 @@
+DROP TABLE IF EXISTS sca_cache;
\ No newline at end of file
@@ -0,0 +1,5 @@
+CREATE TABLE IF NOT EXISTS sca_cache (
+    cache_key       TEXT        PRIMARY KEY,
+    report          BYTEA       NOT NULL,
+    created_at      TIMESTAMPTZ NOT NULL DEFAULT now()
+);
\ No newline at end of file
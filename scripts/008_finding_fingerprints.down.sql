@@ -0,0 +1 @@
+DROP TABLE IF EXISTS finding_fingerprints;
\ No newline at end of file
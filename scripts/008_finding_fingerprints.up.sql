@@ -0,0 +1,9 @@
+CREATE TABLE IF NOT EXISTS finding_fingerprints (
+    target_type     TEXT        NOT NULL,
+    target_id       BIGINT      NOT NULL,
+    scanner         TEXT        NOT NULL,
+    digest          TEXT        NOT NULL,
+    fingerprints    JSONB       NOT NULL,
+    updated_at      TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (target_type, target_id, scanner)
+);
\ No newline at end of file
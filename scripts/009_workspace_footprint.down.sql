@@ -0,0 +1,3 @@
+ALTER TABLE IF EXISTS images DROP COLUMN IF EXISTS workspace_bytes;
+
+ALTER TABLE IF EXISTS projects DROP COLUMN IF EXISTS workspace_bytes;
@@ -0,0 +1,3 @@
+ALTER TABLE projects ADD COLUMN IF NOT EXISTS workspace_bytes BIGINT      NULL;
+
+ALTER TABLE images ADD COLUMN IF NOT EXISTS workspace_bytes   BIGINT      NULL;
@@ -27,4 +27,7 @@ def execute_sql_script(script_path):
             conn.close()
 
 if __name__ == "__main__":
+    execute_sql_script("/scripts/008_finding_fingerprints.down.sql")
+    execute_sql_script("/scripts/007_sca_cache.down.sql")
+    execute_sql_script("/scripts/004_run_journal.down.sql")
     execute_sql_script("/scripts/001_drop_tables.down.sql")
@@ -28,3 +28,11 @@ def execute_sql_script(script_path):
 
 if __name__ == "__main__":
     execute_sql_script("/scripts/001_create_tables.up.sql")
+    execute_sql_script("/scripts/002_projects_config_sync.up.sql")
+    execute_sql_script("/scripts/003_work_leases.up.sql")
+    execute_sql_script("/scripts/004_run_journal.up.sql")
+    execute_sql_script("/scripts/005_scheduling.up.sql")
+    execute_sql_script("/scripts/006_target_durations.up.sql")
+    execute_sql_script("/scripts/007_sca_cache.up.sql")
+    execute_sql_script("/scripts/008_finding_fingerprints.up.sql")
+    execute_sql_script("/scripts/009_workspace_footprint.up.sql")
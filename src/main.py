@@ -1,7 +1,11 @@
 #!/usr/bin/env python3
+import argparse
 import asyncio
+from datetime import datetime, timedelta
 import json
 import os
+import socket
+import uuid
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -12,11 +16,85 @@ from modules.db import Database
 from modules.defectdojo import DefectDojo
 from modules.git import Gitlab
 from modules.scanner import ScannRunner
+from modules.backends import ScannerBackends
 from modules.rocket import Rocket
+from modules.scheduler import Scheduler
+from modules.workspace import Workspace
+from modules.daemon import Daemon
+from modules.webhooks import Webhooks
+from modules.logger import log, LEVEL_INFO, LEVEL_ERROR
+from modules.metrics import REGISTRY
+from modules.tracing import TRACER, span
 
 CONFIG_PROJECTS_FILEPATH    = "config/projects.json"
 
-async def main() -> None:
+# advisory lock keys, only one runner syncs inventory at a time
+LOCK_SYNC_PROJECTS          = 1001
+LOCK_REFRESH_PROJECTS       = 1002
+
+RUN_JOURNAL_RETENTION       = timedelta(days=7)
+SCA_CACHE_RETENTION         = timedelta(days=2)
+# repositories not scanned for this long lose their local object store
+OBJECT_STORE_RETENTION      = timedelta(days=7)
+
+WORKSPACE_PATH              = "./.tmp"
+# kept free for everything else on the runner, and assumed for targets never measured
+WORKSPACE_RESERVE_MB        = 2048
+WORKSPACE_DEFAULT_MB        = 1024
+WORKSPACE_TMPFS_MAX_MB      = 256
+
+SCANNER_CACHE_DIR           = "./.cache/runtimes"
+SCANNER_CACHE_REFRESH_HOURS = 6
+
+DAEMON_POLL_SECONDS         = 300
+DAEMON_HOST                 = "127.0.0.1"
+DAEMON_PORT                 = 8080
+WEBHOOK_DEBOUNCE_SECONDS    = 120
+
+async def refresh_projects(m: Main, db: Database) -> None:
+    async with db.advisory_lock(LOCK_REFRESH_PROJECTS) as locked:
+        if locked:
+            await m.refresh_projects()
+
+async def run_cycle(m: Main, db: Database) -> None:
+    try:
+        await scan_cycle(m, db)
+    finally:
+        # one timeline per run, spans of webhook scans in between land in the next one
+        if TRACER.enabled:
+            TRACER.dump(os.path.join(os.getenv("TRACE_DIR"), f"{m.run_id}-{datetime.now():%H%M%S}.json"))
+
+async def scan_cycle(m: Main, db: Database) -> None:
+    projects_from_config = ProjectConfig.from_file(CONFIG_PROJECTS_FILEPATH)
+    async with db.advisory_lock(LOCK_SYNC_PROJECTS) as locked:
+        if locked:
+            with span("sync projects", "cycle"):
+                await m.sync_projects_with_db(projects_from_config)
+                await db.purge_journal(RUN_JOURNAL_RETENTION)
+                await db.purge_sca_cache(SCA_CACHE_RETENTION)
+    
+    # object stores are local to each runner, no lock needed
+    m.gitlab.purge_object_stores(OBJECT_STORE_RETENTION)
+    m.dd.reset_caches(m.run_id)
+
+    # images/engagements refresh runs alongside project scans,
+    # image scans need it finished
+    refresh_task = asyncio.create_task(refresh_projects(m, db))
+
+    try:
+        with span("load scanners", "cycle"):
+            await m.scanner.load_scanners()
+        with span("process projects", "cycle"):
+            await m.process_projects_from_db()
+        await refresh_task
+        with span("process images", "cycle"):
+            await m.process_images_from_db()
+    finally:
+        # targets finished before a failure are still reported, and journaled as notified
+        with span("notify", "cycle"):
+            await m.flush_notifications(m.run_id)
+
+async def main(args: argparse.Namespace) -> None:
     dd_host     = os.getenv("DD_HOST")
     dd_token    = os.getenv("DD_TOKEN")
     git_host    = os.getenv("GIT_HOST")
@@ -28,6 +106,16 @@ async def main() -> None:
     rocket_password = os.getenv("ROCKET_PASSWORD")
     rocket_chat_id = os.getenv("ROCKET_CHAT_ID")
 
+    # runners of the same pipeline share run_id and split its inventory
+    run_id      = os.getenv("RUN_ID") or os.getenv("CI_PIPELINE_ID") or uuid.uuid4().hex
+    # a runner slot survives restarts and job retries, each process adds its own suffix
+    runner_slot = f"{os.getenv('CI_PIPELINE_ID')}-{os.getenv('CI_NODE_INDEX', '1')}" if os.getenv("CI_PIPELINE_ID") else socket.gethostname()
+    runner_id   = f"{runner_slot}/{uuid.uuid4().hex[:8]}"
+
+    # scans still running at the deadline are cancelled and left for the next run
+    run_deadline_minutes = os.getenv("RUN_DEADLINE_MINUTES")
+    run_deadline = datetime.now() + timedelta(minutes=int(run_deadline_minutes)) if run_deadline_minutes and not args.daemon else None
+
     registries_credentials = os.getenv("REGISTRIES_CREDENTIALS")
     registries_credentials = json.loads(registries_credentials) if registries_credentials != "" else {}
 
@@ -36,28 +124,74 @@ async def main() -> None:
     
     projects_from_config = ProjectConfig.from_file(CONFIG_PROJECTS_FILEPATH)
     if len(projects_from_config) == 0:
-        print("no projects to be scanned, exit")
+        log(LEVEL_INFO, "main", "no projects to be scanned, exit")
         return
 
     rocket  = Rocket(rocket_host, rocket_username, rocket_password, rocket_chat_id)
-    dd      = DefectDojo(dd_host, dd_token)
-    gitlab  = Gitlab(git_host, git_token)
-    scanner = ScannRunner(git_host, git_token, registries_credentials)
+    dd      = DefectDojo(dd_host, dd_token, reimport=os.getenv("DD_REIMPORT", "").lower() == "true")
+    # object stores only pay off for a long-lived daemon, CI runners start from an empty disk
+    gitlab  = Gitlab(git_host, git_token, os.path.join(WORKSPACE_PATH, "repos") if args.daemon else None)
+    backends = ScannerBackends(
+        os.getenv("SCANNER_CACHE_DIR") or SCANNER_CACHE_DIR,
+        trivy_server        = os.getenv("SCANNER_TRIVY_SERVER", "").lower() == "true",
+        semgrep_packs       = [pack.strip() for pack in os.getenv("SCANNER_SEMGREP_RULE_PACKS", "").split(",") if pack.strip()],
+        refresh_interval    = float(os.getenv("SCANNER_CACHE_REFRESH_HOURS") or SCANNER_CACHE_REFRESH_HOURS) * 3600
+    )
+    scanner = ScannRunner(git_host, git_token, registries_credentials, backends)
     db      = Database(db_url)
     await db.connect()
+    await scanner.start()
 
-    m = Main(dd, gitlab, scanner, db, rocket)
-    await m.sync_projects_with_db(projects_from_config)
-    
-    await m.scanner.load_scanners()
-    await m.process_projects_from_db()
-    await m.process_images_from_db()
+    scheduler = Scheduler(run_deadline)
+    workspace = Workspace(
+        WORKSPACE_PATH,
+        reserve_bytes   = int(os.getenv("WORKSPACE_RESERVE_MB", WORKSPACE_RESERVE_MB)) * 1024 ** 2,
+        default_bytes   = int(os.getenv("WORKSPACE_DEFAULT_MB", WORKSPACE_DEFAULT_MB)) * 1024 ** 2,
+        tmpfs_path      = os.getenv("WORKSPACE_TMPFS_PATH") or None,
+        tmpfs_max_bytes = int(os.getenv("WORKSPACE_TMPFS_MAX_MB", WORKSPACE_TMPFS_MAX_MB)) * 1024 ** 2
+    )
 
-    await db.close()
+    m = Main(dd, gitlab, scanner, db, rocket, scheduler, workspace, runner_id, run_id)
+    await m.recover_leases(f"{runner_slot}/")
+    try:
+        if args.daemon:
+            daemon = Daemon(
+                m,
+                lambda: run_cycle(m, db),
+                run_id_prefix   = os.getenv("RUN_ID") or socket.gethostname(),
+                poll_interval   = int(os.getenv("DAEMON_POLL_SECONDS", DAEMON_POLL_SECONDS)),
+                host            = os.getenv("DAEMON_HOST", DAEMON_HOST),
+                port            = int(os.getenv("DAEMON_PORT", DAEMON_PORT))
+            )
+            webhooks = Webhooks(
+                m,
+                debounce_seconds    = int(os.getenv("WEBHOOK_DEBOUNCE_SECONDS", WEBHOOK_DEBOUNCE_SECONDS)),
+                gitlab_secret       = os.getenv("GITLAB_WEBHOOK_SECRET"),
+                harbor_secret       = os.getenv("HARBOR_WEBHOOK_SECRET")
+            )
+            daemon.app.add_routes(webhooks.routes())
+            await daemon.run()
+        else:
+            await run_cycle(m, db)
+    finally:
+        # CI runs leave their metrics for the node_exporter textfile collector
+        metrics_textfile = os.getenv("METRICS_TEXTFILE")
+        if metrics_textfile and not args.daemon:
+            REGISTRY.write_textfile(metrics_textfile)
+        m.close()
+        await scanner.close()
+        await rocket.close()
+        await dd.close()
+        await gitlab.close()
+        await db.close()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="continuous monitoring")
+    parser.add_argument("--daemon", action="store_true", help="run as a long-lived service scanning on per-target intervals")
+    args = parser.parse_args()
+
     try:
-        asyncio.run(main())
+        asyncio.run(main(args))
     except Exception as e:
-        print(e)
+        log(LEVEL_ERROR, "main", str(e))
         exit(1)
\ No newline at end of file
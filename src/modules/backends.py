@@ -0,0 +1,143 @@
+import asyncio
+import os
+import socket
+import time
+import aiohttp
+
+from modules.logger import BaseLogger
+from modules.metrics import http_trace_config, SCANNER_BACKEND_UP
+
+
+class ScannerBackends(BaseLogger):
+    # rule packs are stored as plain files, scans read them instead of downloading
+    __SEMGREP_REGISTRY  = "https://semgrep.dev/c/{}"
+
+    __STARTUP_TIMEOUT   = 600   # seconds, a cold server downloads the vulnerability DB first
+    __WATCH_INTERVAL    = 30    # seconds between liveness checks of the server
+
+    def __init__(self, cache_dir: str, trivy_server: bool = False, semgrep_packs: list[str] | None = None,
+                 refresh_interval: float = 6 * 3600) -> None:
+        self.cache_dir          = os.path.abspath(cache_dir)
+        self.semgrep_rules_path = os.path.join(self.cache_dir, "semgrep")
+        self.__trivy_cache      = os.path.join(self.cache_dir, "trivy")
+        self.__trivy_server     = trivy_server
+        self.__semgrep_packs    = semgrep_packs or []
+        self.__refresh_interval = refresh_interval
+
+        self.__server: asyncio.subprocess.Process | None = None
+        self.__server_url: str | None = None
+        self.__maintainer: asyncio.Task | None = None
+        self.__rules_refreshed_at = 0.0
+
+    def env(self) -> dict[str, str]:
+        # every scanner subprocess shares the cache, trivy runs in client mode while the server is up
+        env = {
+            **os.environ,
+            "TRIVY_CACHE_DIR":              self.__trivy_cache,
+            "SEMGREP_ENABLE_VERSION_CHECK": "0",
+        }
+        if self.__server_url:
+            env["TRIVY_SERVER"] = self.__server_url
+        return env
+
+    async def start(self) -> None:
+        os.makedirs(self.__trivy_cache, exist_ok=True)
+        os.makedirs(self.semgrep_rules_path, exist_ok=True)
+
+        await self.__refresh_rules()
+        if self.__trivy_server:
+            await self.__start_server()
+        if self.__trivy_server or self.__semgrep_packs:
+            self.__maintainer = asyncio.create_task(self.__maintain())
+
+    async def close(self) -> None:
+        if self.__maintainer:
+            self.__maintainer.cancel()
+            self.__maintainer = None
+        await self.__stop_server()
+
+    async def __maintain(self) -> None:
+        # the server refreshes its vulnerability DB on its own, rules are refreshed here
+        while True:
+            await asyncio.sleep(self.__WATCH_INTERVAL)
+            if self.__trivy_server and (self.__server == None or self.__server.returncode != None):
+                self._log_err("trivy server is down, restarting")
+                await self.__stop_server()
+                await self.__start_server()
+            if time.monotonic() - self.__rules_refreshed_at >= self.__refresh_interval:
+                await self.__refresh_rules()
+
+    async def __start_server(self) -> None:
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+
+        try:
+            self.__server = await asyncio.create_subprocess_exec(
+                "trivy", "server", "--listen", f"127.0.0.1:{port}", "--cache-dir", self.__trivy_cache,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL,
+                env=self.env()
+            )
+        except OSError as e:
+            self._log_err(f"failed to start trivy server, scanning standalone: {e}")
+            self.__trivy_server = False
+            return
+
+        url = f"http://127.0.0.1:{port}"
+        deadline = time.monotonic() + self.__STARTUP_TIMEOUT
+        async with aiohttp.ClientSession() as session:
+            while time.monotonic() < deadline and self.__server.returncode == None:
+                try:
+                    async with session.get(f"{url}/healthz") as response:
+                        if response.status == 200:
+                            self.__server_url = url
+                            SCANNER_BACKEND_UP.set("trivy", value=1)
+                            self._log(f"trivy server listening on {url}")
+                            return
+                except aiohttp.ClientError:
+                    pass
+                await asyncio.sleep(1)
+
+        self._log_err("trivy server did not become healthy, scanning standalone")
+        await self.__stop_server()
+
+    async def __stop_server(self) -> None:
+        self.__server_url = None
+        SCANNER_BACKEND_UP.set("trivy", value=0)
+        if self.__server and self.__server.returncode == None:
+            self.__server.terminate()
+            try:
+                await asyncio.wait_for(self.__server.wait(), 10)
+            except TimeoutError:
+                self.__server.kill()
+                await self.__server.wait()
+        self.__server = None
+
+    async def __refresh_rules(self) -> None:
+        if not self.__semgrep_packs:
+            return
+
+        refreshed = 0
+        async with aiohttp.ClientSession(trace_configs=[http_trace_config("semgrep")]) as session:
+            for pack in self.__semgrep_packs:
+                try:
+                    async with session.get(self.__SEMGREP_REGISTRY.format(pack)) as response:
+                        if response.status != 200:
+                            self._log_err(f"failed to fetch semgrep rules {pack}: {response.status}")
+                            continue
+                        rules = await response.read()
+                except aiohttp.ClientError as e:
+                    self._log_err(f"failed to fetch semgrep rules {pack}: {e}")
+                    continue
+
+                # a failed refresh keeps the previous rules, a partial write never replaces them
+                rules_path = os.path.join(self.semgrep_rules_path, f"{pack.replace('/', '_')}.yaml")
+                with open(f"{rules_path}.tmp", "wb") as f:
+                    f.write(rules)
+                os.replace(f"{rules_path}.tmp", rules_path)
+                refreshed += 1
+
+        self.__rules_refreshed_at = time.monotonic()
+        SCANNER_BACKEND_UP.set("semgrep_rules", value=1 if os.listdir(self.semgrep_rules_path) else 0)
+        self._log(f"refreshed {refreshed}/{len(self.__semgrep_packs)} semgrep rule packs")
@@ -1,12 +1,15 @@
+import hashlib
 import json
 
 class ProjectConfig:
-    def __init__(self, gitlab_url: str, gitlab_branch: str, public_url: str, dast_params: str, team: str):
+    def __init__(self, gitlab_url: str, gitlab_branch: str, public_url: str, dast_params: str, team: str,
+                 scan_interval_days: int = 0):
         self.gitlab_url     = gitlab_url
         self.gitlab_branch  = gitlab_branch
         self.public_url     = public_url
         self.dast_params    = dast_params
         self.team           = team
+        self.scan_interval_days = scan_interval_days
 
     @classmethod
     def from_dict(cls, data: dict):
@@ -15,9 +18,23 @@ class ProjectConfig:
             gitlab_branch   = data.get("gitlab_branch", ""),
             public_url      = data.get("public_url", ""),
             dast_params     = data.get("dast_params", ""),
-            team            = data.get("team", "")
+            team            = data.get("team", ""),
+            scan_interval_days = int(data.get("scan_interval_days", 0))
         )
 
+    def to_dict(self) -> dict:
+        return {
+            "gitlab_url":       self.gitlab_url,
+            "gitlab_branch":    self.gitlab_branch,
+            "public_url":       self.public_url,
+            "dast_params":      self.dast_params,
+            "team":             self.team,
+            "scan_interval_days": self.scan_interval_days
+        }
+
+    def config_hash(self) -> str:
+        return hashlib.sha256(json.dumps(self.to_dict(), sort_keys=True).encode()).hexdigest()
+
     @classmethod
     def from_file(cls, filepath: str):
         with open(filepath, "r") as f:
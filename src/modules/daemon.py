@@ -0,0 +1,80 @@
+import asyncio
+from datetime import date, datetime
+from typing import Awaitable, Callable
+from aiohttp import web
+
+from modules.logger import BaseLogger
+from modules.main import Main
+from modules.metrics import REGISTRY, CONTENT_TYPE
+
+
+class Daemon(BaseLogger):
+    STATE_IDLE      = "idle"
+    STATE_RUNNING   = "running"
+
+    def __init__(self, main: Main, cycle: Callable[[], Awaitable[None]], run_id_prefix: str,
+                 poll_interval: int, host: str, port: int) -> None:
+        self.__main             = main
+        self.__cycle            = cycle
+        self.__run_id_prefix    = run_id_prefix
+        self.__poll_interval    = poll_interval
+        self.__host             = host
+        self.__port             = port
+
+        self.app = web.Application()
+        self.app.add_routes([
+            web.get("/health", self.__handle_health),
+            web.get("/status", self.__handle_status),
+            web.get("/metrics", self.__handle_metrics),
+        ])
+
+        self.__status = {
+            "runner_id":            main.runner_id,
+            "state":                self.STATE_IDLE,
+            "run_id":               None,
+            "cycles":               0,
+            "failed_cycles":        0,
+            "last_cycle_started":   None,
+            "last_cycle_finished":  None,
+            "last_error":           None,
+        }
+
+    async def run(self) -> None:
+        runner = web.AppRunner(self.app)
+        await runner.setup()
+        await web.TCPSite(runner, self.__host, self.__port).start()
+        self._log(f"daemon listening on {self.__host}:{self.__port}")
+
+        try:
+            while True:
+                await self.__run_cycle()
+                await asyncio.sleep(self.__poll_interval)
+        finally:
+            await runner.cleanup()
+
+    async def __run_cycle(self) -> None:
+        # one run id per day: targets are due again only by their scan interval
+        self.__main.run_id = f"{self.__run_id_prefix}-{date.today().isoformat()}"
+
+        self.__status["state"]              = self.STATE_RUNNING
+        self.__status["run_id"]             = self.__main.run_id
+        self.__status["last_cycle_started"] = datetime.now().isoformat()
+        try:
+            await self.__cycle()
+        except Exception as e:
+            self._log_err(f"daemon cycle failed: {e}")
+            self.__status["failed_cycles"] += 1
+            self.__status["last_error"]     = str(e)
+        finally:
+            self.__status["state"]                  = self.STATE_IDLE
+            self.__status["cycles"]                 += 1
+            self.__status["last_cycle_finished"]    = datetime.now().isoformat()
+
+    async def __handle_health(self, request: web.Request) -> web.Response:
+        return web.Response(text="ok")
+
+    async def __handle_status(self, request: web.Request) -> web.Response:
+        return web.json_response(self.__status)
+
+    async def __handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(body=REGISTRY.render().encode(), headers={"Content-Type": CONTENT_TYPE})
@@ -1,10 +1,19 @@
 import asyncpg
+import json
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, fields
+from datetime import date, datetime, timedelta
 from enum import Enum
 
+from modules.metrics import observe_query
+
 class Tables(Enum):
     PROJECTS    = "projects"
     IMAGES      = "images"
     DAST        = "dast"
+    RUN_JOURNAL = "run_journal"
+    SCA_CACHE   = "sca_cache"
+    FINDING_FINGERPRINTS = "finding_fingerprints"
 
 class ProjectColumns(Enum):
     ID                  = "id"
@@ -14,6 +23,10 @@ class ProjectColumns(Enum):
     DD_PROJECT_ID       = "dd_project_id"
     LAST_SCAN_AT        = "last_scan_at"
     TEAM                = "team"
+    CONFIG_HASH         = "config_hash"
+    SYNCED_AT           = "synced_at"
+    SCAN_INTERVAL_DAYS  = "scan_interval_days"
+    FINDINGS_COUNT      = "findings_count"
 
 class ImageColumns(Enum):
     ID              = "id"
@@ -22,6 +35,8 @@ class ImageColumns(Enum):
     IMAGE_URL       = "image_url"
     ENGAGEMENT_ID   = "engagement_id"
     LAST_SCAN_AT    = "last_scan_at"
+    SCAN_INTERVAL_DAYS  = "scan_interval_days"
+    FINDINGS_COUNT      = "findings_count"
 
 class DastColumns(Enum):
     ID              = "id"
@@ -29,49 +44,157 @@ class DastColumns(Enum):
     PARAMS          = "params"
     LAST_SCAN_AT    = "last_scan_at"
 
+class JournalColumns(Enum):
+    RUN_ID          = "run_id"
+    TARGET_TYPE     = "target_type"
+    TARGET_ID       = "target_id"
+    STAGE           = "stage"
+    UPDATED_AT      = "updated_at"
+
+class JournalStages(Enum):
+    CLONED      = "cloned"
+    SCANNED     = "scanned"
+    UPLOADED    = "uploaded"
+    NOTIFIED    = "notified"
+
+JOURNAL_STAGES_ORDER = list(JournalStages)
+
+class ScaCacheColumns(Enum):
+    CACHE_KEY       = "cache_key"
+    REPORT          = "report"
+    CREATED_AT      = "created_at"
+
+class FingerprintColumns(Enum):
+    TARGET_TYPE     = "target_type"
+    TARGET_ID       = "target_id"
+    SCANNER         = "scanner"
+    DIGEST          = "digest"
+    FINGERPRINTS    = "fingerprints"
+    UPDATED_AT      = "updated_at"
+
+class LeaseColumns(Enum):
+    LEASED_BY       = "leased_by"
+    LEASED_UNTIL    = "leased_until"
+    LAST_RUN_ID     = "last_run_id"
+
+class DurationColumns(Enum):
+    CLONE_SECONDS   = "clone_seconds"
+    SCAN_SECONDS    = "scan_seconds"
+    UPLOAD_SECONDS  = "upload_seconds"
+
+class FootprintColumns(Enum):
+    WORKSPACE_BYTES = "workspace_bytes"
+
+@dataclass(slots=True)
+class ProjectRow:
+    id:             int
+    is_active:      bool
+    gitlab_url:     str
+    gitlab_branch:  str
+    dd_project_id:  int
+    last_scan_at:   date | None
+    team:           str
+    config_hash:    str | None
+    synced_at:      datetime | None
+    scan_interval_days: int
+    findings_count: int | None
+    workspace_bytes: int | None
+
+@dataclass(slots=True)
+class ImageRow:
+    id:             int
+    is_active:      bool
+    project_id:     int
+    image_url:      str
+    engagement_id:  int
+    last_scan_at:   date | None
+    scan_interval_days: int
+    findings_count: int | None
+    workspace_bytes: int | None
+
+@dataclass(slots=True)
+class DastRow:
+    id:             int
+    project_id:     int
+    params:         str
+    last_scan_at:   date | None
+
+Row = ProjectRow | ImageRow | DastRow
+
+ROW_TYPES: dict[Tables, type] = {
+    Tables.PROJECTS:    ProjectRow,
+    Tables.IMAGES:      ImageRow,
+    Tables.DAST:        DastRow,
+}
+
+# smoothing factor for per-target stage durations
+DURATION_EWMA_ALPHA = 0.3
+# per-target disk footprints keep their peak, shrinking repositories decay towards the new size
+FOOTPRINT_DECAY = 0.9
+
 class Database:
     def __init__(self, conn_str: str):
         self.conn_str = conn_str
         self.conn = None
+        # explicit column lists keep record order aligned with row fields,
+        # so records are unpacked positionally without building dicts
+        self.__columns = {
+            table: ', '.join(f.name for f in fields(row_type))
+            for table, row_type in ROW_TYPES.items()
+        }
+
+    def _to_row(self, table: Tables, record: asyncpg.Record) -> Row:
+        return ROW_TYPES[table](*record)
 
     async def connect(self):
-        self.conn = await asyncpg.create_pool(self.conn_str)
+        self.conn = await asyncpg.create_pool(self.conn_str, init=self.__init_connection)
+
+    async def __init_connection(self, conn: asyncpg.Connection) -> None:
+        conn.add_query_logger(observe_query)
     
     async def close(self):
         if self.conn:
             await self.conn.close()
     
-    async def fetch_row(self, table: Tables, column: Enum, value: str) -> dict | None:
+    async def fetch_row(self, table: Tables, column: Enum, value: str) -> Row | None:
         if not self.conn:
             await self.connect()
         
-        query = f"SELECT * FROM {table.value} WHERE {column.value} = $1 LIMIT 1"
+        query = f"SELECT {self.__columns[table]} FROM {table.value} WHERE {column.value} = $1 LIMIT 1"
         row = await self.conn.fetchrow(query, value)
-        return dict(row) if row else None
+        return self._to_row(table, row) if row else None
     
-    async def fetch_rows(self, table: Tables, column: Enum, value: str) -> list[dict] | None:
+    async def fetch_rows(self, table: Tables, column: Enum, value: str) -> list[Row] | None:
         if not self.conn:
             await self.connect()
         
-        query = f"SELECT * FROM {table.value} WHERE {column.value} = $1"
+        query = f"SELECT {self.__columns[table]} FROM {table.value} WHERE {column.value} = $1"
         rows = await self.conn.fetch(query, value)
-        return [dict(row) for row in rows] if rows != None else None
+        return [self._to_row(table, row) for row in rows] if rows != None else None
     
-    async def fetch_rows_page(self, table: Tables, offset: int = 0, limit: int = 1) -> list[dict] | None:
+    async def fetch_all(self, table: Tables) -> list[Row] | None:
+        if not self.conn:
+            await self.connect()
+
+        query = f"SELECT {self.__columns[table]} FROM {table.value}"
+        rows = await self.conn.fetch(query)
+        return [self._to_row(table, row) for row in rows] if rows != None else None
+
+    async def fetch_rows_page(self, table: Tables, offset: int = 0, limit: int = 1) -> list[Row] | None:
         if not self.conn:
             await self.connect()
 
-        query = f"SELECT * FROM {table.value} OFFSET $1 LIMIT $2"
+        query = f"SELECT {self.__columns[table]} FROM {table.value} OFFSET $1 LIMIT $2"
         rows = await self.conn.fetch(query, offset, limit)
-        return [dict(row) for row in rows] if rows != None else None
+        return [self._to_row(table, row) for row in rows] if rows != None else None
 
-    async def fetch_rows_in(self, table: Tables, column: Enum, values: list[str], positive_in: bool) -> list[dict] | None:
+    async def fetch_rows_in(self, table: Tables, column: Enum, values: list[str], positive_in: bool) -> list[Row] | None:
         if not self.conn:
             await self.connect()
         filter_string = f"IN ({', '.join(values)})" if positive_in else f"NOT IN ({', '.join(values)})"
-        query = f"SELECT * FROM {table.value} WHERE {column.value} {filter_string}"
+        query = f"SELECT {self.__columns[table]} FROM {table.value} WHERE {column.value} {filter_string}"
         rows = await self.conn.fetch(query)
-        return [dict(row) for row in rows] if rows != None else None
+        return [self._to_row(table, row) for row in rows] if rows != None else None
     
     async def insert_row(self, table: Tables, data: dict) -> None:
         if not self.conn:
@@ -96,4 +219,243 @@ class Database:
             await self.connect()
 
         query = f"UPDATE {table.value} SET {column.value} = $1 WHERE {filter_column.value} = $2"
-        await self.conn.execute(query, value, filter_value)
\ No newline at end of file
+        await self.conn.execute(query, value, filter_value)
+
+    async def update_row_columns(self, table: Tables, filter_column: Enum, filter_value: str, data: dict) -> None:
+        if not self.conn:
+            await self.connect()
+
+        set_string = ', '.join(f"{k.value} = ${i+1}" for i, k in enumerate(data.keys()))
+        values = tuple(data.values())
+
+        query = f"UPDATE {table.value} SET {set_string} WHERE {filter_column.value} = ${len(data)+1}"
+        await self.conn.execute(query, *values, filter_value)
+
+    def __overdue_days(self) -> str:
+        return "(CURRENT_DATE - COALESCE(last_scan_at, DATE '1970-01-01')) - scan_interval_days"
+
+    def __expected_seconds(self, default_param: str) -> str:
+        total = " + ".join(f"COALESCE({c.value}, 0)" for c in DurationColumns)
+        return f"COALESCE(NULLIF({total}, 0), {default_param}::float8)"
+
+    async def claim_rows(self, table: Tables, runner_id: str, run_id: str, limit: int, ttl: timedelta,
+                         default_seconds: float, max_seconds: float | None = None) -> list[Row] | None:
+        if not self.conn:
+            await self.connect()
+
+        # rows leased by a dead runner become claimable once leased_until passes;
+        # rows go by how many scan intervals they are late, longest expected first
+        # within the same bucket (LPT), and rows not expected to finish within
+        # max_seconds are not admitted
+        overdue, expected = self.__overdue_days(), self.__expected_seconds("$5")
+        bucket = f"FLOOR(({overdue})::float8 / GREATEST(scan_interval_days, 1))"
+        query = f"""
+            UPDATE {table.value}
+            SET {LeaseColumns.LEASED_BY.value} = $1, {LeaseColumns.LEASED_UNTIL.value} = now() + $2::interval
+            WHERE id IN (
+                SELECT id FROM {table.value}
+                WHERE is_active
+                    AND {overdue} >= 0
+                    AND {LeaseColumns.LAST_RUN_ID.value} IS DISTINCT FROM $3
+                    AND ({LeaseColumns.LEASED_UNTIL.value} IS NULL OR {LeaseColumns.LEASED_UNTIL.value} < now())
+                    AND ($6::float8 IS NULL OR {expected} <= $6::float8)
+                ORDER BY {bucket} DESC, {expected} DESC, COALESCE(findings_count, 0) DESC, {overdue} DESC, id
+                LIMIT $4
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING {self.__columns[table]}
+        """
+        rows = await self.conn.fetch(query, runner_id, ttl, run_id, limit, default_seconds, max_seconds)
+        return [self._to_row(table, row) for row in rows] if rows != None else None
+
+    async def claim_row(self, table: Tables, runner_id: str, row_id: int, ttl: timedelta) -> Row | None:
+        if not self.conn:
+            await self.connect()
+
+        query = f"""
+            UPDATE {table.value}
+            SET {LeaseColumns.LEASED_BY.value} = $1, {LeaseColumns.LEASED_UNTIL.value} = now() + $2::interval
+            WHERE id = (
+                SELECT id FROM {table.value}
+                WHERE id = $3
+                    AND is_active
+                    AND ({LeaseColumns.LEASED_UNTIL.value} IS NULL OR {LeaseColumns.LEASED_UNTIL.value} < now())
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING {self.__columns[table]}
+        """
+        row = await self.conn.fetchrow(query, runner_id, ttl, row_id)
+        return self._to_row(table, row) if row else None
+
+    async def fetch_expected_durations(self, table: Tables, run_id: str, default_seconds: float) -> list[float] | None:
+        if not self.conn:
+            await self.connect()
+
+        query = f"""
+            SELECT {self.__expected_seconds("$2")} FROM {table.value}
+            WHERE is_active
+                AND {self.__overdue_days()} >= 0
+                AND {LeaseColumns.LAST_RUN_ID.value} IS DISTINCT FROM $1
+        """
+        rows = await self.conn.fetch(query, run_id, default_seconds)
+        return [row[0] for row in rows] if rows != None else None
+
+    async def record_durations(self, table: Tables, row_id: int, durations: dict[DurationColumns, float]) -> None:
+        if not self.conn:
+            await self.connect()
+        if not durations:
+            return
+
+        set_string = ', '.join(
+            f"{k.value} = COALESCE({DURATION_EWMA_ALPHA} * ${i+1}::float8 + {1 - DURATION_EWMA_ALPHA} * {k.value}, ${i+1}::float8)"
+            for i, k in enumerate(durations.keys())
+        )
+        query = f"UPDATE {table.value} SET {set_string} WHERE id = ${len(durations)+1}"
+        await self.conn.execute(query, *durations.values(), row_id)
+
+    async def record_footprint(self, table: Tables, row_id: int, workspace_bytes: int) -> None:
+        if not self.conn:
+            await self.connect()
+
+        column = FootprintColumns.WORKSPACE_BYTES.value
+        query = f"UPDATE {table.value} SET {column} = GREATEST($1::bigint, ({FOOTPRINT_DECAY} * COALESCE({column}, 0))::bigint) WHERE id = $2"
+        await self.conn.execute(query, workspace_bytes, row_id)
+
+    async def extend_leases(self, table: Tables, runner_id: str, ids: list[int], ttl: timedelta) -> None:
+        if not self.conn:
+            await self.connect()
+
+        query = f"""
+            UPDATE {table.value}
+            SET {LeaseColumns.LEASED_UNTIL.value} = now() + $1::interval
+            WHERE id = ANY($2::bigint[]) AND {LeaseColumns.LEASED_BY.value} = $3
+        """
+        await self.conn.execute(query, ttl, ids, runner_id)
+
+    async def release_row(self, table: Tables, runner_id: str, run_id: str | None, row_id: int) -> None:
+        if not self.conn:
+            await self.connect()
+
+        # run_id None hands the row back unfinished, e.g. when a run hits its deadline
+        query = f"""
+            UPDATE {table.value}
+            SET {LeaseColumns.LEASED_BY.value} = NULL, {LeaseColumns.LEASED_UNTIL.value} = NULL,
+                {LeaseColumns.LAST_RUN_ID.value} = COALESCE($1, {LeaseColumns.LAST_RUN_ID.value})
+            WHERE id = $2 AND {LeaseColumns.LEASED_BY.value} = $3
+        """
+        await self.conn.execute(query, run_id, row_id, runner_id)
+
+    async def release_stale_leases(self, table: Tables, runner_prefix: str, runner_id: str) -> None:
+        if not self.conn:
+            await self.connect()
+
+        # leases of earlier processes of the same runner slot, which cannot be alive anymore
+        query = f"""
+            UPDATE {table.value}
+            SET {LeaseColumns.LEASED_BY.value} = NULL, {LeaseColumns.LEASED_UNTIL.value} = NULL
+            WHERE left({LeaseColumns.LEASED_BY.value}, length($1)) = $1 AND {LeaseColumns.LEASED_BY.value} <> $2
+        """
+        await self.conn.execute(query, runner_prefix, runner_id)
+
+    @asynccontextmanager
+    async def advisory_lock(self, key: int):
+        if not self.conn:
+            await self.connect()
+
+        async with self.conn.acquire() as conn:
+            locked = await conn.fetchval("SELECT pg_try_advisory_lock($1)", key)
+            try:
+                yield locked
+            finally:
+                if locked:
+                    await conn.execute("SELECT pg_advisory_unlock($1)", key)
+
+    async def fetch_journal_stage(self, run_id: str, target_type: Tables, target_id: int) -> JournalStages | None:
+        if not self.conn:
+            await self.connect()
+
+        query = f"""
+            SELECT {JournalColumns.STAGE.value} FROM {Tables.RUN_JOURNAL.value}
+            WHERE {JournalColumns.RUN_ID.value} = $1 AND {JournalColumns.TARGET_TYPE.value} = $2 AND {JournalColumns.TARGET_ID.value} = $3
+        """
+        stage = await self.conn.fetchval(query, run_id, target_type.value, target_id)
+        return JournalStages(stage) if stage else None
+
+    async def save_journal_stage(self, run_id: str, target_type: Tables, target_id: int, stage: JournalStages) -> None:
+        if not self.conn:
+            await self.connect()
+
+        query = f"""
+            INSERT INTO {Tables.RUN_JOURNAL.value}
+                ({JournalColumns.RUN_ID.value}, {JournalColumns.TARGET_TYPE.value}, {JournalColumns.TARGET_ID.value}, {JournalColumns.STAGE.value})
+            VALUES ($1, $2, $3, $4)
+            ON CONFLICT ({JournalColumns.RUN_ID.value}, {JournalColumns.TARGET_TYPE.value}, {JournalColumns.TARGET_ID.value})
+            DO UPDATE SET {JournalColumns.STAGE.value} = EXCLUDED.{JournalColumns.STAGE.value}, {JournalColumns.UPDATED_AT.value} = now()
+        """
+        await self.conn.execute(query, run_id, target_type.value, target_id, stage.value)
+
+    async def purge_journal(self, older_than: timedelta) -> None:
+        if not self.conn:
+            await self.connect()
+
+        query = f"DELETE FROM {Tables.RUN_JOURNAL.value} WHERE {JournalColumns.UPDATED_AT.value} < now() - $1::interval"
+        await self.conn.execute(query, older_than)
+
+    async def fetch_sca_report(self, cache_key: str) -> bytes | None:
+        if not self.conn:
+            await self.connect()
+
+        query = f"SELECT {ScaCacheColumns.REPORT.value} FROM {Tables.SCA_CACHE.value} WHERE {ScaCacheColumns.CACHE_KEY.value} = $1"
+        return await self.conn.fetchval(query, cache_key)
+
+    async def save_sca_report(self, cache_key: str, report: bytes) -> None:
+        if not self.conn:
+            await self.connect()
+
+        query = f"""
+            INSERT INTO {Tables.SCA_CACHE.value} ({ScaCacheColumns.CACHE_KEY.value}, {ScaCacheColumns.REPORT.value})
+            VALUES ($1, $2)
+            ON CONFLICT ({ScaCacheColumns.CACHE_KEY.value}) DO NOTHING
+        """
+        await self.conn.execute(query, cache_key, report)
+
+    async def purge_sca_cache(self, older_than: timedelta) -> None:
+        if not self.conn:
+            await self.connect()
+
+        query = f"DELETE FROM {Tables.SCA_CACHE.value} WHERE {ScaCacheColumns.CREATED_AT.value} < now() - $1::interval"
+        await self.conn.execute(query, older_than)
+
+    async def fetch_finding_fingerprints(self, target_type: Tables, target_id: int,
+                                         scanner: str) -> tuple[str, dict[str, str], datetime] | None:
+        if not self.conn:
+            await self.connect()
+
+        query = f"""
+            SELECT {FingerprintColumns.DIGEST.value}, {FingerprintColumns.FINGERPRINTS.value}, {FingerprintColumns.UPDATED_AT.value}
+            FROM {Tables.FINDING_FINGERPRINTS.value}
+            WHERE {FingerprintColumns.TARGET_TYPE.value} = $1 AND {FingerprintColumns.TARGET_ID.value} = $2
+                AND {FingerprintColumns.SCANNER.value} = $3
+        """
+        record = await self.conn.fetchrow(query, target_type.value, target_id, scanner)
+        if not record:
+            return None
+        digest, fingerprints, updated_at = record
+        return digest, json.loads(fingerprints), updated_at
+
+    async def save_finding_fingerprints(self, target_type: Tables, target_id: int, scanner: str,
+                                        digest: str, fingerprints: dict[str, str]) -> None:
+        if not self.conn:
+            await self.connect()
+
+        query = f"""
+            INSERT INTO {Tables.FINDING_FINGERPRINTS.value}
+                ({FingerprintColumns.TARGET_TYPE.value}, {FingerprintColumns.TARGET_ID.value}, {FingerprintColumns.SCANNER.value},
+                 {FingerprintColumns.DIGEST.value}, {FingerprintColumns.FINGERPRINTS.value})
+            VALUES ($1, $2, $3, $4, $5::jsonb)
+            ON CONFLICT ({FingerprintColumns.TARGET_TYPE.value}, {FingerprintColumns.TARGET_ID.value}, {FingerprintColumns.SCANNER.value})
+            DO UPDATE SET {FingerprintColumns.DIGEST.value} = EXCLUDED.{FingerprintColumns.DIGEST.value},
+                {FingerprintColumns.FINGERPRINTS.value} = EXCLUDED.{FingerprintColumns.FINGERPRINTS.value},
+                {FingerprintColumns.UPDATED_AT.value} = now()
+        """
+        await self.conn.execute(query, target_type.value, target_id, scanner, digest, json.dumps(fingerprints))
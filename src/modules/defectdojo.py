@@ -1,8 +1,13 @@
 from datetime import datetime
+import asyncio
 import aiohttp
 import os
 
 from modules.logger import BaseLogger
+from modules.metrics import http_trace_config
+
+# findings below are discarded by DefectDojo on import
+MINIMUM_SEVERITY = "Medium"
 
 
 class DefectDojoReport:
@@ -11,9 +16,15 @@ class DefectDojoReport:
             engagement_id, branch,
             report_name = None
         ):
+        # identifies the test a reimport updates
+        self.scan_type      = scan_type
+        self.engagement_id  = engagement_id
+        self.endpoint_id    = endpoint_id
+        self.title          = report_name
+
         self.metadata = aiohttp.FormData()
         self.metadata.add_fields(
-            ('minimum_severity', 'Medium'),
+            ('minimum_severity', MINIMUM_SEVERITY),
             ('active', 'true'),
             ('verified', 'true'),
             ('close_old_findings', 'true'),
@@ -30,8 +41,10 @@ class DefectDojoReport:
         self.metadata.add_field('file', file, filename="scan.json")
 
         if report_name:
+            # the service scopes close_old_findings, reports of another scanner with the same scan type stay open
             self.metadata.add_fields(
                 ('test_title', report_name),
+                ('service', report_name),
                 ('close_old_findings_product_scope', 'false')
             )
 
@@ -40,6 +53,8 @@ class DefectDojo(BaseLogger):
     __API_PRODUCTS      = "/api/v2/products"
     __API_ENGAGEMENTS   = "/api/v2/engagements"
     __API_SCAN          = "/api/v2/import-scan/"
+    __API_REIMPORT_SCAN = "/api/v2/reimport-scan/"
+    __API_TESTS         = "/api/v2/tests"
     __API_ENDPOINT      = "/api/v2/endpoints"
 
     __API_SUCCES_STATUS = set([200, 201])
@@ -47,41 +62,62 @@ class DefectDojo(BaseLogger):
     __SCANNERS_PREFIXES = set(["trivy"])
     __TARGET_PREFIXES   = set(["prod"])
 
-    def __init__(self, host: str, token: str) -> None:
+    def __init__(self, host: str, token: str, reimport: bool = False) -> None:
         self.__host     = host
         self.__token    = f"Token {token}"
+        self.__session: aiohttp.ClientSession | None = None
+
+        # update one test per (engagement, scan type, title) instead of adding a test per run
+        self.__reimport = reimport
+
+        # rarely changing lookups, kept for the process lifetime
+        self.__endpoints_cache: dict[int, int] = {}
+        self.__engagements_cache: dict[tuple[int, str | None], int] = {}
+        self.__tests_cache: dict[tuple[int, str, str | None], int] = {}
+        # run the caches were filled in, a daemon keeps them warm until its daily run rolls over
+        self.__caches_run_id: str | None = None
+        # (engagement, scan type, title) -> lock, concurrent first reports create one test between them
+        self.__import_locks: dict[tuple[int, str, str | None], asyncio.Lock] = {}
+
+    def __get_session(self) -> aiohttp.ClientSession:
+        if not self.__session or self.__session.closed:
+            self.__session = aiohttp.ClientSession(trace_configs=[http_trace_config("defectdojo")])
+        return self.__session
+
+    async def close(self) -> None:
+        if self.__session:
+            await self.__session.close()
+            self.__session = None
 
     async def __request_get(self, endpoint: str, body: dict) -> dict | None:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"{self.__host}{endpoint}",
-                headers={
-                    'Content-Type': 'application/json',
-                    'Authorization': self.__token
-                },
-                params=body
-            ) as response:
-                if response.status != 200:
-                    return None
-                return await response.json()
+        async with self.__get_session().get(
+            f"{self.__host}{endpoint}",
+            headers={
+                'Content-Type': 'application/json',
+                'Authorization': self.__token
+            },
+            params=body
+        ) as response:
+            if response.status != 200:
+                return None
+            return await response.json()
             
     async def __request_post(self, endpoint: str, body: dict | None = None, data: dict | aiohttp.formdata.FormData | None = None) -> dict | None:
         if body == None and data == None:
             return None
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{self.__host}{endpoint}",
-                headers={
-                    'Authorization': self.__token
-                },
-                json=body,
-                data=data
-            ) as response:
-                if response.status not in self.__API_SUCCES_STATUS:
-                    self._log_err(f"{response.status}:\n{await response.text()}")
-                    return None
-                return await response.json()
+        async with self.__get_session().post(
+            f"{self.__host}{endpoint}",
+            headers={
+                'Authorization': self.__token
+            },
+            json=body,
+            data=data
+        ) as response:
+            if response.status not in self.__API_SUCCES_STATUS:
+                self._log_err(f"{response.status}:\n{await response.text()}")
+                return None
+            return await response.json()
 
     async def find_product(self, name: str) -> int | None:
         response = await self.__request_get(
@@ -110,6 +146,9 @@ class DefectDojo(BaseLogger):
         return response.get("findings_count", -1)
 
     async def get_engagement(self, product: int, branch: str | None = None) -> int | None:
+        if (product, branch) in self.__engagements_cache:
+            return self.__engagements_cache[(product, branch)]
+
         response = await self.__request_get(
             self.__API_ENGAGEMENTS,
             {
@@ -127,6 +166,7 @@ class DefectDojo(BaseLogger):
         
         for engagement in results:
             if engagement["branch_tag"] == branch:
+                self.__engagements_cache[(product, branch)] = engagement["id"]
                 return engagement["id"]
         return None
         
@@ -185,6 +225,9 @@ class DefectDojo(BaseLogger):
         return images
 
     async def get_endpoint_id(self, product_id: int) -> int | None:
+        if product_id in self.__endpoints_cache:
+            return self.__endpoints_cache[product_id]
+
         response = await self.__request_get(
             self.__API_ENDPOINT,
             {
@@ -203,12 +246,90 @@ class DefectDojo(BaseLogger):
         for endpoint in results:
             if endpoint.get("protocol") is not None:
                 endpoint_id = endpoint["id"]
+                self.__endpoints_cache[product_id] = endpoint_id
                 break
 
         return endpoint_id
         
 
-    async def send_report(self, report: DefectDojoReport) -> None:
+    async def get_test(self, engagement_id: int, scan_type: str, title: str | None = None) -> int | None:
+        key = (engagement_id, scan_type, title)
+        if key in self.__tests_cache:
+            return self.__tests_cache[key]
+
+        response = await self.__request_get(
+            self.__API_TESTS,
+            {
+                "engagement": engagement_id,
+                "o": "-created",
+                "limit": 100
+            }
+        )
+        if not response:
+            return None
+
+        for test in response.get("results", []):
+            if test.get("scan_type") == scan_type and test.get("title") == title:
+                self.__tests_cache[key] = test["id"]
+                return test["id"]
+        return None
+
+    def reset_caches(self, run_id: str) -> None:
+        # ids deleted or recreated in DefectDojo are looked up again once per run,
+        # stale ones in between are evicted when an upload is rejected
+        if run_id == self.__caches_run_id:
+            return
+        self.__caches_run_id = run_id
+        self.__endpoints_cache.clear()
+        self.__engagements_cache.clear()
+        self.__tests_cache.clear()
+
+    def __evict(self, report: DefectDojoReport) -> None:
+        # a rejected upload may point at a deleted engagement or endpoint
+        for key, engagement_id in list(self.__engagements_cache.items()):
+            if engagement_id == report.engagement_id:
+                del self.__engagements_cache[key]
+        for key, endpoint_id in list(self.__endpoints_cache.items()):
+            if endpoint_id == report.endpoint_id:
+                del self.__endpoints_cache[key]
+        for key in [key for key in self.__tests_cache if key[0] == report.engagement_id]:
+            del self.__tests_cache[key]
+
+    async def send_report(self, report: DefectDojoReport) -> int | None:
+        if not self.__reimport:
+            test_id = await self.__import_report(report)
+            if test_id == None:
+                self.__evict(report)
+            return test_id
+
+        key = (report.engagement_id, report.scan_type, report.title)
+        test_id = await self.get_test(*key)
+        if test_id == None:
+            async with self.__import_locks.setdefault(key, asyncio.Lock()):
+                # a concurrent first report may have created the test meanwhile
+                test_id = await self.get_test(*key)
+                if test_id == None:
+                    # first report of its kind in the engagement, later runs reimport into this test
+                    test_id = await self.__import_report(report)
+                    if test_id == None:
+                        self.__evict(report)
+                    else:
+                        self.__tests_cache[key] = test_id
+                    return test_id
+
+        report.metadata.add_field('test', str(test_id))
+        response = await self.__request_post(
+            self.__API_REIMPORT_SCAN,
+            data = report.metadata
+        )
+        if not response:
+            # the test may have been deleted, look it up again next time
+            self.__evict(report)
+            return None
+
+        return response.get("test_id", test_id)
+
+    async def __import_report(self, report: DefectDojoReport) -> int | None:
         response = await self.__request_post(
             self.__API_SCAN,
             data = report.metadata
@@ -1,9 +1,13 @@
+import asyncio
+import hashlib
 import os
 import shutil
+import time
 import aiohttp
 from git import Repo
-from datetime import datetime
+from datetime import datetime, timedelta
 from modules.logger import BaseLogger
+from modules.metrics import http_trace_config
 
 
 
@@ -12,23 +16,41 @@ class Gitlab(BaseLogger):
     __API_PIPELINES = "/projects/{}/pipelines"
     __API_JOBS      = "/projects/{}/pipelines/{}/jobs"
 
-    def __init__(self, host: str, token: str) -> None:
+    def __init__(self, host: str, token: str, objects_path: str | None = None) -> None:
         self.__host     = host
         self.__token    = token
+        self.__session: aiohttp.ClientSession | None = None
+
+        # one bare object store per repository kept between runs, every branch scanned is a worktree of it;
+        # without it each checkout gets its own store next to the worktree, removed along with its workspace
+        self.__objects_path = objects_path
+        # repo_url -> lock serializing fetches and worktree changes of its store
+        self.__store_locks: dict[str, asyncio.Lock] = {}
+        # repo_url -> (run_id, branches fetched during that run)
+        self.__fetched: dict[str, tuple[str, set[str]]] = {}
+
+    def __get_session(self) -> aiohttp.ClientSession:
+        if not self.__session or self.__session.closed:
+            self.__session = aiohttp.ClientSession(trace_configs=[http_trace_config("gitlab")])
+        return self.__session
+
+    async def close(self) -> None:
+        if self.__session:
+            await self.__session.close()
+            self.__session = None
 
     async def __request_get(self, endpoint: str, body: dict) -> dict | None:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"{self.__host}{endpoint}",
-                headers={
-                    'Content-Type': 'application/json',
-                    'Authorization': f"Bearer {self.__token}"
-                },
-                params=body
-            ) as response:
-                if response.status != 200:
-                    return None
-                return await response.json()
+        async with self.__get_session().get(
+            f"{self.__host}{endpoint}",
+            headers={
+                'Content-Type': 'application/json',
+                'Authorization': f"Bearer {self.__token}"
+            },
+            params=body
+        ) as response:
+            if response.status != 200:
+                return None
+            return await response.json()
 
     async def get_pipelines(self, project: str, branch: str, page: int = 1) -> list[int] | None:
         pipelines = await self.__request_get(
@@ -61,16 +83,58 @@ class Gitlab(BaseLogger):
         
         return jobs
     
-    def clone_repository(self, repo_url: str, repo_branch: str, dest_path: str) -> bool:
+    async def checkout_worktree(self, repo_url: str, repo_branch: str, dest_path: str, run_id: str) -> bool:
         self.clean_dir(dest_path)
-        
-        try:
-            Repo.clone_from(f"{self.__host.replace('https://', 'https://continuous-monitoring:' + self.__token + '@')}/{repo_url}", dest_path, branch=repo_branch)
-            self._log(f"repository cloned successfully: {repo_url} -> {dest_path}")
-            return True
-        except Exception as e:
-            self._log_err(f"failed to clone repository: {e}")
-            return False
+        store_path = self.__store_path(repo_url) if self.__objects_path else f"{os.path.abspath(dest_path)}.git"
+
+        async with self.__store_locks.setdefault(store_path, asyncio.Lock()):
+            try:
+                await asyncio.to_thread(self.__checkout_worktree, repo_url, repo_branch, dest_path, store_path, run_id)
+            except Exception as e:
+                self._log_err(f"failed to check out repository: {e}")
+                return False
+
+        self._log(f"repository checked out successfully: {repo_url}@{repo_branch} -> {dest_path}")
+        return True
+
+    def __checkout_worktree(self, repo_url: str, repo_branch: str, dest_path: str, store_path: str, run_id: str) -> None:
+        store = Repo(store_path) if os.path.exists(store_path) else Repo.init(store_path, bare=True, mkdir=True)
+
+        # siblings on the same repository reuse the objects fetched earlier in the run,
+        # a branch not fetched yet only transfers what its history adds
+        fetched_run_id, branches = self.__fetched.get(store_path, (None, set()))
+        if fetched_run_id != run_id or not self.__objects_path:
+            branches = set()
+        if repo_branch not in branches:
+            # worktrees removed along with their workspace leave metadata behind
+            store.git.worktree("prune")
+            store.git.fetch(self.__remote_url(repo_url), f"+refs/heads/{repo_branch}:refs/heads/{repo_branch}")
+            if self.__objects_path:
+                branches.add(repo_branch)
+                self.__fetched[store_path] = (run_id, branches)
+                os.utime(store_path)
+
+        # detached, so later fetches may move the branch while this worktree is scanned
+        store.git.worktree("add", "--force", "--detach", os.path.abspath(dest_path), f"refs/heads/{repo_branch}")
+
+    def purge_object_stores(self, retention: timedelta) -> None:
+        if not self.__objects_path or not os.path.isdir(self.__objects_path):
+            return
+
+        cutoff = time.time() - retention.total_seconds()
+        for store in os.listdir(self.__objects_path):
+            store_path = os.path.abspath(os.path.join(self.__objects_path, store))
+            if os.path.getmtime(store_path) < cutoff:
+                self._log(f"removing unused object store: {store_path}")
+                shutil.rmtree(store_path, ignore_errors=True)
+                self.__fetched.pop(store_path, None)
+
+    def __store_path(self, repo_url: str) -> str:
+        name = f"{hashlib.sha256(repo_url.encode()).hexdigest()[:16]}.git"
+        return os.path.abspath(os.path.join(self.__objects_path, name))
+
+    def __remote_url(self, repo_url: str) -> str:
+        return f"{self.__host.replace('https://', 'https://continuous-monitoring:' + self.__token + '@')}/{repo_url}"
         
     def clean_dir(self, path: str, project_id: int | None = None) -> None:
         if os.path.exists(path):
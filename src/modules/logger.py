@@ -1,8 +1,150 @@
+import atexit
+import json
+import os
+import queue
+import sys
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime
 
+LEVEL_DEBUG     = 10
+LEVEL_INFO      = 20
+LEVEL_WARNING   = 30
+LEVEL_ERROR     = 40
+
+LEVEL_NAMES = {
+    LEVEL_DEBUG:    "debug",
+    LEVEL_INFO:     "info",
+    LEVEL_WARNING:  "warning",
+    LEVEL_ERROR:    "error",
+}
+
+# fields attached to every record logged from the current task, e.g. project_id, image, stage, run_id
+_log_context: ContextVar[dict] = ContextVar("log_context", default={})
+
+
+def bind_log_context(**fields) -> None:
+    # binds for the rest of the current task, or until the enclosing log_context exits
+    _log_context.set({**_log_context.get(), **fields})
+
+@contextmanager
+def log_context(**fields):
+    token = _log_context.set({**_log_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
+
+
+class _LogWriter:
+    __QUEUE_SIZE    = 10000
+    __BATCH_SIZE    = 256
+
+    def __init__(self) -> None:
+        self.level          = self.__parse_level(os.getenv("LOG_LEVEL", "info"))
+        # hot-path debug messages are emitted once per this many calls of a call site
+        self.sample_every   = max(int(os.getenv("LOG_DEBUG_SAMPLE_EVERY", "100")), 1)
+
+        self.__queue: queue.Queue = queue.Queue(maxsize=self.__QUEUE_SIZE)
+        self.__dropped  = 0
+        self.__samples: dict[tuple, int] = {}
+        self.__thread   = threading.Thread(target=self.__run, name="log-writer", daemon=True)
+        self.__thread.start()
+        atexit.register(self.close)
+
+    def __parse_level(self, name: str) -> int:
+        for level, level_name in LEVEL_NAMES.items():
+            if level_name == name.lower():
+                return level
+        return LEVEL_INFO
+
+    def sampled(self, site: tuple) -> int:
+        # returns how many calls the emitted record stands for, 0 to skip this one
+        count = self.__samples.get(site, 0) + 1
+        if count < self.sample_every:
+            self.__samples[site] = count
+            return 0
+        self.__samples[site] = 0
+        return count
+
+    def write(self, level: int, name: str, msg: str, fields: dict | None = None) -> None:
+        record = {
+            "ts":       datetime.now().isoformat(timespec="milliseconds"),
+            "level":    LEVEL_NAMES[level],
+            "logger":   name,
+            "msg":      msg,
+            **_log_context.get(),
+        }
+        if fields:
+            record.update(fields)
+
+        # never block the event loop on a slow log pipe, count what did not fit instead
+        try:
+            self.__queue.put_nowait((level, record))
+        except queue.Full:
+            self.__dropped += 1
+
+    def close(self) -> None:
+        if self.__thread.is_alive():
+            self.__queue.put(None)
+            self.__thread.join()
+
+    def __run(self) -> None:
+        while True:
+            batch = [self.__queue.get()]
+            while len(batch) < self.__BATCH_SIZE:
+                try:
+                    batch.append(self.__queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = None in batch
+            for level, record in filter(None, batch):
+                stream = sys.stderr if level >= LEVEL_WARNING else sys.stdout
+                stream.write(json.dumps(record, default=str) + "\n")
+
+            if self.__dropped:
+                dropped, self.__dropped = self.__dropped, 0
+                sys.stderr.write(json.dumps({
+                    "ts":       datetime.now().isoformat(timespec="milliseconds"),
+                    "level":    LEVEL_NAMES[LEVEL_WARNING],
+                    "logger":   "logger",
+                    "msg":      f"dropped {dropped} log records, queue full",
+                }) + "\n")
+
+            sys.stdout.flush()
+            sys.stderr.flush()
+            if stop:
+                return
+
+
+_writer = _LogWriter()
+
+
+def log(level: int, name: str, msg: str, **fields) -> None:
+    if level >= _writer.level:
+        _writer.write(level, name, msg, fields)
+
+
 class BaseLogger:
-    def _log_err(self, msg: str) -> None:
-        print(f"[{datetime.now().strftime('%H:%M:%S')}] {msg}")
-    
-    def _log(self, msg: str) -> None:
-        print(f"[{datetime.now().strftime('%H:%M:%S')}] {msg}")
\ No newline at end of file
+    def _log_err(self, msg: str, **fields) -> None:
+        log(LEVEL_ERROR, type(self).__name__, msg, **fields)
+
+    def _log_warn(self, msg: str, **fields) -> None:
+        log(LEVEL_WARNING, type(self).__name__, msg, **fields)
+
+    def _log(self, msg: str, **fields) -> None:
+        log(LEVEL_INFO, type(self).__name__, msg, **fields)
+
+    def _log_debug(self, msg: str, sample: bool = False, **fields) -> None:
+        # sample=True for hot paths: only every LOG_DEBUG_SAMPLE_EVERY-th call of a call site is kept
+        if _writer.level > LEVEL_DEBUG:
+            return
+        if sample:
+            caller = sys._getframe(1)
+            represents = _writer.sampled((caller.f_code, caller.f_lineno))
+            if not represents:
+                return
+            fields["sampled"] = represents
+        _writer.write(LEVEL_DEBUG, type(self).__name__, msg, fields)
@@ -1,98 +1,243 @@
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager, contextmanager, AsyncExitStack
+from dataclasses import dataclass
 import asyncio
+import hashlib
 import json
 import os
+import shutil
+import time
+import uuid
+import zlib
 
 from dotenv import load_dotenv
 load_dotenv()
 
-from modules.logger import BaseLogger
+from modules.logger import BaseLogger, log_context, bind_log_context
 from modules.config import ProjectConfig
 from modules.db import Database
-from modules.defectdojo import DefectDojo, DefectDojoReport
+from modules.defectdojo import DefectDojo, DefectDojoReport, MINIMUM_SEVERITY
 from modules.git import Gitlab
 from modules.scanner import ScannRunner
 from modules.rocket import Rocket
+from modules.scheduler import Scheduler
+from modules.workspace import Workspace, Allocation
+from modules.reports import slim_report, SlimResult, FindingsDelta, detach_project_path, attach_project_path
+from modules.metrics import STAGE_DURATION, TARGETS_IN_PROGRESS
+from modules.tracing import span
 
 from modules.db import Tables, ProjectColumns, ImageColumns, DastColumns
+from modules.db import ProjectRow, ImageRow
+from modules.db import JournalStages, JOURNAL_STAGES_ORDER, DurationColumns
 
-MESSAGE_PROJECT_REPORT = """:small_blue_diamond: {team}
+MESSAGE_FINDINGS_TOTAL = ":warning: Continous monitoring found {findings_count} vulnerabilities"
 
-:warning: Continous monitoring found {findings_count} vulnerabilities
+MESSAGE_FINDINGS_DELTA = ":warning: Continous monitoring found {new_count} new and {closed_count} closed vulnerabilities, {findings_count} open"
+
+MESSAGE_PROJECT_REPORT = """{summary}
 – DefectDojo: https://defectdojo.ru/product/{project_id}
 – Gitlab: https://git.ru/{gitlab_url}
 – Branch: {gitlab_branch}
 """
 
-MESSAGE_IMAGE_REPORT = """:small_blue_diamond: {team}
-
-:warning: Continous monitoring found {findings_count} vulnerabilities
+MESSAGE_IMAGE_REPORT = """{summary}
 – Image: {image_url}
 – DefectDojo: https://defectdojo.ru/engagement/{engagement_id}
 – Gitlab: https://git.ru/{gitlab_url}
 – Branch: {gitlab_branch}
 """
 
+@dataclass(eq=False)
+class _ImageWorkspace:
+    # one workspace allocation per image digest and run, shared by the engagements scanning that image
+    image_ref:  str
+    admitted:   asyncio.Future                  # Allocation, or None when it does not fit
+    stack:      AsyncExitStack                  # holds the allocation until the last engagement is done
+    users:      int = 1
+    scan:       asyncio.Future | None = None    # shared reports dir once the image is scanned
+
+
 class Main(BaseLogger):
 
-    __BASE_TMP_PATH = "./.tmp"
+    __REFRESH_INTERVAL = timedelta(days=1)
 
-    def __init__(self, dd: DefectDojo, gitlab: Gitlab, scanner: ScannRunner, db: Database, rocket: Rocket) -> None:
+    __WORKERS           = 5
+    __REPORTS_POOL_SIZE = 2
+    __LEASE_TTL         = timedelta(minutes=10)
+    __LEASE_HEARTBEAT   = 120   # seconds
+
+    # unchanged reports are still re-imported this often, so DefectDojo cannot drift for good
+    __FINGERPRINTS_MAX_AGE  = timedelta(days=7)
+    __DELTA_TITLES_LIMIT    = 5
+
+    def __init__(self, dd: DefectDojo, gitlab: Gitlab, scanner: ScannRunner, db: Database, rocket: Rocket,
+                 scheduler: Scheduler, workspace: Workspace, runner_id: str, run_id: str) -> None:
         self.dd         = dd
         self.gitlab     = gitlab
         self.scanner    = scanner
         self.db         = db
         self.rocket     = rocket
+        self.scheduler  = scheduler
+        self.workspace  = workspace
+
+        # runners sharing run_id split one inventory pass between them
+        self.runner_id  = runner_id
+        self.run_id     = run_id
+
+        # dd_project_id -> project, filled once per run for image notifications
+        self.__projects_cache: dict[int, ProjectRow] = {}
+        # run id -> image digest -> workspace holding its single scan
+        self.__image_workspaces: dict[str, dict[str, _ImageWorkspace]] = {}
+        # (table, row id) -> journal run id of targets whose report waits in the rocket buffer;
+        # their leases are kept, and last_run_id left unstamped, until the digest is delivered
+        self.__undelivered: dict[tuple[Tables, int], str] = {}
+        self.__undelivered_heartbeat: asyncio.Task | None = None
+        # keeps report json parsing off the event loop
+        self.__reports_pool: ProcessPoolExecutor | None = None
 
     async def sync_projects_with_db(self, projects: list[ProjectConfig]) -> None:
+        db_projects = await self.db.fetch_all(Tables.PROJECTS)
+        if db_projects == None:
+            self._log_err("failed to get db projects")
+            return
+
+        # (gitlab_url, gitlab_branch) -> rows, duplicates are kept so the extra ones get deactivated
+        db_by_key: dict[tuple[str, str], list[ProjectRow]] = {}
+        for db_project in db_projects:
+            db_by_key.setdefault((db_project.gitlab_url, db_project.gitlab_branch), []).append(db_project)
+
+        matched: list[tuple[ProjectConfig, ProjectRow]] = []
+        unmatched: list[ProjectConfig] = []
         for project in projects:
-            db_project = await self.db.fetch_row(
+            rows = db_by_key.get((project.gitlab_url, project.gitlab_branch))
+            if rows:
+                matched.append((project, rows.pop(0)))
+            else:
+                unmatched.append(project)
+
+        # a branch changed in config keeps the row, and the product, it had under the old branch
+        leftovers: dict[str, list[ProjectRow]] = {}
+        for rows in db_by_key.values():
+            for db_project in rows:
+                leftovers.setdefault(db_project.gitlab_url, []).append(db_project)
+        for project in unmatched:
+            rows = leftovers.get(project.gitlab_url)
+            if rows:
+                matched.append((project, rows.pop(0)))
+                continue
+            self._log(f"adding new project {project.gitlab_url}@{project.gitlab_branch}")
+            await self.__add_new_project(project)
+
+        for project, db_project in matched:
+            config_hash = project.config_hash()
+            if db_project.config_hash == config_hash and db_project.is_active:
+                continue
+
+            self._log(f"[{db_project.dd_project_id}] updating changed project {project.gitlab_url}")
+            await self.db.update_row_columns(
                 Tables.PROJECTS,
-                ProjectColumns.GITLAB_URL,
-                project.gitlab_url
+                ProjectColumns.ID,
+                db_project.id,
+                {
+                    ProjectColumns.IS_ACTIVE:       True,
+                    ProjectColumns.GITLAB_BRANCH:   project.gitlab_branch,
+                    ProjectColumns.TEAM:            project.team,
+                    ProjectColumns.CONFIG_HASH:     config_hash,
+                    ProjectColumns.SCAN_INTERVAL_DAYS: project.scan_interval_days
+                }
             )
-            if not db_project:
-                self._log(f"adding new project {project.gitlab_url}")
-                await self.__add_new_project(project)
+            await self.db.update_row(
+                Tables.IMAGES,
+                ImageColumns.PROJECT_ID,
+                db_project.dd_project_id,
+                ImageColumns.SCAN_INTERVAL_DAYS,
+                project.scan_interval_days
+            )
+            if not db_project.is_active:
+                await self.__set_project_images_active(db_project.dd_project_id, True)
+
+        # projects left are not in config anymore
+        for db_project in (db_project for rows in leftovers.values() for db_project in rows):
+            if not db_project.is_active:
                 continue
-            self._log(f"syncing existing project {project.gitlab_url}")
+            self._log(f"[{db_project.dd_project_id}] deactivating removed project {db_project.gitlab_url}")
+            await self.db.update_row(
+                Tables.PROJECTS,
+                ProjectColumns.ID,
+                db_project.id,
+                ProjectColumns.IS_ACTIVE,
+                False
+            )
+            await self.__set_project_images_active(db_project.dd_project_id, False)
+
+    async def refresh_projects(self) -> None:
+        db_projects = await self.db.fetch_all(Tables.PROJECTS)
+        if db_projects == None:
+            self._log_err("failed to get db projects for refresh")
+            return
+
+        for db_project in db_projects:
+            if not db_project.is_active:
+                continue
+            if db_project.synced_at and datetime.now() - db_project.synced_at < self.__REFRESH_INTERVAL:
+                continue
+
+            self._log(f"syncing existing project {db_project.gitlab_url}")
             await self.__sync_single_project(db_project)
+            await self.db.update_row(
+                Tables.PROJECTS,
+                ProjectColumns.ID,
+                db_project.id,
+                ProjectColumns.SYNCED_AT,
+                datetime.now()
+            )
+
+    async def __set_project_images_active(self, project_id: int, is_active: bool) -> None:
+        await self.db.update_row(
+            Tables.IMAGES,
+            ImageColumns.PROJECT_ID,
+            project_id,
+            ImageColumns.IS_ACTIVE,
+            is_active
+        )
 
-    async def __sync_single_project(self, db_project: dict) -> None:
-        last_scan_at = await self.dd.get_engagement_last_update(db_project[ProjectColumns.DD_PROJECT_ID.value])
-        if last_scan_at > db_project[ProjectColumns.LAST_SCAN_AT.value]:
-            self._log(f"[{db_project[ProjectColumns.DD_PROJECT_ID.value]}] updating last_scan_at")
+    async def __sync_single_project(self, db_project: ProjectRow) -> None:
+        last_scan_at = await self.dd.get_engagement_last_update(db_project.dd_project_id)
+        if last_scan_at > db_project.last_scan_at:
+            self._log(f"[{db_project.dd_project_id}] updating last_scan_at")
             await self.db.update_row(
                 Tables.PROJECTS,
                 ProjectColumns.ID,
-                db_project[ProjectColumns.ID.value],
+                db_project.id,
                 ProjectColumns.LAST_SCAN_AT,
                 last_scan_at
             )
 
-        self._log(f"[{db_project[ProjectColumns.DD_PROJECT_ID.value]}] getting dd images")
+        self._log(f"[{db_project.dd_project_id}] getting dd images")
         dd_images = await self.dd.get_images_from_engs(
-            db_project[ProjectColumns.DD_PROJECT_ID.value]
+            db_project.dd_project_id
         )
-        self._log(f"[{db_project[ProjectColumns.DD_PROJECT_ID.value]}] getting db images")
+        self._log(f"[{db_project.dd_project_id}] getting db images")
         db_images = await self.db.fetch_rows(
             Tables.IMAGES,
             ImageColumns.PROJECT_ID,
-            db_project[ProjectColumns.DD_PROJECT_ID.value]
+            db_project.dd_project_id
         )
         if dd_images == None or db_images == None:
-            self._log_err(f"[{db_project[ProjectColumns.DD_PROJECT_ID.value]}] failed to get dd_images or db_images\n           dd_images: {dd_images}\n           db_images: {db_images}")
+            self._log_err(f"[{db_project.dd_project_id}] failed to get dd_images or db_images\n           dd_images: {dd_images}\n           db_images: {db_images}")
             return
 
-        self._log(f"[{db_project[ProjectColumns.DD_PROJECT_ID.value]}] syncing dd & db images")
+        self._log(f"[{db_project.dd_project_id}] syncing dd & db images")
         await self.__sync_images(
-            db_project[ProjectColumns.DD_PROJECT_ID.value],
+            db_project.dd_project_id,
+            db_project.scan_interval_days,
             dd_images,
             db_images
         )
     
-    async def __sync_images(self, project_id: str, dd_images: list[tuple[int, str]], db_images: list[dict]) -> None:
-        set_dd_images, set_db_images = set([dd_image[0] for dd_image in dd_images]), set([db_image[ImageColumns.ENGAGEMENT_ID.value] for db_image in db_images])
+    async def __sync_images(self, project_id: str, scan_interval_days: int, dd_images: list[tuple[int, str]], db_images: list[ImageRow]) -> None:
+        set_dd_images, set_db_images = set([dd_image[0] for dd_image in dd_images]), set([db_image.engagement_id for db_image in db_images])
         sets_intersection = set_dd_images & set_db_images
         old_images, new_images = None, None
 
@@ -134,22 +279,23 @@ class Main(BaseLogger):
                         ImageColumns.IMAGE_URL:     dd_image[1],
                         ImageColumns.IS_ACTIVE:     True,
                         ImageColumns.LAST_SCAN_AT:  dd_image[2],
-                        ImageColumns.PROJECT_ID:    project_id
+                        ImageColumns.PROJECT_ID:    project_id,
+                        ImageColumns.SCAN_INTERVAL_DAYS: scan_interval_days
                     }
                 )
 
         for dd_image in dd_images:
             if dd_image[0] not in sets_intersection:
                 continue
-            db_image = next(db_image for db_image in db_images if db_image[ImageColumns.ENGAGEMENT_ID.value] == dd_image[0])
-            if dd_image[2] < db_image[ImageColumns.LAST_SCAN_AT.value]:
+            db_image = next(db_image for db_image in db_images if db_image.engagement_id == dd_image[0])
+            if dd_image[2] < db_image.last_scan_at:
                 continue
 
-            self._log(f"[{db_image[ImageColumns.IMAGE_URL.value]}] updating last_scan_at")
+            self._log(f"[{db_image.image_url}] updating last_scan_at")
             await self.db.update_row(
                 Tables.IMAGES,
                 ImageColumns.ID,
-                db_image[ImageColumns.ID.value],
+                db_image.id,
                 ImageColumns.LAST_SCAN_AT,
                 dd_image[2]
             )
@@ -159,6 +305,12 @@ class Main(BaseLogger):
         if not dd_project_id:
             self._log_err(f"failed to get dd product {project.gitlab_url}")
             return
+
+        # products are looked up by gitlab_url, another branch of it already owns this one
+        tracked = await self.db.fetch_row(Tables.PROJECTS, ProjectColumns.DD_PROJECT_ID, dd_project_id)
+        if tracked:
+            self._log_err(f"[{dd_project_id}] skipping {project.gitlab_url}@{project.gitlab_branch}: product already tracked for branch {tracked.gitlab_branch}")
+            return
         
         last_scan_at = await self.dd.get_engagement_last_update(dd_project_id)
 
@@ -170,7 +322,10 @@ class Main(BaseLogger):
                 ProjectColumns.GITLAB_BRANCH:   project.gitlab_branch,
                 ProjectColumns.DD_PROJECT_ID:   dd_project_id,
                 ProjectColumns.LAST_SCAN_AT:    last_scan_at,
-                ProjectColumns.TEAM:            project.team
+                ProjectColumns.TEAM:            project.team,
+                ProjectColumns.CONFIG_HASH:     project.config_hash(),
+                ProjectColumns.SYNCED_AT:       datetime.now(),
+                ProjectColumns.SCAN_INTERVAL_DAYS: project.scan_interval_days
             }
         )
         dd_images = await self.dd.get_images_from_engs(dd_project_id)
@@ -187,101 +342,244 @@ class Main(BaseLogger):
                     ImageColumns.IMAGE_URL:     dd_image[1],
                     ImageColumns.IS_ACTIVE:     True,
                     ImageColumns.LAST_SCAN_AT:  dd_image[2],
-                    ImageColumns.PROJECT_ID:    dd_project_id
+                    ImageColumns.PROJECT_ID:    dd_project_id,
+                    ImageColumns.SCAN_INTERVAL_DAYS: project.scan_interval_days
                 }
             )
 
     async def process_projects_from_db(self) -> None:
-        offset, limit = 0, 5
-        while True:
-            projects = await self.db.fetch_rows_page(
-                Tables.PROJECTS,
-                offset,
-                limit
-            )
-            if projects == None:
-                self._log_err(f"failed to get projects (offest = {offset}, limit = {limit})")
-                continue
-            
-            if len(projects) == 0:
-                break
-
-            tasks = [self.__process_project(project) for project in projects]
-            await asyncio.gather(*tasks)
-            offset += limit
+        await self.__process_leased(Tables.PROJECTS, self.__process_project)
     
-    async def __process_project(self, project: dict) -> None:
-        self._log(f"[{project[ProjectColumns.DD_PROJECT_ID.value]}] processing")
+    async def __process_project(self, project: ProjectRow, run_id: str) -> None:
+        self._log(f"[{project.dd_project_id}] processing")
 
-        if project[ProjectColumns.IS_ACTIVE.value] == False:
-            self._log(f"[{project[ProjectColumns.DD_PROJECT_ID.value]}] skipping (project is not active)")
-            return
-        
-        last_scan_delta = datetime.now().date() - project[ProjectColumns.LAST_SCAN_AT.value]
-        delta_limit = timedelta(days=0)
-        if last_scan_delta < delta_limit:
-            self._log(f"[{project[ProjectColumns.DD_PROJECT_ID.value]}] skipping (time delta is {last_scan_delta})")
+        if project.is_active == False:
+            self._log(f"[{project.dd_project_id}] skipping (project is not active)")
             return
         
-        self._log(f"[{project[ProjectColumns.DD_PROJECT_ID.value]}] cloning repository")
-        project_path = f"{self.__BASE_TMP_PATH}/project/{project[ProjectColumns.DD_PROJECT_ID.value]}/"
-        if not self.gitlab.clone_repository(project[ProjectColumns.GITLAB_URL.value], project[ProjectColumns.GITLAB_BRANCH.value], project_path):
-            self._log_err(f"[{project[ProjectColumns.DD_PROJECT_ID.value]}] failed to clone")
+        stage = await self.db.fetch_journal_stage(run_id, Tables.PROJECTS, project.id)
+        if stage == JournalStages.NOTIFIED:
+            self._log(f"[{project.dd_project_id}] skipping (already finished in run {run_id})")
             return
-        
-        reports_dir = f"{self.__BASE_TMP_PATH}/reports/{project[ProjectColumns.DD_PROJECT_ID.value]}"
-        if not os.path.exists(reports_dir):
-            os.makedirs(reports_dir)
-        
-        self._log(f"[{project[ProjectColumns.DD_PROJECT_ID.value]}] scaning...")
-        await self.scanner.scan_project(project[ProjectColumns.DD_PROJECT_ID.value], project_path, reports_dir)
-        self.gitlab.clean_dir(project_path, project[ProjectColumns.DD_PROJECT_ID.value])
 
-        if len(os.listdir(reports_dir)) == 0:
-            self._log(f"[{project[ProjectColumns.DD_PROJECT_ID.value]}] no reports to upload")
-            return
-        
-        self._log(f"[{project[ProjectColumns.DD_PROJECT_ID.value]}] uploading reports...")
-        await self.__send_project_reports(project, reports_dir)
-        self.gitlab.clean_dir(reports_dir, project[ProjectColumns.DD_PROJECT_ID.value])
-
-        self._log(f"[{project[ProjectColumns.DD_PROJECT_ID.value]}] updating last_scan_at")
-        await self.db.update_row(
-            Tables.PROJECTS,
-            ProjectColumns.ID,
-            project[ProjectColumns.ID.value],
-            ProjectColumns.LAST_SCAN_AT,
-            datetime.now().date()
-        )
+        async with self.workspace.allocate(f"project/{project.dd_project_id}", project.workspace_bytes) as allocation:
+            if allocation == None:
+                self._log_err(f"[{project.dd_project_id}] skipping (not enough disk space)")
+                return
+
+            project_path = allocation.path("repo")
+            reports_dir = allocation.path("reports")
+
+            # a resumed stage is only trusted while its artifacts survived the restart
+            if stage == JournalStages.CLONED and not os.path.exists(project_path):
+                stage = None
+            if stage == JournalStages.SCANNED and not os.path.exists(reports_dir):
+                stage = None
+
+            durations: dict[DurationColumns, float] = {}
+            # None when the change is unknown, e.g. on first import or after a resumed upload
+            delta = None
+
+            if not self.__stage_reached(stage, JournalStages.CLONED):
+                with self.__stage("clone"):
+                    self._log(f"[{project.dd_project_id}] cloning repository")
+                    started_at = time.monotonic()
+                    if not await self.gitlab.checkout_worktree(project.gitlab_url, project.gitlab_branch, project_path, run_id):
+                        self._log_err(f"[{project.dd_project_id}] failed to clone")
+                        return
+                    durations[DurationColumns.CLONE_SECONDS] = time.monotonic() - started_at
+                    # the clone is most of the footprint, what is left of the reservation goes back
+                    await self.workspace.measure(allocation)
+                    await self.__save_stage(run_id, Tables.PROJECTS, project.id, JournalStages.CLONED)
+
+            if not self.__stage_reached(stage, JournalStages.SCANNED):
+                with self.__stage("scan"):
+                    self.gitlab.clean_dir(reports_dir, project.dd_project_id)
+                    os.makedirs(reports_dir)
+
+                    self._log(f"[{project.dd_project_id}] scaning...")
+                    started_at = time.monotonic()
+                    sca_keys = await self.__sca_cache_keys(project, project_path)
+                    cached = await self.__restore_sca_reports(project, project_path, sca_keys, reports_dir)
+                    await self.scanner.scan_project(project.dd_project_id, project_path, reports_dir, skip=cached)
+                    await self.__store_sca_reports(project_path, sca_keys, cached, reports_dir)
+                    durations[DurationColumns.SCAN_SECONDS] = time.monotonic() - started_at
+                    await self.workspace.measure(allocation)
+                    self.gitlab.clean_dir(project_path, project.dd_project_id)
+                    await self.workspace.measure(allocation, settle=True)
+                    await self.db.record_footprint(Tables.PROJECTS, project.id, allocation.peak)
+                    await self.__save_stage(run_id, Tables.PROJECTS, project.id, JournalStages.SCANNED)
+
+            if not self.__stage_reached(stage, JournalStages.UPLOADED):
+                with self.__stage("upload"):
+                    if len(os.listdir(reports_dir)) == 0:
+                        self._log(f"[{project.dd_project_id}] no reports to upload")
+                        self.gitlab.clean_dir(reports_dir, project.dd_project_id)
+                        await self.__record_durations(Tables.PROJECTS, project.id, durations)
+                        await self.__save_stage(run_id, Tables.PROJECTS, project.id, JournalStages.NOTIFIED)
+                        return
+
+                    self._log(f"[{project.dd_project_id}] uploading reports...")
+                    started_at = time.monotonic()
+                    delta = await self.__send_project_reports(project, reports_dir)
+                    durations[DurationColumns.UPLOAD_SECONDS] = time.monotonic() - started_at
+                    self.gitlab.clean_dir(reports_dir, project.dd_project_id)
+
+                    self._log(f"[{project.dd_project_id}] updating last_scan_at")
+                    await self.db.update_row(
+                        Tables.PROJECTS,
+                        ProjectColumns.ID,
+                        project.id,
+                        ProjectColumns.LAST_SCAN_AT,
+                        datetime.now().date()
+                    )
+                    await self.__save_stage(run_id, Tables.PROJECTS, project.id, JournalStages.UPLOADED)
+
+            await self.__record_durations(Tables.PROJECTS, project.id, durations)
+            with self.__stage("notify"):
+                findings_count = await self.dd.get_product_findings(project.dd_project_id)
+                if findings_count == None or findings_count == -1:
+                    self._log_err(f"[{project.dd_project_id}] failed to get findings count")
+                    findings_count = None
+                else:
+                    # refreshed even when nothing changed, the scheduler ranks targets by it
+                    await self.db.update_row(
+                        Tables.PROJECTS,
+                        ProjectColumns.ID,
+                        project.id,
+                        ProjectColumns.FINDINGS_COUNT,
+                        findings_count
+                    )
+
+                if delta != None and delta.is_empty():
+                    self._log(f"[{project.dd_project_id}] no new or closed findings, skipping notification")
+                    await self.__save_stage(run_id, Tables.PROJECTS, project.id, JournalStages.NOTIFIED)
+                    return
+                if findings_count == None:
+                    return
+                if findings_count == 0 and delta == None:
+                    await self.__save_stage(run_id, Tables.PROJECTS, project.id, JournalStages.NOTIFIED)
+                    return
+
+
+                self.rocket.add_message(
+                    project.team,
+                    MESSAGE_PROJECT_REPORT.format(
+                        summary=self.__findings_summary(findings_count, delta),
+                        project_id=project.dd_project_id,
+                        gitlab_url=project.gitlab_url,
+                        gitlab_branch=project.gitlab_branch
+                    ),
+                    scope=run_id,
+                    on_sent=self.__await_delivery(Tables.PROJECTS, project.id, run_id)
+                )
 
-        findings_count = await self.dd.get_product_findings(project[ProjectColumns.DD_PROJECT_ID.value])
-        if findings_count == None or findings_count == -1:
-            self._log_err(f"[{project[ProjectColumns.DD_PROJECT_ID.value]}] failed to get findings count")
-            return
-        elif findings_count == 0:
-            return
-        
-        
-        self.rocket.send_message(
-            MESSAGE_PROJECT_REPORT.format(
-                team=project[ProjectColumns.TEAM.value],
-                findings_count=findings_count,
-                project_id=project[ProjectColumns.DD_PROJECT_ID.value],
-                gitlab_url=project[ProjectColumns.GITLAB_URL.value],
-                gitlab_branch=project[ProjectColumns.GITLAB_BRANCH.value]
-            )
-        )
-        
-    async def __send_project_reports(self, project: dict, reports_dir: str) -> None:
-        endpoint_id = await self.dd.get_endpoint_id(project[ProjectColumns.DD_PROJECT_ID.value])
+    async def __sca_cache_keys(self, project: ProjectRow, project_path: str) -> dict[int, str]:
+        scanners = self.scanner.get_project_scanners()
+        if not any(scanner.sca for scanner in scanners):
+            return {}
+
+        db_version = await self.scanner.vuln_db_version()
+        if not db_version:
+            return {}
+
+        manifests_digest = await self.scanner.dependency_manifests_digest(project_path)
+        if manifests_digest == None:
+            self._log(f"[{project.dd_project_id}] no dependency manifests found, sca reports are not cached")
+            return {}
+        return {
+            scanner_idx: self.scanner.sca_cache_key(scanner, manifests_digest, db_version)
+            for scanner_idx, scanner in enumerate(scanners) if scanner.sca
+        }
+
+    async def __restore_sca_reports(self, project: ProjectRow, project_path: str, sca_keys: dict[int, str],
+                                    reports_dir: str) -> set[int]:
+        cached = set()
+        for scanner_idx, cache_key in sca_keys.items():
+            report = await self.db.fetch_sca_report(cache_key)
+            if report == None:
+                continue
+            # reports are cached across projects, paths are pointed back at this checkout
+            with open(os.path.join(reports_dir, f"{scanner_idx}.json"), "wb") as f:
+                f.write(attach_project_path(zlib.decompress(report), project_path))
+            cached.add(scanner_idx)
+            self._log(f"[{project.dd_project_id}] reusing cached sca report for scanner {scanner_idx}")
+        return cached
+
+    async def __store_sca_reports(self, project_path: str, sca_keys: dict[int, str], cached: set[int], reports_dir: str) -> None:
+        for scanner_idx, cache_key in sca_keys.items():
+            report_path = os.path.join(reports_dir, f"{scanner_idx}.json")
+            if scanner_idx in cached or not os.path.exists(report_path):
+                continue
+            with open(report_path, "rb") as f:
+                report = await asyncio.to_thread(zlib.compress, detach_project_path(f.read(), project_path))
+            await self.db.save_sca_report(cache_key, report)
+
+    @contextmanager
+    def __stage(self, stage: str):
+        bind_log_context(stage=stage)
+        with span(stage, "stage"):
+            yield
+
+    def __stage_reached(self, stage: JournalStages | None, target: JournalStages) -> bool:
+        return stage != None and JOURNAL_STAGES_ORDER.index(stage) >= JOURNAL_STAGES_ORDER.index(target)
+
+    async def __save_stage(self, run_id: str, table: Tables, target_id: int, stage: JournalStages) -> None:
+        await self.db.save_journal_stage(run_id, table, target_id, stage)
+
+    def __await_delivery(self, table: Tables, target_id: int, journal_run_id: str):
+        # the target stays leased until its digest went out, a crash before that leaves it
+        # claimable again in the same run, resuming at the notify stage
+        self.__undelivered[(table, target_id)] = journal_run_id
+        if self.__undelivered_heartbeat == None or self.__undelivered_heartbeat.done():
+            self.__undelivered_heartbeat = asyncio.create_task(self.__heartbeat_undelivered())
+        run_id = self.run_id
+
+        async def delivered() -> None:
+            await self.__save_stage(journal_run_id, table, target_id, JournalStages.NOTIFIED)
+            self.__undelivered.pop((table, target_id), None)
+            await self.db.release_row(table, self.runner_id, run_id, target_id)
+        return delivered
+
+    async def flush_notifications(self, journal_run_id: str) -> None:
+        try:
+            await self.rocket.flush(journal_run_id)
+        finally:
+            # undelivered targets are handed back unfinished, the next pass of the run notifies again
+            for (table, target_id), pending_run_id in list(self.__undelivered.items()):
+                if pending_run_id != journal_run_id:
+                    continue
+                del self.__undelivered[(table, target_id)]
+                self._log_err(f"[{table.value} {target_id}] notification was not delivered, left for the next pass")
+                await self.db.release_row(table, self.runner_id, None, target_id)
+
+    async def __heartbeat_undelivered(self) -> None:
+        while self.__undelivered:
+            await asyncio.sleep(self.__LEASE_HEARTBEAT)
+            for table in set(table for table, _ in self.__undelivered):
+                ids = [target_id for pending_table, target_id in self.__undelivered if pending_table == table]
+                await self.db.extend_leases(table, self.runner_id, ids, self.__LEASE_TTL)
+
+    async def recover_leases(self, runner_prefix: str) -> None:
+        # a restarted runner frees what its previous process held instead of waiting out the TTL
+        for table in (Tables.PROJECTS, Tables.IMAGES):
+            await self.db.release_stale_leases(table, runner_prefix, self.runner_id)
+
+    async def __record_durations(self, table: Tables, target_id: int, durations: dict[DurationColumns, float]) -> None:
+        for column, seconds in durations.items():
+            STAGE_DURATION.observe(table.value, column.value.removesuffix("_seconds"), value=seconds)
+        await self.db.record_durations(table, target_id, durations)
+
+    async def __send_project_reports(self, project: ProjectRow, reports_dir: str) -> FindingsDelta | None:
+        endpoint_id = await self.dd.get_endpoint_id(project.dd_project_id)
         engagement_id = await self.dd.get_engagement(
-            project[ProjectColumns.DD_PROJECT_ID.value],
-            project[ProjectColumns.GITLAB_BRANCH.value]
+            project.dd_project_id,
+            project.gitlab_branch
         )
 
         if not all([endpoint_id, engagement_id]):
-            self._log_err(f"[{project[ProjectColumns.DD_PROJECT_ID.value]}] failed to send project reports: endpoint = {endpoint_id}, eng = {engagement_id}")
-            return
+            self._log_err(f"[{project.dd_project_id}] failed to send project reports: endpoint = {endpoint_id}, eng = {engagement_id}")
+            return None
         
         scanners = self.scanner.get_project_scanners()
 
@@ -295,106 +593,313 @@ class Main(BaseLogger):
             scanner = scanners[scanner_idx]
             tasks.append(
                 self.__send_report(
-                    project_id = project[ProjectColumns.DD_PROJECT_ID.value],
+                    project_id = project.dd_project_id,
+                    target = (Tables.PROJECTS, project.id),
+                    scanner_key = scanner.path,
                     file_path = os.path.join(reports_dir, report),
-                    scan_type = scanner[self.scanner.CFG_SCAN_TYPE],
+                    scan_type = scanner.scan_type,
                     engagement_id = engagement_id,
                     endpoint_id = endpoint_id,
-                    branch = project[ProjectColumns.GITLAB_BRANCH.value],
-                    report_name = None
+                    branch = project.gitlab_branch,
+                    # one test per scanner, scanners sharing a scan type never touch each other's findings
+                    report_name = scanner.path
                 )
             )
 
-        await asyncio.gather(*tasks)
+        return self.__merge_deltas(await asyncio.gather(*tasks))
+
+    async def __load_projects_cache(self) -> None:
+        projects = await self.db.fetch_all(Tables.PROJECTS)
+        if projects == None:
+            self._log_err("failed to load projects cache")
+            return
+        self.__projects_cache = {project.dd_project_id: project for project in projects}
 
     async def process_images_from_db(self) -> None:
-        offset, limit = 0, 5
+        await self.__load_projects_cache()
+
+        await self.__process_leased(Tables.IMAGES, self.__process_image)
+
+    @asynccontextmanager
+    async def __image_workspace(self, image: ImageRow, run_id: str):
+        # engagements sharing an image within a run share one allocation, admitted once for the digest;
+        # it is released, with the image's reports, when the last engagement using it is done
+        image_ref, digest = await self.scanner.resolve_image(image.project_id, image.image_url)
+        workspaces = self.__image_workspaces.setdefault(run_id, {})
+        shared = workspaces.get(digest)
+        if shared:
+            shared.users += 1
+        else:
+            shared = _ImageWorkspace(image_ref, asyncio.get_running_loop().create_future(), AsyncExitStack())
+            workspaces[digest] = shared
+            key = f"image/{hashlib.sha256(digest.encode()).hexdigest()[:16]}_{run_id}"
+            try:
+                shared.admitted.set_result(await shared.stack.enter_async_context(self.workspace.allocate(key, image.workspace_bytes)))
+            except BaseException as e:
+                self.__fail_future(shared.admitted, e)
+                await self.__leave_image_workspace(run_id, digest, shared)
+                raise
+
+        try:
+            yield shared, await asyncio.shield(shared.admitted)
+        finally:
+            await self.__leave_image_workspace(run_id, digest, shared)
+
+    async def __leave_image_workspace(self, run_id: str, digest: str, shared: _ImageWorkspace) -> None:
+        shared.users -= 1
+        if shared.users > 0:
+            return
+        workspaces = self.__image_workspaces.get(run_id, {})
+        if workspaces.get(digest) is shared:
+            del workspaces[digest]
+        if not workspaces:
+            self.__image_workspaces.pop(run_id, None)
+        await shared.stack.aclose()
+
+    async def __scan_image_once(self, image: ImageRow, shared: _ImageWorkspace, allocation: Allocation) -> str:
+        if shared.scan:
+            self._log(f"[{image.project_id}] reusing scan of {shared.image_ref}")
+            return await asyncio.shield(shared.scan)
+
+        shared.scan = asyncio.get_running_loop().create_future()
+        shared_reports_dir = allocation.path("image")
+        try:
+            self.gitlab.clean_dir(shared_reports_dir, image.project_id)
+            os.makedirs(shared_reports_dir)
+            await self.scanner.scan_image(image.project_id, shared.image_ref, shared_reports_dir)
+        except BaseException as e:
+            # engagements waiting on this scan fail with the same error, the next one scans again
+            self.__fail_future(shared.scan, e)
+            shared.scan = None
+            raise
+        shared.scan.set_result(shared_reports_dir)
+        return shared_reports_dir
+
+    def __fail_future(self, future: asyncio.Future, e: BaseException) -> None:
+        if isinstance(e, asyncio.CancelledError):
+            future.cancel()
+            return
+        future.set_exception(e)
+        # retrieved here so a future nobody waited on is not logged as unhandled
+        future.exception()
+
+    def __link_reports(self, src_dir: str, dest_dir: str) -> None:
+        for report in os.listdir(src_dir):
+            src, dest = os.path.join(src_dir, report), os.path.join(dest_dir, report)
+            try:
+                os.link(src, dest)
+            except OSError:
+                shutil.copyfile(src, dest)
+
+    async def __process_leased(self, table: Tables, process) -> None:
+        expected = await self.db.fetch_expected_durations(
+            table,
+            self.run_id,
+            self.scheduler.expected_duration(table)
+        )
+        if expected != None:
+            makespan = self.scheduler.predict_makespan(expected, self.__WORKERS)
+            self._log(f"{len(expected)} {table.value} due, predicted run time {timedelta(seconds=int(makespan))} with {self.__WORKERS} workers")
+
+        held: set[int] = set()
+        heartbeat = asyncio.create_task(self.__heartbeat_leases(table, held))
+        try:
+            async with asyncio.timeout(self.scheduler.time_left()):
+                tasks = [self.__lease_worker(table, process, held) for _ in range(self.__WORKERS)]
+                await asyncio.gather(*tasks)
+        except TimeoutError:
+            self._log_err(f"run deadline reached, cancelled {table.value} in progress")
+        finally:
+            heartbeat.cancel()
+
+    async def __lease_worker(self, table: Tables, process, held: set[int]) -> None:
         while True:
-            images = await self.db.fetch_rows_page(
-                Tables.IMAGES,
-                offset,
-                limit
+            rows = await self.db.claim_rows(
+                table,
+                self.runner_id,
+                self.run_id,
+                1,
+                self.__LEASE_TTL,
+                self.scheduler.expected_duration(table),
+                self.scheduler.time_left()
             )
-            if images == None:
-                self._log_err(f"failed to get images (offset = {offset}, limit = {limit})")
-                continue
-            
-            if len(images) == 0:
-                break
-
-            tasks = [self.__process_image(image) for image in images]
-            await asyncio.gather(*tasks)
-            offset += limit
-
-    async def __process_image(self, image: dict) -> None:
-        self._log(f"[{image[ImageColumns.PROJECT_ID.value]}] processing image {image[ImageColumns.IMAGE_URL.value]}")
+            if rows == None:
+                self._log_err(f"failed to claim {table.value}")
+                return
+
+            if len(rows) == 0:
+                return
+
+            held.add(rows[0].id)
+            self._log_debug(f"claimed {table.value} {rows[0].id}", sample=True)
+            await self.__process_lease(table, rows[0], process, held)
+
+    async def __process_lease(self, table: Tables, row: ProjectRow | ImageRow, process, held: set[int],
+                              journal_run_id: str | None = None) -> None:
+        started_at = time.monotonic()
+        run_id = self.run_id
+        context = {"run_id": journal_run_id or self.run_id, "target_type": table.value, "target_id": row.id}
+        if table == Tables.IMAGES:
+            context.update(project_id=row.project_id, image=row.image_url)
+        else:
+            context.update(project_id=row.dd_project_id)
+        TARGETS_IN_PROGRESS.inc(table.value)
+        try:
+            with log_context(**context), span(f"{table.value} {row.id}", "target", **context):
+                await process(row, journal_run_id or self.run_id)
+            self.scheduler.record(table, time.monotonic() - started_at)
+        except asyncio.CancelledError:
+            # unfinished, leave it claimable for the next run
+            run_id = None
+            raise
+        finally:
+            TARGETS_IN_PROGRESS.dec(table.value)
+            held.discard(row.id)
+            # a target awaiting delivery is released once its digest went out
+            if (table, row.id) not in self.__undelivered:
+                await self.db.release_row(table, self.runner_id, run_id, row.id)
+
+    async def process_target(self, table: Tables, row_id: int) -> bool:
+        row = await self.db.claim_row(table, self.runner_id, row_id, self.__LEASE_TTL)
+        if not row:
+            return False
+
+        if table == Tables.IMAGES:
+            process = self.__process_image
+            if row.project_id not in self.__projects_cache:
+                await self.__load_projects_cache()
+        else:
+            process = self.__process_project
+
+        # targeted scans journal separately so a finished cycle does not skip them
+        journal_run_id = f"target-{uuid.uuid4().hex}"
+        held = {row.id}
+        heartbeat = asyncio.create_task(self.__heartbeat_leases(table, held))
+        try:
+            await self.__process_lease(table, row, process, held, journal_run_id)
+        finally:
+            heartbeat.cancel()
+            await self.flush_notifications(journal_run_id)
+        return True
+
+    async def __heartbeat_leases(self, table: Tables, held: set[int]) -> None:
+        while True:
+            await asyncio.sleep(self.__LEASE_HEARTBEAT)
+            if held:
+                await self.db.extend_leases(table, self.runner_id, list(held), self.__LEASE_TTL)
+                self._log_debug(f"extended {len(held)} {table.value} leases", sample=True)
 
-        if image[ImageColumns.IS_ACTIVE.value] == False:
-            self._log(f"[{image[ImageColumns.PROJECT_ID.value]}] skipping (image is not active)")
-            return
+    async def __process_image(self, image: ImageRow, run_id: str) -> None:
+        self._log(f"[{image.project_id}] processing image {image.image_url}")
 
-        last_scan_delta = datetime.now().date() - image[ImageColumns.LAST_SCAN_AT.value]
-        delta_limit = timedelta(days=0)
-        if last_scan_delta < delta_limit:
-            self._log(f"[{image[ImageColumns.PROJECT_ID.value]}] skipping image [{image[ImageColumns.IMAGE_URL.value]}] (time delta is {last_scan_delta})")
+        if image.is_active == False:
+            self._log(f"[{image.project_id}] skipping (image is not active)")
             return
 
-        reports_dir = f"{self.__BASE_TMP_PATH}/reports/{image[ImageColumns.PROJECT_ID.value]}_{image[ImageColumns.ENGAGEMENT_ID.value]}"
-        if not os.path.exists(reports_dir):
-            os.makedirs(reports_dir)
-        
-        self._log(f"[{image[ImageColumns.PROJECT_ID.value]}] scanning image...")
-        await self.scanner.scan_image(image[ImageColumns.PROJECT_ID.value], image[ImageColumns.IMAGE_URL.value], reports_dir)
-
-        if len(os.listdir(reports_dir)) == 0:
-            self._log(f"[{image[ImageColumns.PROJECT_ID.value]}] no reports to upload for {image[ImageColumns.IMAGE_URL.value]}")
+        stage = await self.db.fetch_journal_stage(run_id, Tables.IMAGES, image.id)
+        if stage == JournalStages.NOTIFIED:
+            self._log(f"[{image.project_id}] skipping image [{image.image_url}] (already finished in run {run_id})")
             return
 
-        self._log(f"[{image[ImageColumns.PROJECT_ID.value]}] uploading image reports...")
-        await self.__send_image_reports(image, reports_dir)
-        self.gitlab.clean_dir(reports_dir, image[ImageColumns.PROJECT_ID.value])
-
-        self._log(f"[{image[ImageColumns.PROJECT_ID.value]}] updating last_scan_at")
-        await self.db.update_row(
-            Tables.IMAGES,
-            ImageColumns.ID,
-            image[ImageColumns.ID.value],
-            ImageColumns.LAST_SCAN_AT,
-            datetime.now().date()
-        )
-
-        findings_count = await self.dd.get_product_findings(image[ImageColumns.PROJECT_ID.value])
-        if findings_count == None or findings_count == -1:
-            self._log_err(f"[{image[ImageColumns.PROJECT_ID.value]}] failed to get findings count")
-            return
-        elif findings_count == 0:
-            return
-        
-        dd_project = await self.db.fetch_row(
-            Tables.PROJECTS,
-            ProjectColumns.DD_PROJECT_ID,
-            image[ImageColumns.PROJECT_ID.value]
-        )
-        if not dd_project:
-            self._log_err(f"[{image[ImageColumns.PROJECT_ID.value]}] failed to get dd project")
-            return
-        
-        self.rocket.send_message(
-            MESSAGE_IMAGE_REPORT.format(
-                team=dd_project[ProjectColumns.TEAM.value],
-                findings_count=findings_count,
-                image_url=image[ImageColumns.IMAGE_URL.value],
-                engagement_id=image[ImageColumns.ENGAGEMENT_ID.value],
-                gitlab_url=dd_project[ProjectColumns.GITLAB_URL.value],
-                gitlab_branch=dd_project[ProjectColumns.GITLAB_BRANCH.value]
-            )
-        )
+        async with self.__image_workspace(image, run_id) as (shared, allocation):
+            if allocation == None:
+                self._log_err(f"[{image.project_id}] skipping image [{image.image_url}] (not enough disk space)")
+                return
+
+            reports_dir = allocation.path(f"reports_{image.id}")
+            if stage == JournalStages.SCANNED and not os.path.exists(reports_dir):
+                stage = None
+
+            durations: dict[DurationColumns, float] = {}
+            delta = None
+
+            if not self.__stage_reached(stage, JournalStages.SCANNED):
+                with self.__stage("scan"):
+                    self.gitlab.clean_dir(reports_dir, image.project_id)
+                    os.makedirs(reports_dir)
+
+                    self._log(f"[{image.project_id}] scanning image...")
+                    started_at = time.monotonic()
+                    shared_reports_dir = await self.__scan_image_once(image, shared, allocation)
+                    self.__link_reports(shared_reports_dir, reports_dir)
+                    durations[DurationColumns.SCAN_SECONDS] = time.monotonic() - started_at
+                    await self.workspace.measure(allocation, settle=True)
+                    await self.db.record_footprint(Tables.IMAGES, image.id, allocation.peak)
+                    await self.__save_stage(run_id, Tables.IMAGES, image.id, JournalStages.SCANNED)
+
+            if not self.__stage_reached(stage, JournalStages.UPLOADED):
+                with self.__stage("upload"):
+                    if len(os.listdir(reports_dir)) == 0:
+                        self._log(f"[{image.project_id}] no reports to upload for {image.image_url}")
+                        self.gitlab.clean_dir(reports_dir, image.project_id)
+                        await self.__record_durations(Tables.IMAGES, image.id, durations)
+                        await self.__save_stage(run_id, Tables.IMAGES, image.id, JournalStages.NOTIFIED)
+                        return
+
+                    self._log(f"[{image.project_id}] uploading image reports...")
+                    started_at = time.monotonic()
+                    delta = await self.__send_image_reports(image, reports_dir)
+                    durations[DurationColumns.UPLOAD_SECONDS] = time.monotonic() - started_at
+                    self.gitlab.clean_dir(reports_dir, image.project_id)
+
+                    self._log(f"[{image.project_id}] updating last_scan_at")
+                    await self.db.update_row(
+                        Tables.IMAGES,
+                        ImageColumns.ID,
+                        image.id,
+                        ImageColumns.LAST_SCAN_AT,
+                        datetime.now().date()
+                    )
+                    await self.__save_stage(run_id, Tables.IMAGES, image.id, JournalStages.UPLOADED)
+
+            await self.__record_durations(Tables.IMAGES, image.id, durations)
+            with self.__stage("notify"):
+                findings_count = await self.dd.get_product_findings(image.project_id)
+                if findings_count == None or findings_count == -1:
+                    self._log_err(f"[{image.project_id}] failed to get findings count")
+                    findings_count = None
+                else:
+                    await self.db.update_row(
+                        Tables.IMAGES,
+                        ImageColumns.ID,
+                        image.id,
+                        ImageColumns.FINDINGS_COUNT,
+                        findings_count
+                    )
+
+                if delta != None and delta.is_empty():
+                    self._log(f"[{image.project_id}] no new or closed findings in {image.image_url}, skipping notification")
+                    await self.__save_stage(run_id, Tables.IMAGES, image.id, JournalStages.NOTIFIED)
+                    return
+                if findings_count == None:
+                    return
+                if findings_count == 0 and delta == None:
+                    await self.__save_stage(run_id, Tables.IMAGES, image.id, JournalStages.NOTIFIED)
+                    return
+
+                dd_project = self.__projects_cache.get(image.project_id)
+                if not dd_project:
+                    self._log_err(f"[{image.project_id}] failed to get dd project")
+                    return
+
+                self.rocket.add_message(
+                    dd_project.team,
+                    MESSAGE_IMAGE_REPORT.format(
+                        summary=self.__findings_summary(findings_count, delta),
+                        image_url=image.image_url,
+                        engagement_id=image.engagement_id,
+                        gitlab_url=dd_project.gitlab_url,
+                        gitlab_branch=dd_project.gitlab_branch
+                    ),
+                    scope=run_id,
+                    on_sent=self.__await_delivery(Tables.IMAGES, image.id, run_id)
+                )
 
-    async def __send_image_reports(self, image: dict, reports_dir: str) -> None:
-        endpoint_id = await self.dd.get_endpoint_id(image[ImageColumns.PROJECT_ID.value])
+    async def __send_image_reports(self, image: ImageRow, reports_dir: str) -> FindingsDelta | None:
+        endpoint_id = await self.dd.get_endpoint_id(image.project_id)
         if not endpoint_id:
-            self._log_err(f"[{image[ImageColumns.PROJECT_ID.value]}] failed to send image reports: endpoint = {endpoint_id}")
-            return
+            self._log_err(f"[{image.project_id}] failed to send image reports: endpoint = {endpoint_id}")
+            return None
         
         scanners = self.scanner.get_image_scanners()
 
@@ -408,23 +913,93 @@ class Main(BaseLogger):
             scanner = scanners[scanner_idx]
             tasks.append(
                 self.__send_report(
-                    project_id = image[ImageColumns.PROJECT_ID.value],
+                    project_id = image.project_id,
+                    target = (Tables.IMAGES, image.id),
+                    scanner_key = scanner.path,
                     file_path = os.path.join(reports_dir, report),
-                    scan_type = scanner[self.scanner.CFG_SCAN_TYPE],
-                    engagement_id = image[ImageColumns.ENGAGEMENT_ID.value],
+                    scan_type = scanner.scan_type,
+                    engagement_id = image.engagement_id,
                     endpoint_id = endpoint_id,
                     branch = "continouous-monitoring-images",
-                    report_name = f"{self.scanner.SCANNER_IMAGE_REPORT_NAME_PREFIX}_trivy_{image[ImageColumns.ENGAGEMENT_ID.value]}"
+                    report_name = f"{self.scanner.SCANNER_IMAGE_REPORT_NAME_PREFIX}_trivy_{image.engagement_id}_{scanner.path}"
                 )
             )
-        await asyncio.gather(*tasks)
+        return self.__merge_deltas(await asyncio.gather(*tasks))
 
-    async def __send_report(self, project_id: int, file_path: str, scan_type: str,
+    def __merge_deltas(self, deltas: list[FindingsDelta | None]) -> FindingsDelta | None:
+        # one report without a known delta makes the whole target's delta unknown
+        if not deltas or any(delta == None for delta in deltas):
+            return None
+        merged = FindingsDelta({}, {})
+        for delta in deltas:
+            merged.merge(delta)
+        return merged
+
+    def __findings_summary(self, findings_count: int, delta: FindingsDelta | None) -> str:
+        if delta == None:
+            return MESSAGE_FINDINGS_TOTAL.format(findings_count=findings_count)
+
+        summary = MESSAGE_FINDINGS_DELTA.format(
+            new_count=len(delta.new),
+            closed_count=len(delta.closed),
+            findings_count=findings_count
+        )
+        for label, findings in (("New", delta.new), ("Closed", delta.closed)):
+            if not findings:
+                continue
+            titles = sorted(findings.values())
+            more = f" (+{len(titles) - self.__DELTA_TITLES_LIMIT} more)" if len(titles) > self.__DELTA_TITLES_LIMIT else ""
+            summary += f"\n– {label}: {', '.join(titles[:self.__DELTA_TITLES_LIMIT])}{more}"
+        return summary
+
+    async def __slim_report(self, project_id: int, file_path: str, scan_type: str) -> SlimResult | None:
+        if not self.__reports_pool:
+            self.__reports_pool = ProcessPoolExecutor(max_workers=self.__REPORTS_POOL_SIZE)
+
+        size_before = os.path.getsize(file_path)
+        try:
+            with span("slim report", "reports", scan_type=scan_type):
+                result = await asyncio.get_running_loop().run_in_executor(
+                    self.__reports_pool,
+                    slim_report,
+                    file_path,
+                    scan_type,
+                    MINIMUM_SEVERITY
+                )
+        except Exception as e:
+            self._log_err(f"[{project_id}] failed to slim report {file_path}, uploading as is: {e}")
+            return None
+
+        if result != None:
+            self._log(f"[{project_id}] slimmed report {file_path}: {size_before} -> {os.path.getsize(file_path)} bytes, kept {result.kept}, dropped {result.dropped} findings")
+        return result
+
+    def close(self) -> None:
+        if self.__undelivered_heartbeat:
+            self.__undelivered_heartbeat.cancel()
+        if self.__reports_pool:
+            self.__reports_pool.shutdown(cancel_futures=True)
+            self.__reports_pool = None
+
+    async def __send_report(self, project_id: int, target: tuple[Tables, int], scanner_key: str,
+                            file_path: str, scan_type: str,
                             engagement_id: int | None = None, endpoint_id: int | None = None,
-                            branch: str | None = None, report_name: str | None = None) -> int | None:
+                            branch: str | None = None, report_name: str | None = None) -> FindingsDelta | None:
+        # returns the change against the last imported findings, None when it is unknown
         if not os.path.exists(file_path):
             return None
 
+        slimmed = await self.__slim_report(project_id, file_path, scan_type)
+
+        previous = None
+        if slimmed != None:
+            previous = await self.db.fetch_finding_fingerprints(*target, scanner_key)
+        if previous != None:
+            digest, _, updated_at = previous
+            if digest == slimmed.digest() and datetime.now(timezone.utc) - updated_at < self.__FINGERPRINTS_MAX_AGE:
+                self._log(f"[{project_id}] findings unchanged, skipping upload of {file_path} - {scan_type}")
+                return FindingsDelta({}, {})
+
         with open(file_path, 'rb') as file:
             test_id = await self.dd.send_report(
                 report = DefectDojoReport(
@@ -441,4 +1016,8 @@ class Main(BaseLogger):
                 return None
             
             self._log(f"[{project_id}] uploaded report {file_path} - {scan_type}: test_id = {test_id}")
-            return test_id
\ No newline at end of file
+
+        if slimmed == None:
+            return None
+        await self.db.save_finding_fingerprints(*target, scanner_key, slimmed.digest(), slimmed.fingerprints)
+        return FindingsDelta.between(previous[1], slimmed.fingerprints) if previous != None else None
\ No newline at end of file
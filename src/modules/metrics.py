@@ -0,0 +1,204 @@
+import os
+import re
+from types import SimpleNamespace
+
+import aiohttp
+
+from modules.tracing import TRACER
+
+# Prometheus text exposition format, readable by the node_exporter textfile collector and by scrapes
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+HTTP_BUCKETS    = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+DB_BUCKETS      = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+STAGE_BUCKETS   = (1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1200.0, 3600.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    TYPE = ""
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()) -> None:
+        self.name   = name
+        self.help   = help
+        self.labels = labels
+        self._values: dict[tuple, object] = {}
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.TYPE}"]
+        for values, value in sorted(self._values.items()):
+            lines.extend(self._render_value(values, value))
+        return lines
+
+    def _render_value(self, values: tuple, value) -> list[str]:
+        return [f"{self.name}{_format_labels(self.labels, values)} {value}"]
+
+
+class Counter(_Metric):
+    TYPE = "counter"
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def _render_value(self, values: tuple, value) -> list[str]:
+        return [f"{self.name}_total{_format_labels(self.labels, values)} {value}"]
+
+
+class Gauge(_Metric):
+    TYPE = "gauge"
+
+    def set(self, *labels, value: float) -> None:
+        self._values[labels] = value
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    TYPE = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = HTTP_BUCKETS) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, *labels, value: float) -> None:
+        # per label set: [per-bucket counts..., sum, count]
+        state = self._values.get(labels)
+        if state == None:
+            state = self._values[labels] = [0] * len(self.buckets) + [0.0, 0]
+        for idx, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[idx] += 1
+                break
+        state[-2] += value
+        state[-1] += 1
+
+    def _render_value(self, values: tuple, state) -> list[str]:
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets, state):
+            cumulative += count
+            le = f'le="{bound}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, values, le)} {cumulative}")
+        le = 'le="+Inf"'
+        lines.append(f"{self.name}_bucket{_format_labels(self.labels, values, le)} {state[-1]}")
+        lines.append(f"{self.name}_sum{_format_labels(self.labels, values)} {state[-2]}")
+        lines.append(f"{self.name}_count{_format_labels(self.labels, values)} {state[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.__metrics: list[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self.__metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self.__metrics for line in metric.render()) + "\n"
+
+    def write_textfile(self, path: str) -> None:
+        # written aside and renamed, the collector never reads a half-written file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_DURATION = REGISTRY.register(Histogram(
+    "cm_http_request_duration_seconds", "HTTP calls to external services by endpoint and status",
+    ("service", "method", "endpoint", "status"), HTTP_BUCKETS
+))
+HTTP_REQUESTS_IN_FLIGHT = REGISTRY.register(Gauge(
+    "cm_http_requests_in_flight", "HTTP calls currently awaiting a response", ("service",)
+))
+DB_QUERY_DURATION = REGISTRY.register(Histogram(
+    "cm_db_query_duration_seconds", "Postgres queries by operation, table and outcome",
+    ("operation", "table", "status"), DB_BUCKETS
+))
+STAGE_DURATION = REGISTRY.register(Histogram(
+    "cm_stage_duration_seconds", "Clone, scan and upload durations per target",
+    ("target", "stage"), STAGE_BUCKETS
+))
+TARGETS_IN_PROGRESS = REGISTRY.register(Gauge(
+    "cm_targets_in_progress", "Targets currently processed by this runner", ("target",)
+))
+SUBPROCESSES_IN_PROGRESS = REGISTRY.register(Gauge(
+    "cm_subprocesses_in_progress", "Scanner and tool subprocesses currently running"
+))
+WEBHOOKS_PENDING = REGISTRY.register(Gauge(
+    "cm_webhooks_pending", "Webhook scans waiting for their debounce window", ("target",)
+))
+WORKSPACE_RESERVED_BYTES = REGISTRY.register(Gauge(
+    "cm_workspace_reserved_bytes", "Disk space admitted targets may still grow into", ("volume",)
+))
+WORKSPACE_WAITING = REGISTRY.register(Gauge(
+    "cm_workspace_waiting", "Targets waiting for disk space before their clone or scan"
+))
+SCANNER_BACKEND_UP = REGISTRY.register(Gauge(
+    "cm_scanner_backend_up", "Whether a managed scanner backend is serving scans", ("backend",)
+))
+
+
+# ids, urlencoded paths, digests and tags are collapsed so endpoints stay a small label set
+_ENDPOINT_ID_SEGMENT    = re.compile(r"^(\d+|[0-9a-f]{12,}|.*%2F.*|sha256:.*)$", re.IGNORECASE)
+_REGISTRY_PATH          = re.compile(r"^/v2/.+/(manifests|tags|blobs)/.*$")
+_HARBOR_PATH            = re.compile(r"^/api/v2\.0/projects/[^/]+/repositories/[^/]+/artifacts/[^/]+/(\w+)$")
+
+def endpoint_label(path: str) -> str:
+    if _REGISTRY_PATH.match(path):
+        return _REGISTRY_PATH.sub(r"/v2/{name}/\1/{reference}", path)
+    if _HARBOR_PATH.match(path):
+        return _HARBOR_PATH.sub(r"/api/v2.0/projects/{project}/repositories/{repository}/artifacts/{reference}/\1", path)
+    return "/".join("{id}" if _ENDPOINT_ID_SEGMENT.match(segment) else segment for segment in path.split("/"))
+
+
+def http_trace_config(service: str) -> aiohttp.TraceConfig:
+    async def on_request_start(session, context: SimpleNamespace, params: aiohttp.TraceRequestStartParams) -> None:
+        context.started_at = TRACER.now()
+        HTTP_REQUESTS_IN_FLIGHT.inc(service)
+
+    async def on_request_end(session, context: SimpleNamespace, params: aiohttp.TraceRequestEndParams) -> None:
+        observe(context, params.method, params.url.raw_path, str(params.response.status))
+
+    async def on_request_exception(session, context: SimpleNamespace, params: aiohttp.TraceRequestExceptionParams) -> None:
+        observe(context, params.method, params.url.raw_path, "error")
+
+    def observe(context: SimpleNamespace, method: str, path: str, status: str) -> None:
+        HTTP_REQUESTS_IN_FLIGHT.dec(service)
+        endpoint, duration = endpoint_label(path), TRACER.now() - context.started_at
+        HTTP_REQUEST_DURATION.observe(service, method, endpoint, status, value=duration)
+        TRACER.record(f"{method} {endpoint}", "http", context.started_at, duration, service=service, status=status)
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_request_exception.append(on_request_exception)
+    return trace_config
+
+
+_QUERY_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE)\s+(\w+)", re.IGNORECASE)
+
+def observe_query(record) -> None:
+    # asyncpg query logger callback, gets a LoggedQuery after every query
+    query = record.query.lstrip()
+    operation = query.split(None, 1)[0].upper() if query else ""
+    table = _QUERY_TABLE.search(query)
+    DB_QUERY_DURATION.observe(
+        operation, table.group(1) if table else "", "error" if record.exception else "ok",
+        value=record.elapsed
+    )
@@ -0,0 +1,251 @@
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from typing import Callable
+
+import ijson
+
+
+SEVERITY_ORDER = ["Info", "Low", "Medium", "High", "Critical"]
+
+TRIVY_SEVERITIES = {
+    "UNKNOWN":  "Info",
+    "LOW":      "Low",
+    "MEDIUM":   "Medium",
+    "HIGH":     "High",
+    "CRITICAL": "Critical",
+}
+
+SEMGREP_SEVERITIES = {
+    "INFO":     "Low",
+    "WARNING":  "Medium",
+    "ERROR":    "High",
+}
+
+# stands in for the scanned checkout in cached reports, so projects with the same manifests share one
+PROJECT_PATH_PLACEHOLDER = b"{{CONTINUOUS_MONITORING_PROJECT_PATH}}"
+
+
+@dataclass(frozen=True)
+class SlimRule:
+    # ijson prefixes of single findings, filtered by severity one at a time
+    findings:       tuple[str, ...]
+    severity:       Callable[[dict], str | None]
+    # (identity, title) of a kept finding, given scalars collected from context prefixes
+    fingerprint:    Callable[[dict, dict], tuple[str, str]]
+    context:        tuple[str, ...] = ()
+    # fields dropped from every kept finding
+    finding_fields: tuple[str, ...] = ()
+    # whole subtrees dropped from the report, as ijson prefixes
+    subtrees:       tuple[str, ...] = ()
+
+
+def _trivy_severity(finding: dict) -> str | None:
+    return TRIVY_SEVERITIES.get(str(finding.get("Severity", "")).upper())
+
+def _semgrep_severity(finding: dict) -> str | None:
+    return SEMGREP_SEVERITIES.get(str(finding.get("extra", {}).get("severity", "")).upper())
+
+def _trivy_fingerprint(finding: dict, context: dict) -> tuple[str, str]:
+    target = context.get("Results.item.Target", "")
+    finding_id = finding.get("VulnerabilityID") or finding.get("ID") or finding.get("RuleID", "")
+    pkg, version = finding.get("PkgName", ""), finding.get("InstalledVersion", "")
+    line = finding.get("StartLine", finding.get("CauseMetadata", {}).get("StartLine", ""))
+    identity = "|".join(str(part) for part in (target, finding_id, pkg, version, finding.get("PkgPath", ""), line))
+    title = f"{finding_id} {pkg} {version}".strip() if pkg else f"{finding_id} in {target}"
+    return identity, title
+
+def _semgrep_fingerprint(finding: dict, context: dict) -> tuple[str, str]:
+    check_id, path = finding.get("check_id", ""), finding.get("path", "")
+    line = finding.get("start", {}).get("line", "")
+    return f"{check_id}|{path}|{line}", f"{check_id.split('.')[-1]} {path}:{line}"
+
+
+# keyed by DefectDojo scan type, reports of other types are uploaded as is
+SLIM_RULES = {
+    "Trivy Scan": SlimRule(
+        findings        = (
+            "Results.item.Vulnerabilities.item",
+            "Results.item.Misconfigurations.item",
+            "Results.item.Secrets.item",
+        ),
+        severity        = _trivy_severity,
+        fingerprint     = _trivy_fingerprint,
+        context         = ("Results.item.Target",),
+        finding_fields  = ("DataSource", "PkgIdentifier", "VendorSeverity"),
+        subtrees        = ("Results.item.Packages",),
+    ),
+    "Semgrep JSON Report": SlimRule(
+        findings        = ("results.item",),
+        severity        = _semgrep_severity,
+        fingerprint     = _semgrep_fingerprint,
+        finding_fields  = ("extra.dataflow_trace",),
+    ),
+}
+
+
+class _JsonStreamWriter:
+    def __init__(self, out) -> None:
+        self.__out          = out
+        self.__counts       = []
+        self.__after_key    = False
+
+    def key(self, key: str) -> None:
+        if self.__counts[-1] > 0:
+            self.__out.write(",")
+        self.__counts[-1] += 1
+        self.__out.write(json.dumps(key) + ":")
+        self.__after_key = True
+
+    def start(self, bracket: str) -> None:
+        self.__before_value()
+        self.__out.write(bracket)
+        self.__counts.append(0)
+
+    def end(self, bracket: str) -> None:
+        self.__counts.pop()
+        self.__out.write(bracket)
+
+    def value(self, value) -> None:
+        self.__before_value()
+        self.__out.write(json.dumps(value))
+
+    def __before_value(self) -> None:
+        if self.__after_key:
+            self.__after_key = False
+            return
+        if self.__counts:
+            if self.__counts[-1] > 0:
+                self.__out.write(",")
+            self.__counts[-1] += 1
+
+
+def _strip_field(finding: dict, dotted: str) -> None:
+    *parents, name = dotted.split(".")
+    for parent in parents:
+        finding = finding.get(parent)
+        if not isinstance(finding, dict):
+            return
+    finding.pop(name, None)
+
+
+@dataclass
+class SlimResult:
+    kept:           int
+    dropped:        int
+    # fingerprint -> title of every kept finding
+    fingerprints:   dict[str, str]
+
+    def digest(self) -> str:
+        return hashlib.sha256("\n".join(sorted(self.fingerprints)).encode()).hexdigest()
+
+
+def slim_report(path: str, scan_type: str, minimum_severity: str) -> SlimResult | None:
+    # runs in a worker process, memory is bounded by the largest single finding;
+    # returns None when scan_type has no rule
+    rule = SLIM_RULES.get(scan_type)
+    if not rule:
+        return None
+
+    threshold = SEVERITY_ORDER.index(minimum_severity)
+    result = SlimResult(0, 0, {})
+    context = {}
+    tmp_path = f"{path}.slim"
+
+    try:
+        with open(path, "rb") as src, open(tmp_path, "w") as dst:
+            writer = _JsonStreamWriter(dst)
+            builder, builder_prefix = None, None
+            skip_depth, skip_next = 0, False
+
+            for prefix, event, value in ijson.parse(src, use_float=True):
+                if builder is not None:
+                    builder.event(event, value)
+                    if prefix == builder_prefix and event in ("end_map", "end_array"):
+                        finding = builder.value
+                        severity = rule.severity(finding) if isinstance(finding, dict) else None
+                        if severity in SEVERITY_ORDER and SEVERITY_ORDER.index(severity) < threshold:
+                            result.dropped += 1
+                        else:
+                            if isinstance(finding, dict):
+                                identity, title = rule.fingerprint(finding, context)
+                                result.fingerprints[hashlib.sha256(identity.encode()).hexdigest()[:32]] = title
+                            for dotted in rule.finding_fields:
+                                _strip_field(finding, dotted)
+                            writer.value(finding)
+                            result.kept += 1
+                        builder = None
+                    continue
+
+                if skip_next or skip_depth:
+                    skip_next = False
+                    if event in ("start_map", "start_array"):
+                        skip_depth += 1
+                    elif event in ("end_map", "end_array"):
+                        skip_depth -= 1
+                    continue
+
+                if event == "map_key":
+                    subtree = f"{prefix}.{value}" if prefix else value
+                    if subtree in rule.subtrees:
+                        skip_next = True
+                        continue
+                    writer.key(value)
+                elif event in ("start_map", "start_array"):
+                    if prefix in rule.findings:
+                        builder, builder_prefix = ijson.ObjectBuilder(), prefix
+                        builder.event(event, value)
+                        continue
+                    writer.start("{" if event == "start_map" else "[")
+                elif event in ("end_map", "end_array"):
+                    writer.end("}" if event == "end_map" else "]")
+                else:
+                    if prefix in rule.context:
+                        context[prefix] = value
+                    writer.value(value)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    os.replace(tmp_path, path)
+    return result
+
+
+def _path_forms(project_path: str) -> list[bytes]:
+    # as passed to the scanner and resolved, raw and json-escaped, longest first
+    forms = set()
+    for path in (os.path.abspath(project_path), project_path):
+        forms.add(path.encode())
+        forms.add(json.dumps(path)[1:-1].encode())
+    return sorted(forms, key=len, reverse=True)
+
+def detach_project_path(report: bytes, project_path: str) -> bytes:
+    for form in _path_forms(project_path):
+        report = report.replace(form, PROJECT_PATH_PLACEHOLDER)
+    return report
+
+def attach_project_path(report: bytes, project_path: str) -> bytes:
+    return report.replace(PROJECT_PATH_PLACEHOLDER, json.dumps(project_path)[1:-1].encode())
+
+
+@dataclass
+class FindingsDelta:
+    # fingerprint -> title
+    new:    dict[str, str]
+    closed: dict[str, str]
+
+    @classmethod
+    def between(cls, previous: dict[str, str], current: dict[str, str]) -> "FindingsDelta":
+        return cls(
+            new     = {fp: title for fp, title in current.items() if fp not in previous},
+            closed  = {fp: title for fp, title in previous.items() if fp not in current},
+        )
+
+    def merge(self, other: "FindingsDelta") -> None:
+        self.new.update(other.new)
+        self.closed.update(other.closed)
+
+    def is_empty(self) -> bool:
+        return not self.new and not self.closed
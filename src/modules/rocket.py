@@ -1,16 +1,142 @@
-from rocketchat_API.rocketchat import RocketChat
+import asyncio
+import time
+import aiohttp
+from typing import Awaitable, Callable
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from modules.logger import BaseLogger
+from modules.metrics import http_trace_config
+
+
+# awaited once the message it was added with has been delivered
+OnSent = Callable[[], Awaitable[None]]
+
+
+class Rocket(BaseLogger):
+    __API_POST_MESSAGE  = "/api/v1/chat.postMessage"
+
+    __DIGEST_HEADER         = ":small_blue_diamond: {team}\n"
+    __DIGEST_SEPARATOR      = "\n"
+    __MAX_MESSAGE_LENGTH    = 4000
+
+    __MAX_RETRIES       = 3
+    __RETRY_BACKOFF     = 2     # seconds, doubled on every retry
+    __SEND_INTERVAL     = 1     # seconds between two posts to the chat
+    __POOL_SIZE         = 4
 
-class Rocket:
     def __init__(self, host: str, user: str, password: str, chat_id: str) -> None:
-        self.rocket = RocketChat(
-            server_url  = host,
-            user_id     = user,
-            auth_token  = password
-        )
-        self.chat_id = chat_id
-        
-    def send_message(self, message: str, thread_id: str | None = None) -> None:
+        self.__host     = host
+        self.__headers  = {
+            "X-User-Id":    user,
+            "X-Auth-Token": password
+        }
+        self.chat_id    = chat_id
+
+        self.__session: aiohttp.ClientSession | None = None
+        self.__rate_lock    = asyncio.Lock()
+        self.__last_sent_at = 0.0
+
+        # scope -> (team, thread_id) -> messages collected during the run, each with its delivery callback
+        self.__pending: dict[str, dict[tuple[str, str | None], list[tuple[str, OnSent | None]]]] = {}
+
+    def add_message(self, team: str, message: str, thread_id: str | None = None,
+                    scope: str = "", on_sent: OnSent | None = None) -> None:
+        # on_sent runs once the digest carrying the message was delivered, never for a failed one
+        self.__pending.setdefault(scope, {}).setdefault((team, thread_id), []).append((message, on_sent))
+
+    async def flush(self, scope: str = "") -> None:
+        # only the given scope is sent, a targeted scan never posts the cycle's digests early
+        pending = self.__pending.pop(scope, {})
+        tasks = [
+            self.__send_digest(digest, thread_id, callbacks)
+            for (team, thread_id), messages in pending.items()
+            for digest, callbacks in self.__build_digests(team, messages)
+        ]
+        await asyncio.gather(*tasks)
+
+    async def __send_digest(self, digest: str, thread_id: str | None, callbacks: list[OnSent]) -> None:
+        if not await self.send_message(digest, thread_id):
+            return
+        for callback in callbacks:
+            try:
+                await callback()
+            except Exception as e:
+                self._log_err(f"failed to record delivered message: {e}")
+
+    async def send_message(self, message: str, thread_id: str | None = None) -> bool:
+        body = {
+            "roomId":   self.chat_id,
+            "text":     message
+        }
         if thread_id:
-            self.rocket.chat_post_message(message, room_id=self.chat_id, thread_id=thread_id)
-        else:
-            self.rocket.chat_post_message(message, room_id=self.chat_id)
\ No newline at end of file
+            body["tmid"] = thread_id
+
+        session = self.__get_session()
+        for attempt in range(self.__MAX_RETRIES):
+            await self.__wait_rate_limit()
+            try:
+                async with session.post(f"{self.__host}{self.__API_POST_MESSAGE}", json=body) as response:
+                    if response.status == 200:
+                        return True
+                    retry_after = response.headers.get("Retry-After")
+                    self._log_err(f"failed to send rocket message ({attempt + 1}/{self.__MAX_RETRIES}): {response.status}")
+            except aiohttp.ClientError as e:
+                retry_after = None
+                self._log_err(f"failed to send rocket message ({attempt + 1}/{self.__MAX_RETRIES}): {e}")
+
+            if attempt + 1 < self.__MAX_RETRIES:
+                await asyncio.sleep(self.__retry_delay(retry_after, attempt))
+        return False
+
+    def __retry_delay(self, retry_after: str | None, attempt: int) -> float:
+        # Retry-After is either seconds or an HTTP-date, anything else falls back to the backoff
+        backoff = self.__RETRY_BACKOFF * 2 ** attempt
+        if not retry_after:
+            return backoff
+        try:
+            return max(float(retry_after), 0.0)
+        except ValueError:
+            pass
+        try:
+            retry_at = parsedate_to_datetime(retry_after)
+        except (TypeError, ValueError):
+            return backoff
+        if retry_at.tzinfo == None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+    async def close(self) -> None:
+        if self.__session:
+            await self.__session.close()
+            self.__session = None
+
+    def __get_session(self) -> aiohttp.ClientSession:
+        if not self.__session or self.__session.closed:
+            self.__session = aiohttp.ClientSession(
+                headers=self.__headers,
+                connector=aiohttp.TCPConnector(limit=self.__POOL_SIZE),
+                trace_configs=[http_trace_config("rocket")]
+            )
+        return self.__session
+
+    async def __wait_rate_limit(self) -> None:
+        async with self.__rate_lock:
+            delay = self.__last_sent_at + self.__SEND_INTERVAL - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.__last_sent_at = time.monotonic()
+
+    def __build_digests(self, team: str, messages: list[tuple[str, OnSent | None]]) -> list[tuple[str, list[OnSent]]]:
+        header = self.__DIGEST_HEADER.format(team=team)
+        digests, current, callbacks = [], header, []
+        for message, on_sent in messages:
+            if current != header and len(current) + len(message) > self.__MAX_MESSAGE_LENGTH:
+                digests.append((current, callbacks))
+                current, callbacks = header, []
+            current += self.__DIGEST_SEPARATOR + message
+            if on_sent:
+                callbacks.append(on_sent)
+        if current != header:
+            digests.append((current, callbacks))
+        return digests
@@ -1,110 +1,366 @@
 import asyncio
 import aiohttp
+import hashlib
+import os
+import time
+from dataclasses import dataclass, asdict
 from datetime import datetime
+from urllib.parse import quote
 from modules.logger import BaseLogger
+from modules.backends import ScannerBackends
+from modules.metrics import http_trace_config, SUBPROCESSES_IN_PROGRESS
+from modules.tracing import span
 import json
 
+@dataclass(slots=True, frozen=True)
+class ScannerDefinition:
+    TARGET_PROJECT  = "project"
+    TARGET_IMAGE    = "image"
+
+    __PREFIX_PROJECT    = "PROJECT: "
+    __PREFIX_IMAGE      = "IMAGE: "
+    __PREFIX_TYPE       = "DD_SCAN_TYPE: "
+    __PREFIX_SCA        = "SCA: "
+
+    __REQUIRED_PLACEHOLDERS = {
+        TARGET_PROJECT: ("{PROJECT_PATH}", "{OUTPUT_PATH}"),
+        TARGET_IMAGE:   ("{IMAGE_URL}", "{OUTPUT_PATH}"),
+    }
+
+    path:       str
+    target:     str
+    command:    str
+    scan_type:  str
+    # results depend only on dependency manifests and can be cached by their hash
+    sca:        bool = False
+
+    @classmethod
+    def parse(cls, path: str, lines: list[str]) -> "ScannerDefinition":
+        if len(lines) not in (2, 3):
+            raise ValueError(f"expected 2 or 3 lines, got {len(lines)}")
+
+        cmd_line, type_line = lines[ScannRunner.CFG_SCAN_CMD], lines[ScannRunner.CFG_SCAN_TYPE]
+        if not type_line.startswith(cls.__PREFIX_TYPE) or not type_line[len(cls.__PREFIX_TYPE):].strip():
+            raise ValueError(f"second line must be {cls.__PREFIX_TYPE}<type>")
+
+        if cmd_line.startswith(cls.__PREFIX_PROJECT):
+            target, command = cls.TARGET_PROJECT, cmd_line[len(cls.__PREFIX_PROJECT):]
+        elif cmd_line.startswith(cls.__PREFIX_IMAGE):
+            target, command = cls.TARGET_IMAGE, cmd_line[len(cls.__PREFIX_IMAGE):]
+        else:
+            raise ValueError(f"first line must start with {cls.__PREFIX_PROJECT!r} or {cls.__PREFIX_IMAGE!r}")
+
+        missing = [p for p in cls.__REQUIRED_PLACEHOLDERS[target] if p not in command]
+        if missing:
+            raise ValueError(f"command misses placeholders {missing}")
+
+        sca = False
+        if len(lines) == 3:
+            sca_value = lines[ScannRunner.CFG_SCA][len(cls.__PREFIX_SCA):].strip().lower()
+            if not lines[ScannRunner.CFG_SCA].startswith(cls.__PREFIX_SCA) or sca_value not in ("true", "false"):
+                raise ValueError(f"third line must be {cls.__PREFIX_SCA}true|false")
+            sca = sca_value == "true"
+
+        return cls(
+            path        = path,
+            target      = target,
+            command     = command,
+            scan_type   = type_line[len(cls.__PREFIX_TYPE):].strip(),
+            sca         = sca
+        )
+
 class ScannRunner(BaseLogger):
     __SCANNERS_CONFIG_REPO      = 5425
 
-    __SCANNER_PREFIX_PROJECT    = "PROJECT: "
-    __SCANNER_PREFIX_IMAGE      = "IMAGE: "
-    __SCANNER_PREFIX_TYPE       = "DD_SCAN_TYPE: "
     __SCANNER_COMMENT_PREFIX    = "#"
+    __SCANNERS_CACHE_VERSION    = 3
+    __SCANNERS_CACHE_PATH       = "./.cache/scanners"
+    __BACKENDS_CACHE_PATH       = "./.cache/runtimes"
+    __TREE_PAGE_SIZE            = 100
+    __FETCH_CONCURRENCY         = 8
 
     SCANNER_IMAGE_REPORT_NAME_PREFIX = "prod"
 
+    API_COMMITS_ENDPOINT        = "/api/v4/projects/{}/repository/commits"
     API_FILES_ENDPOINT          = "/api/v4/projects/{}/repository/tree"
     API_FILE_CONTENT_ENDPOINT   = "/api/v4/projects/{}/repository/files/{}/raw"
 
     CFG_SCAN_CMD    = 0
     CFG_SCAN_TYPE   = 1
+    CFG_SCA         = 2
 
     __HARBOR_REGISTRIES = set([
         "registry-dev.ru",
         "registry.ru",
         "harbor.ru",
     ])
+    # every file trivy's language analyzers read, a change to any of them may change the findings
+    __DEPENDENCY_MANIFESTS = set([
+        "package.json", "package-lock.json", "npm-shrinkwrap.json", "yarn.lock", "pnpm-lock.yaml", "bun.lock",
+        "go.mod", "go.sum", "go.work",
+        "poetry.lock", "Pipfile", "Pipfile.lock", "pyproject.toml", "uv.lock", "setup.py", "setup.cfg",
+        "environment.yml", "environment.yaml",
+        "pom.xml", "build.gradle", "build.gradle.kts", "gradle.lockfile", "build.sbt.lock",
+        "Gemfile", "Gemfile.lock", "composer.json", "composer.lock", "Cargo.toml", "Cargo.lock",
+        "packages.lock.json", "packages.config", "Directory.Packages.props", "Directory.Build.props",
+        "Podfile.lock", "Package.resolved", "pubspec.lock", "mix.lock", "conan.lock", "Package.swift",
+    ])
+    __DEPENDENCY_MANIFEST_SUFFIXES = (
+        ".csproj", ".vbproj", ".fsproj", ".deps.json", ".nuspec", ".gemspec",
+        ".jar", ".war", ".ear", ".par", "requirements.txt",
+    )
+    __MANIFEST_SKIP_DIRS = set([".git"])
+
+    __DB_VERSION_CMD = "trivy version --format json"
+    __DB_VERSION_TTL = 3600
+
+    __MANIFEST_MEDIA_TYPES = [
+        "application/vnd.oci.image.index.v1+json",
+        "application/vnd.docker.distribution.manifest.list.v2+json",
+        "application/vnd.oci.image.manifest.v1+json",
+        "application/vnd.docker.distribution.manifest.v2+json",
+    ]
     __ANOTHER_REGISTRIES = set([
         "registry.ru",
         "registry.com",
     ])
 
-    def __init__(self, git_host: str, git_token: str, registries_credentials: dict) -> None:
+    def __init__(self, git_host: str, git_token: str, registries_credentials: dict,
+                 backends: ScannerBackends | None = None) -> None:
         self.__git_host         = git_host
         self.__git_token        = f"Bearer {git_token}"
-        self.__scanners_project = []
-        self.__scanners_image   = []
+        self.__scanners_project: list[ScannerDefinition] = []
+        self.__scanners_image: list[ScannerDefinition]   = []
+        self.__fetch_semaphore  = asyncio.Semaphore(self.__FETCH_CONCURRENCY)
+        self.__loaded_commit: str | None = None
+        self.__db_version: tuple[str, float] | None = None
         self.__registries_credentials = registries_credentials
+        # long-lived trivy server and rule caches, scans only pay for their own work
+        self.__backends = backends or ScannerBackends(self.__BACKENDS_CACHE_PATH)
 
-    async def fetch_files_list(self) -> list:
-        async with aiohttp.ClientSession() as session:
+    async def start(self) -> None:
+        await self.__backends.start()
+
+    async def close(self) -> None:
+        await self.__backends.close()
+
+    async def fetch_last_commit(self, session: aiohttp.ClientSession) -> str | None:
+        async with session.get(
+            f"{self.__git_host}{self.API_COMMITS_ENDPOINT.format(self.__SCANNERS_CONFIG_REPO)}",
+            params={"per_page": 1}
+        ) as response:
+            if response.status != 200:
+                return None
+            commits = await response.json()
+            return commits[0]["id"] if commits else None
+
+    async def fetch_files_list(self, session: aiohttp.ClientSession, ref: str) -> list | None:
+        files, page = [], "1"
+        while page:
             async with session.get(
                 f"{self.__git_host}{self.API_FILES_ENDPOINT.format(self.__SCANNERS_CONFIG_REPO)}",
-                headers={"Authorization": self.__git_token}
+                params={"ref": ref, "page": page, "per_page": self.__TREE_PAGE_SIZE}
             ) as response:
-                return await response.json() if response.status == 200 else []
+                if response.status != 200:
+                    return None
+                files.extend(await response.json())
+                page = response.headers.get("X-Next-Page")
+        return files
 
-    async def fetch_file_content(self, file_path: str) -> str:
-        async with aiohttp.ClientSession() as session:
+    async def fetch_file_content(self, session: aiohttp.ClientSession, file_path: str, ref: str) -> str | None:
+        async with self.__fetch_semaphore:
             async with session.get(
-                f"{self.__git_host}{self.API_FILE_CONTENT_ENDPOINT.format(self.__SCANNERS_CONFIG_REPO, file_path)}",
-                headers={"Authorization": self.__git_token}
+                f"{self.__git_host}{self.API_FILE_CONTENT_ENDPOINT.format(self.__SCANNERS_CONFIG_REPO, quote(file_path, safe=''))}",
+                params={"ref": ref}
             ) as response:
-                return await response.text() if response.status == 200 else ""
+                return await response.text() if response.status == 200 else None
 
     async def load_scanners(self):
-        files = await self.fetch_files_list()
-        for file in files:
-            if file["type"] == "blob":
-                content = await self.fetch_file_content(file["path"])
-                if content == None:
-                    continue
+        async with aiohttp.ClientSession(headers={"Authorization": self.__git_token},
+                                         trace_configs=[http_trace_config("gitlab")]) as session:
+            commit = await self.fetch_last_commit(session)
+            if commit == None:
+                self._log_err("failed to get scanners config last commit")
+                self.__fall_back_to_cached_scanners("the latest commit")
+                return
 
-                scanner_cfg = content.splitlines()
-                if len(scanner_cfg) != 2 or not scanner_cfg[self.CFG_SCAN_TYPE].startswith(self.__SCANNER_PREFIX_TYPE):
-                    self._log_err(f"wrong config format: {file['path']}")
-                    continue
+            if commit == self.__loaded_commit:
+                return
 
-                if scanner_cfg[self.CFG_SCAN_CMD].startswith(self.__SCANNER_COMMENT_PREFIX):
-                    self._log(f"ignoring commented scanner: {file['path']}")
-                    continue
+            definitions = self.__load_cached_scanners(commit)
+            if definitions == None:
+                definitions = await self.__fetch_scanners(session, commit)
+                if definitions == None:
+                    # an incomplete set is never cached nor used, the last complete one stays
+                    self.__fall_back_to_cached_scanners(commit)
+                    return
+                self.__save_cached_scanners(commit, definitions)
+            else:
+                self._log(f"loaded scanners from cache: {commit}")
 
-                if scanner_cfg[self.CFG_SCAN_CMD].startswith(self.__SCANNER_PREFIX_PROJECT):
-                    self.__scanners_project.append((
-                        scanner_cfg[self.CFG_SCAN_CMD][len(self.__SCANNER_PREFIX_PROJECT):],
-                        scanner_cfg[self.CFG_SCAN_TYPE][len(self.__SCANNER_PREFIX_TYPE):]
-                    ))
-                elif scanner_cfg[self.CFG_SCAN_CMD].startswith(self.__SCANNER_PREFIX_IMAGE):
-                    self.__scanners_image.append((
-                        scanner_cfg[0][len(self.__SCANNER_PREFIX_IMAGE):],
-                        scanner_cfg[self.CFG_SCAN_TYPE][len(self.__SCANNER_PREFIX_TYPE):]
-                    ))
-                else:
-                    continue
+        self.__scanners_project = [d for d in definitions if d.target == ScannerDefinition.TARGET_PROJECT]
+        self.__scanners_image   = [d for d in definitions if d.target == ScannerDefinition.TARGET_IMAGE]
+        self.__loaded_commit    = commit
+
+    async def __fetch_scanners(self, session: aiohttp.ClientSession, commit: str) -> list[ScannerDefinition] | None:
+        files = await self.fetch_files_list(session, commit)
+        if files == None:
+            self._log_err(f"failed to list scanners config files at {commit}")
+            return None
+        files = [file for file in files if file["type"] == "blob"]
+        contents = await asyncio.gather(*[self.fetch_file_content(session, file["path"], commit) for file in files])
+
+        failed = [file["path"] for file, content in zip(files, contents) if content == None]
+        if failed:
+            self._log_err(f"failed to fetch configs at {commit}: {', '.join(failed)}")
+            return None
+
+        definitions = []
+        for file, content in zip(files, contents):
+
+            scanner_cfg = content.splitlines()
+            if scanner_cfg and scanner_cfg[self.CFG_SCAN_CMD].startswith(self.__SCANNER_COMMENT_PREFIX):
+                self._log(f"ignoring commented scanner: {file['path']}")
+                continue
+
+            try:
+                definitions.append(ScannerDefinition.parse(file["path"], scanner_cfg))
+            except ValueError as e:
+                self._log_err(f"wrong config format: {file['path']}: {e}")
+        return definitions
+
+    def __fall_back_to_cached_scanners(self, commit: str) -> None:
+        if self.__loaded_commit != None:
+            self._log_err(f"keeping scanners of {self.__loaded_commit}, {commit} failed to load")
+            return
 
-    def get_project_scanners(self):
+        # a fresh process takes the set cached by an earlier run, only one commit is kept on disk
+        cached = sorted(os.listdir(self.__SCANNERS_CACHE_PATH)) if os.path.isdir(self.__SCANNERS_CACHE_PATH) else []
+        suffix = f".v{self.__SCANNERS_CACHE_VERSION}.json"
+        for name in cached:
+            if not name.endswith(suffix):
+                continue
+            definitions = self.__load_cached_scanners(name[:-len(suffix)])
+            if definitions != None:
+                self._log_err(f"using cached scanners of {name[:-len(suffix)]}, {commit} failed to load")
+                self.__scanners_project = [d for d in definitions if d.target == ScannerDefinition.TARGET_PROJECT]
+                self.__scanners_image   = [d for d in definitions if d.target == ScannerDefinition.TARGET_IMAGE]
+                return
+
+        raise RuntimeError(f"failed to load scanners of {commit} and no cached set to fall back to")
+
+    def __load_cached_scanners(self, commit: str) -> list[ScannerDefinition] | None:
+        cache_path = os.path.join(self.__SCANNERS_CACHE_PATH, f"{commit}.v{self.__SCANNERS_CACHE_VERSION}.json")
+        if not os.path.exists(cache_path):
+            return None
+        try:
+            with open(cache_path, "r") as f:
+                return [ScannerDefinition(**definition) for definition in json.load(f)]
+        except (OSError, ValueError, TypeError) as e:
+            self._log_err(f"failed to read scanners cache {cache_path}: {e}")
+            return None
+
+    def __save_cached_scanners(self, commit: str, definitions: list[ScannerDefinition]) -> None:
+        os.makedirs(self.__SCANNERS_CACHE_PATH, exist_ok=True)
+        for cached in os.listdir(self.__SCANNERS_CACHE_PATH):
+            os.remove(os.path.join(self.__SCANNERS_CACHE_PATH, cached))
+
+        cache_path = os.path.join(self.__SCANNERS_CACHE_PATH, f"{commit}.v{self.__SCANNERS_CACHE_VERSION}.json")
+        with open(f"{cache_path}.tmp", "w") as f:
+            json.dump([asdict(definition) for definition in definitions], f)
+        os.replace(f"{cache_path}.tmp", cache_path)
+
+    def get_project_scanners(self) -> list[ScannerDefinition]:
         return self.__scanners_project
     
-    def get_image_scanners(self):
+    def get_image_scanners(self) -> list[ScannerDefinition]:
         return self.__scanners_image
     
-    async def scan_project(self, project_id: int, path: str, outputs_base_path: str) -> None:
+    async def scan_project(self, project_id: int, path: str, outputs_base_path: str, skip: set[int] = frozenset()) -> None:
         for scanner_idx in range(len(self.__scanners_project)):
-            scan_cmd = self.__scanners_project[scanner_idx][self.CFG_SCAN_CMD].format(PROJECT_PATH=path, OUTPUT_PATH=f"{outputs_base_path}/{scanner_idx}.json")
+            if scanner_idx in skip:
+                continue
+            # {SEMGREP_RULES} points semgrep at the pre-fetched rule packs instead of the registry
+            scan_cmd = self.__scanners_project[scanner_idx].command.format(
+                PROJECT_PATH=path,
+                OUTPUT_PATH=f"{outputs_base_path}/{scanner_idx}.json",
+                SEMGREP_RULES=self.__backends.semgrep_rules_path
+            )
             result = await self.__execute_command(scan_cmd)
             self._log(f"[{project_id}] {result} {scan_cmd}")
             
-    async def scan_image(self, project_id: int, image_url: str, outputs_base_path: str) -> None:
-        for scanner_idx in range(len(self.__scanners_image)):
-            registry = image_url.split("/")[0]
-            registry_credentials = self.__registries_credentials[registry]
+    def sca_cache_key(self, scanner: ScannerDefinition, manifests_digest: str, db_version: str) -> str:
+        identity = json.dumps([scanner.command, scanner.scan_type, manifests_digest, db_version])
+        return hashlib.sha256(identity.encode()).hexdigest()
+
+    async def dependency_manifests_digest(self, path: str) -> str | None:
+        # None when no manifest was found, the findings then come from files the digest cannot see
+        return await asyncio.to_thread(self.__hash_manifests, path)
+
+    def __hash_manifests(self, path: str) -> str | None:
+        digest, matched = hashlib.sha256(), False
+        for root, dirs, files in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if d not in self.__MANIFEST_SKIP_DIRS)
+            for name in sorted(files):
+                if name not in self.__DEPENDENCY_MANIFESTS and not name.endswith(self.__DEPENDENCY_MANIFEST_SUFFIXES):
+                    continue
+                file_path = os.path.join(root, name)
+                if os.path.islink(file_path):
+                    continue
+                digest.update(os.path.relpath(file_path, path).encode())
+                file_digest = hashlib.sha256()
+                with open(file_path, "rb") as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b""):
+                        file_digest.update(chunk)
+                digest.update(file_digest.digest())
+                matched = True
+        return digest.hexdigest() if matched else None
+
+    async def vuln_db_version(self) -> str:
+        if self.__db_version and time.monotonic() - self.__db_version[1] < self.__DB_VERSION_TTL:
+            return self.__db_version[0]
+
+        process = await asyncio.create_subprocess_shell(
+            self.__DB_VERSION_CMD,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            env=self.__backends.env()
+        )
+        SUBPROCESSES_IN_PROGRESS.inc()
+        try:
+            with span("trivy version", "subprocess"):
+                stdout, _ = await process.communicate()
+        finally:
+            SUBPROCESSES_IN_PROGRESS.dec()
+        try:
+            version = json.loads(stdout).get("VulnerabilityDB", {}).get("UpdatedAt", "")
+        except ValueError:
+            version = ""
+        if not version:
+            # unknown db version, never share cached results under it
+            return ""
+
+        self.__db_version = (version, time.monotonic())
+        return version
+
+    async def resolve_image(self, project_id: int, image_url: str) -> tuple[str, str]:
+        registry = image_url.split("/")[0]
+        image = image_url.replace(f"{registry}/", "")
+
+        tag = await self.registry_fetch_latest(registry, image)
+        self._log(f"[{project_id}] fetched latest {image_url} tag: {tag}")
+
+        image_ref = f"{image_url}:{tag}"
+        digest = await self.__registry_fetch_digest(registry, image, tag)
+        return image_ref, digest or image_ref
 
-            tag = await self.registry_fetch_latest(registry, image_url.replace(f"{registry}/", ""))
-            self._log(f"[{project_id}] fetched latest {image_url} tag: {tag}")
+    async def scan_image(self, project_id: int, image_ref: str, outputs_base_path: str) -> None:
+        registry = image_ref.split("/")[0]
+        registry_credentials = self.__registries_credentials[registry]
+        auth_cmd = "docker login {} -u {} -p {}".format(registry, registry_credentials["user"], registry_credentials["password"])
 
-            auth_cmd = "docker login {} -u {} -p {}".format(registry, registry_credentials["user"], registry_credentials["password"])
-            scan_cmd = self.__scanners_image[scanner_idx][self.CFG_SCAN_CMD].format(IMAGE_URL=f"{image_url}:{tag}", OUTPUT_PATH=f"{outputs_base_path}/{scanner_idx}.json")
+        for scanner_idx in range(len(self.__scanners_image)):
+            scan_cmd = self.__scanners_image[scanner_idx].command.format(IMAGE_URL=image_ref, OUTPUT_PATH=f"{outputs_base_path}/{scanner_idx}.json")
             
             result_cmd = f"{auth_cmd} && {scan_cmd}"
             result = await self.__execute_command(result_cmd)
@@ -114,9 +370,21 @@ class ScannRunner(BaseLogger):
         process = await asyncio.create_subprocess_shell(
             command,
             stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
+            stderr=asyncio.subprocess.PIPE,
+            env=self.__backends.env()
         )
-        stdout, stderr = await process.communicate()
+        # named after the last command of the chain, earlier ones carry registry credentials
+        executable = command.split("&&")[-1].split()[0]
+        SUBPROCESSES_IN_PROGRESS.inc()
+        try:
+            with span(executable, "subprocess", pid=process.pid):
+                stdout, stderr = await process.communicate()
+        except asyncio.CancelledError:
+            process.kill()
+            await process.wait()
+            raise
+        finally:
+            SUBPROCESSES_IN_PROGRESS.dec()
         if process.returncode != 0:
             # self._log(stdout.decode(errors="ignore").strip())
             # self._log_err(stderr.decode(errors="ignore").strip())
@@ -142,8 +410,20 @@ class ScannRunner(BaseLogger):
         results.sort(key=lambda x: x[1], reverse=True)
         return results[0][0]
     
+    async def __registry_fetch_digest(self, registry: str, image: str, tag: str) -> str | None:
+        async with aiohttp.ClientSession(trace_configs=[http_trace_config("registry")]) as session:
+            async with session.head(
+                f"https://{registry}/v2/{image}/manifests/{tag}",
+                auth=aiohttp.BasicAuth(
+                    self.__registries_credentials[registry]["user"],
+                    self.__registries_credentials[registry]["password"]
+                ),
+                headers={"Accept": ", ".join(self.__MANIFEST_MEDIA_TYPES)}
+            ) as response:
+                return response.headers.get("Docker-Content-Digest") if response.status == 200 else None
+
     async def __registry_fetch_tags(self, registry: str, image: str) -> dict:
-        async with aiohttp.ClientSession() as session:
+        async with aiohttp.ClientSession(trace_configs=[http_trace_config("registry")]) as session:
             async with session.get(
                 f"https://{registry}/v2/{image}/tags/list?page_size=1",
                 auth=aiohttp.BasicAuth(
@@ -158,7 +438,7 @@ class ScannRunner(BaseLogger):
             async with aiohttp.ClientSession(auth=aiohttp.BasicAuth(
                     self.__registries_credentials[registry]["user"],
                     self.__registries_credentials[registry]["password"]
-                )) as session:
+                ), trace_configs=[http_trace_config("registry")]) as session:
                 async with session.get(f"https://{registry}/v2/{image}/manifests/{tag}") as response:
                     if response.status == 200:
                         response_json = await response.json()
@@ -176,7 +456,7 @@ class ScannRunner(BaseLogger):
                     self.__registries_credentials[registry]["password"]
                 ), headers={
                     "accept": "application/json"
-                }) as session:
+                }, trace_configs=[http_trace_config("registry")]) as session:
                 async with session.get(
                     f"https://{registry}/api/v2.0/projects/{main_repo}/repositories/{sub_repo}/artifacts/{tag}/tags",
                     params={
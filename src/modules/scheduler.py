@@ -0,0 +1,43 @@
+import heapq
+from collections import deque
+from datetime import datetime
+
+from modules.logger import BaseLogger
+from modules.db import Tables
+
+
+class Scheduler(BaseLogger):
+    # expected seconds per target until the run has measured its own
+    __DEFAULT_ESTIMATES = {
+        Tables.PROJECTS:    300.0,
+        Tables.IMAGES:      120.0,
+    }
+    # only recent targets shape the estimate, a long-lived runner keeps no more than this
+    __MAX_SAMPLES = 200
+
+    def __init__(self, deadline: datetime | None = None) -> None:
+        self.deadline = deadline
+        self.__durations: dict[Tables, deque[float]] = {
+            table: deque(maxlen=self.__MAX_SAMPLES) for table in self.__DEFAULT_ESTIMATES
+        }
+
+    def time_left(self) -> float | None:
+        if not self.deadline:
+            return None
+        return (self.deadline - datetime.now()).total_seconds()
+
+    def expected_duration(self, table: Tables) -> float:
+        durations = self.__durations[table]
+        if not durations:
+            return self.__DEFAULT_ESTIMATES[table]
+        return sum(durations) / len(durations)
+
+    def predict_makespan(self, expected: list[float], workers: int) -> float:
+        # longest processing time first: every job goes to the least loaded worker
+        loads = [0.0] * max(workers, 1)
+        for duration in sorted(expected, reverse=True):
+            heapq.heappush(loads, heapq.heappop(loads) + duration)
+        return max(loads)
+
+    def record(self, table: Tables, seconds: float) -> None:
+        self.__durations[table].append(seconds)
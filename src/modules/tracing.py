@@ -0,0 +1,87 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Tracer:
+    # events kept in memory between two dumps, later ones are counted and dropped
+    __MAX_EVENTS = 1_000_000
+
+    def __init__(self, enabled: bool) -> None:
+        self.enabled    = enabled
+        self.__origin   = time.perf_counter()
+        self.__events: list[dict] = []
+        self.__dropped  = 0
+        # asyncio task or thread -> timeline row, so overlapping work shows side by side
+        self.__lanes: dict[int, int] = {}
+
+    def now(self) -> float:
+        return time.perf_counter()
+
+    def record(self, name: str, category: str, started_at: float, duration: float, **args) -> None:
+        # started_at and duration in seconds, started_at taken from now()
+        if not self.enabled:
+            return
+        if len(self.__events) >= self.__MAX_EVENTS:
+            self.__dropped += 1
+            return
+
+        self.__events.append({
+            "name": name,
+            "cat":  category,
+            "ph":   "X",
+            "ts":   round((started_at - self.__origin) * 1e6),
+            "dur":  round(duration * 1e6),
+            "pid":  os.getpid(),
+            "tid":  self.__lane(),
+            "args": args,
+        })
+
+    @contextmanager
+    def span(self, name: str, category: str, **args):
+        if not self.enabled:
+            yield
+            return
+
+        started_at = self.now()
+        try:
+            yield
+        except BaseException as e:
+            args["error"] = type(e).__name__
+            raise
+        finally:
+            self.record(name, category, started_at, self.now() - started_at, **args)
+
+    def dump(self, path: str) -> None:
+        # Chrome trace-event JSON, opens in chrome://tracing, Perfetto or speedscope
+        if not self.enabled:
+            return
+        events, self.__events = self.__events, []
+        self.__lanes.clear()
+        if self.__dropped:
+            events.append({"name": "dropped_events", "ph": "C", "ts": 0, "pid": os.getpid(), "args": {"count": self.__dropped}})
+            self.__dropped = 0
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        os.replace(tmp_path, path)
+
+    def __lane(self) -> int:
+        try:
+            owner = id(asyncio.current_task())
+        except RuntimeError:
+            owner = threading.get_ident()
+        lane = self.__lanes.get(owner)
+        if lane == None:
+            lane = self.__lanes[owner] = len(self.__lanes) + 1
+        return lane
+
+
+TRACER = Tracer(enabled=bool(os.getenv("TRACE_DIR")))
+
+span = TRACER.span
@@ -0,0 +1,150 @@
+import asyncio
+import hmac
+import json
+from aiohttp import web, ContentTypeError
+
+from modules.logger import BaseLogger
+from modules.main import Main
+from modules.db import Tables, ProjectColumns, ImageColumns
+from modules.metrics import WEBHOOKS_PENDING
+
+
+class Webhooks(BaseLogger):
+    __GITLAB_EVENT_PUSH     = "push"
+    __GITLAB_BRANCH_PREFIX  = "refs/heads/"
+    __HARBOR_EVENT_PUSH     = "PUSH_ARTIFACT"
+
+    __RETRY_LIMIT = 3
+
+    def __init__(self, main: Main, debounce_seconds: int,
+                 gitlab_secret: str | None = None, harbor_secret: str | None = None) -> None:
+        self.__main             = main
+        self.__debounce         = debounce_seconds
+        self.__gitlab_secret    = gitlab_secret
+        self.__harbor_secret    = harbor_secret
+
+        # (table, row id) -> scan waiting for its debounce window to close
+        self.__pending: dict[tuple[Tables, int], asyncio.Task] = {}
+        # (table, row id) -> scan in progress, referenced until it finishes
+        self.__running: dict[tuple[Tables, int], asyncio.Task] = {}
+        # (table, row id) -> attempt, scanned again once the running scan finishes
+        self.__rescan: dict[tuple[Tables, int], int] = {}
+
+    def routes(self) -> list[web.RouteDef]:
+        # unauthenticated webhooks would let anyone trigger scans, a source without a secret is not served
+        routes = []
+        for name, secret, handler in (
+            ("gitlab", self.__gitlab_secret, self.__handle_gitlab),
+            ("harbor", self.__harbor_secret, self.__handle_harbor),
+        ):
+            if not secret:
+                self._log_err(f"{name} webhook secret is not set, not serving /webhooks/{name}")
+                continue
+            routes.append(web.post(f"/webhooks/{name}", handler))
+        return routes
+
+    async def __handle_gitlab(self, request: web.Request) -> web.Response:
+        if not self.__authorized(self.__gitlab_secret, request.headers.get("X-Gitlab-Token")):
+            return web.json_response({"error": "unauthorized"}, status=401)
+
+        event = await self.__read_event(request)
+        if event == None:
+            return web.json_response({"error": "invalid payload"}, status=400)
+        if event.get("object_kind") != self.__GITLAB_EVENT_PUSH:
+            return web.json_response({"queued": 0})
+
+        ref = event.get("ref", "")
+        gitlab_url = event.get("project", {}).get("path_with_namespace", "")
+        if not ref.startswith(self.__GITLAB_BRANCH_PREFIX) or not gitlab_url:
+            return web.json_response({"queued": 0})
+        branch = ref[len(self.__GITLAB_BRANCH_PREFIX):]
+
+        projects = await self.__main.db.fetch_rows(Tables.PROJECTS, ProjectColumns.GITLAB_URL, gitlab_url) or []
+        queued = [self.__enqueue(Tables.PROJECTS, project.id) for project in projects if project.gitlab_branch == branch]
+        self._log(f"gitlab push {gitlab_url}@{branch}: {len(queued)} projects queued")
+        return web.json_response({"queued": len(queued)}, status=202)
+
+    async def __handle_harbor(self, request: web.Request) -> web.Response:
+        if not self.__authorized(self.__harbor_secret, request.headers.get("Authorization")):
+            return web.json_response({"error": "unauthorized"}, status=401)
+
+        event = await self.__read_event(request)
+        if event == None:
+            return web.json_response({"error": "invalid payload"}, status=400)
+        if event.get("type") != self.__HARBOR_EVENT_PUSH:
+            return web.json_response({"queued": 0})
+
+        image_urls = set(
+            self.__strip_reference(resource.get("resource_url", ""))
+            for resource in event.get("event_data", {}).get("resources", [])
+        )
+
+        queued = []
+        for image_url in image_urls:
+            images = await self.__main.db.fetch_rows(Tables.IMAGES, ImageColumns.IMAGE_URL, image_url) or []
+            queued.extend(self.__enqueue(Tables.IMAGES, image.id) for image in images)
+        self._log(f"harbor push {', '.join(image_urls)}: {len(queued)} images queued")
+        return web.json_response({"queued": len(queued)}, status=202)
+
+    def __authorized(self, secret: str | None, provided: str | None) -> bool:
+        if not secret:
+            return False
+        return provided != None and hmac.compare_digest(secret, provided)
+
+    async def __read_event(self, request: web.Request) -> dict | None:
+        try:
+            event = await request.json()
+        except (json.JSONDecodeError, UnicodeDecodeError, ContentTypeError) as e:
+            self._log_err(f"malformed webhook from {request.remote}: {e}")
+            return None
+        return event if isinstance(event, dict) else None
+
+    def __strip_reference(self, resource_url: str) -> str:
+        # harbor.ru/project/repo:tag or harbor.ru/project/repo@sha256:... -> harbor.ru/project/repo
+        resource_url = resource_url.split("@")[0]
+        name, _, tag = resource_url.rpartition(":")
+        return name if name and "/" not in tag else resource_url
+
+    def __enqueue(self, table: Tables, row_id: int, attempt: int = 0) -> tuple[Tables, int]:
+        key = (table, row_id)
+        if key in self.__pending:
+            self._log(f"[{table.value} {row_id}] coalesced into pending scan")
+            return key
+        if key in self.__running:
+            # the running scan may have checked out the previous commit, one more follows it
+            self._log(f"[{table.value} {row_id}] queued after running scan")
+            self.__rescan[key] = attempt
+            return key
+
+        task = asyncio.create_task(self.__scan_after_debounce(key, attempt))
+        task.add_done_callback(lambda _: self.__finished(key, task))
+        self.__pending[key] = task
+        WEBHOOKS_PENDING.inc(table.value)
+        return key
+
+    async def __scan_after_debounce(self, key: tuple[Tables, int], attempt: int) -> None:
+        await asyncio.sleep(self.__debounce)
+        # events arriving from here on wait for this scan instead of joining it
+        self.__running[key] = self.__pending.pop(key)
+
+        table, row_id = key
+        WEBHOOKS_PENDING.dec(table.value)
+        try:
+            scanned = await self.__main.process_target(table, row_id)
+            if not scanned and attempt + 1 < self.__RETRY_LIMIT:
+                # leased by a cycle's scan, try again after it had time to finish
+                self.__rescan.setdefault(key, attempt + 1)
+        except Exception as e:
+            self._log_err(f"[{table.value} {row_id}] webhook scan failed: {e}")
+
+    def __finished(self, key: tuple[Tables, int], task: asyncio.Task) -> None:
+        table, row_id = key
+        if self.__pending.get(key) is task:
+            # cancelled inside its debounce window
+            del self.__pending[key]
+            WEBHOOKS_PENDING.dec(table.value)
+        if self.__running.get(key) is task:
+            del self.__running[key]
+        attempt = self.__rescan.pop(key, None)
+        if attempt != None and not task.cancelled():
+            self.__enqueue(table, row_id, attempt)
@@ -0,0 +1,168 @@
+import asyncio
+import os
+import shutil
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+
+from modules.logger import BaseLogger
+from modules.metrics import WORKSPACE_RESERVED_BYTES, WORKSPACE_WAITING
+
+
+def disk_footprint(path: str) -> int:
+    # allocated blocks rather than apparent sizes, hard links counted once
+    total, seen, dirs = 0, set(), [path]
+    while dirs:
+        try:
+            entries = os.scandir(dirs.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    stat = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.path)
+                if stat.st_nlink > 1 and not entry.is_dir(follow_symlinks=False):
+                    if (stat.st_dev, stat.st_ino) in seen:
+                        continue
+                    seen.add((stat.st_dev, stat.st_ino))
+                total += stat.st_blocks * 512
+    return total
+
+
+@dataclass(eq=False)
+class Allocation:
+    key:        str
+    root:       str
+    volume:     str
+    expected:   int             # bytes reserved on admission
+    used:       int = 0         # last measured footprint
+    peak:       int = 0
+    settled:    bool = False    # done growing, nothing left reserved
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def outstanding(self) -> int:
+        return 0 if self.settled else max(self.expected - self.used, 0)
+
+
+class _Volume:
+    def __init__(self, name: str, path: str, reserve_bytes: int, max_allocation_bytes: int | None = None) -> None:
+        self.name       = name
+        self.path       = path
+        self.reserve_bytes = reserve_bytes
+        # only targets known to stay below this are placed here
+        self.max_allocation_bytes = max_allocation_bytes
+        self.allocations: list[Allocation] = []
+
+    def outstanding(self) -> int:
+        return sum(allocation.outstanding() for allocation in self.allocations)
+
+    def available(self) -> int:
+        return shutil.disk_usage(self.path).free - self.reserve_bytes - self.outstanding()
+
+
+class Workspace(BaseLogger):
+    # space freed outside this process is noticed without a release
+    __POLL_INTERVAL = 5     # seconds
+    # footprints vary between runs, admissions reserve a bit more than the last peak
+    __HEADROOM      = 1.25
+
+    def __init__(self, base_path: str, reserve_bytes: int, default_bytes: int,
+                 tmpfs_path: str | None = None, tmpfs_max_bytes: int = 0) -> None:
+        self.base_path          = base_path
+        self.__default_bytes    = default_bytes
+
+        os.makedirs(base_path, exist_ok=True)
+        self.__volumes = [_Volume("disk", base_path, reserve_bytes)]
+        if tmpfs_path and tmpfs_max_bytes > 0:
+            # small repositories are cloned and scanned in memory, tried before the disk
+            tmpfs_base = os.path.join(tmpfs_path, "continuous-monitoring")
+            os.makedirs(tmpfs_base, exist_ok=True)
+            self.__volumes.insert(0, _Volume("tmpfs", tmpfs_base, 0, tmpfs_max_bytes))
+
+        self.__released = asyncio.Event()
+
+    @asynccontextmanager
+    async def allocate(self, key: str, footprint: int | None):
+        # yields None when the target cannot fit even with nothing else running,
+        # the allocation's directory is removed on every way out
+        allocation = await self.__admit(key, footprint)
+        try:
+            yield allocation
+        finally:
+            if allocation != None:
+                await self.__release(allocation)
+
+    async def measure(self, allocation: Allocation, settle: bool = False) -> int:
+        allocation.used = await asyncio.to_thread(disk_footprint, allocation.root)
+        allocation.peak = max(allocation.peak, allocation.used)
+        if settle:
+            allocation.settled = True
+        self.__update_metrics()
+        self.__notify()
+        return allocation.used
+
+    async def __admit(self, key: str, footprint: int | None) -> Allocation | None:
+        expected = int(footprint * self.__HEADROOM) if footprint else self.__default_bytes
+
+        volume, waiting = self.__place(footprint, expected), False
+        try:
+            while volume == None:
+                if not any(v.allocations for v in self.__volumes):
+                    self._log_err(f"not enough disk space for {key}: needs {expected} bytes, {self.__volumes[-1].available()} available")
+                    return None
+                if not waiting:
+                    self._log(f"waiting for disk space for {key}: needs {expected} bytes")
+                    WORKSPACE_WAITING.inc()
+                    waiting = True
+                try:
+                    await asyncio.wait_for(self.__released.wait(), self.__POLL_INTERVAL)
+                except TimeoutError:
+                    pass
+                volume = self.__place(footprint, expected)
+        finally:
+            if waiting:
+                WORKSPACE_WAITING.dec()
+
+        allocation = Allocation(key, os.path.join(volume.path, key), volume.name, expected)
+        volume.allocations.append(allocation)
+        self.__update_metrics()
+
+        # leftovers of a crashed run stay only where a resumed target will look for them
+        for other in self.__volumes:
+            if other is not volume and os.path.exists(os.path.join(other.path, key)):
+                await asyncio.to_thread(shutil.rmtree, os.path.join(other.path, key), True)
+        os.makedirs(allocation.root, exist_ok=True)
+        return allocation
+
+    async def __release(self, allocation: Allocation) -> None:
+        try:
+            await asyncio.to_thread(shutil.rmtree, allocation.root, True)
+        finally:
+            self.__volume(allocation.volume).allocations.remove(allocation)
+            self.__update_metrics()
+            self.__notify()
+
+    def __place(self, footprint: int | None, expected: int) -> _Volume | None:
+        for volume in self.__volumes:
+            if volume.max_allocation_bytes != None and (footprint == None or expected > volume.max_allocation_bytes):
+                continue
+            if volume.available() >= expected:
+                return volume
+        return None
+
+    def __volume(self, name: str) -> _Volume:
+        return next(volume for volume in self.__volumes if volume.name == name)
+
+    def __notify(self) -> None:
+        # wakes every waiting admission, each re-checks free space on its own
+        self.__released.set()
+        self.__released = asyncio.Event()
+
+    def __update_metrics(self) -> None:
+        for volume in self.__volumes:
+            WORKSPACE_RESERVED_BYTES.set(volume.name, value=volume.outstanding())
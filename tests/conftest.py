@@ -0,0 +1,134 @@
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from modules.db import Tables, JournalStages, ProjectRow, ImageRow
+
+
+def project_row(id: int = 1, **overrides) -> ProjectRow:
+    values = dict(
+        id=id, is_active=True, gitlab_url=f"group/project-{id}", gitlab_branch="main", dd_project_id=100 + id,
+        last_scan_at=None, team="team", config_hash=None, synced_at=None, scan_interval_days=1,
+        findings_count=None, workspace_bytes=None
+    )
+    values.update(overrides)
+    return ProjectRow(**values)
+
+
+class FakeDatabase:
+    # in-memory stand-in for the lease and journal queries of Database
+    def __init__(self, rows: dict[Tables, list[ProjectRow | ImageRow]]) -> None:
+        self.rows       = {table: {row.id: row for row in table_rows} for table, table_rows in rows.items()}
+        self.leases: dict[tuple[Tables, int], tuple[str, datetime]] = {}
+        self.last_run: dict[tuple[Tables, int], str] = {}
+        self.journal: dict[tuple[str, Tables, int], JournalStages] = {}
+        self.updates: list[tuple] = []
+        self.fingerprints: dict[tuple[Tables, int, str], tuple[str, dict[str, str], datetime]] = {}
+
+    def expire_leases(self) -> None:
+        self.leases = {key: (runner, datetime.min) for key, (runner, _) in self.leases.items()}
+
+    def __leased(self, key: tuple[Tables, int]) -> bool:
+        return key in self.leases and self.leases[key][1] > datetime.now()
+
+    async def fetch_all(self, table):
+        return list(self.rows.get(table, {}).values())
+
+    async def claim_rows(self, table, runner_id, run_id, limit, ttl, default_seconds, max_seconds=None):
+        claimed = []
+        for row in self.rows.get(table, {}).values():
+            key = (table, row.id)
+            if not row.is_active or self.last_run.get(key) == run_id or self.__leased(key):
+                continue
+            self.leases[key] = (runner_id, datetime.now() + ttl)
+            claimed.append(row)
+            if len(claimed) == limit:
+                break
+        return claimed
+
+    async def claim_row(self, table, runner_id, row_id, ttl):
+        row = self.rows[table].get(row_id)
+        if row == None or self.__leased((table, row_id)):
+            return None
+        self.leases[(table, row_id)] = (runner_id, datetime.now() + ttl)
+        return row
+
+    async def release_row(self, table, runner_id, run_id, row_id):
+        key = (table, row_id)
+        if key not in self.leases or self.leases[key][0] != runner_id:
+            return
+        del self.leases[key]
+        if run_id != None:
+            self.last_run[key] = run_id
+
+    async def extend_leases(self, table, runner_id, ids, ttl):
+        for row_id in ids:
+            if self.leases.get((table, row_id), (None,))[0] == runner_id:
+                self.leases[(table, row_id)] = (runner_id, datetime.now() + ttl)
+
+    async def release_stale_leases(self, table, runner_prefix, runner_id):
+        for key, (runner, _) in list(self.leases.items()):
+            if key[0] == table and runner.startswith(runner_prefix) and runner != runner_id:
+                del self.leases[key]
+
+    async def fetch_expected_durations(self, table, run_id, default_seconds):
+        return [default_seconds for row in self.rows.get(table, {}).values() if self.last_run.get((table, row.id)) != run_id]
+
+    async def fetch_journal_stage(self, run_id, target_type, target_id):
+        return self.journal.get((run_id, target_type, target_id))
+
+    async def save_journal_stage(self, run_id, target_type, target_id, stage):
+        self.journal[(run_id, target_type, target_id)] = stage
+
+    async def update_row(self, table, filter_column, filter_value, column, value):
+        self.updates.append((table, filter_value, column, value))
+
+    async def fetch_finding_fingerprints(self, target_type, target_id, scanner):
+        return self.fingerprints.get((target_type, target_id, scanner))
+
+    async def save_finding_fingerprints(self, target_type, target_id, scanner, digest, fingerprints):
+        self.fingerprints[(target_type, target_id, scanner)] = (digest, fingerprints, datetime.now(timezone.utc))
+
+    async def record_durations(self, table, row_id, durations):
+        pass
+
+    async def record_footprint(self, table, row_id, workspace_bytes):
+        pass
+
+
+class FakeDefectDojo:
+    def __init__(self, findings_count: int = 3) -> None:
+        self.findings_count = findings_count
+        self.uploads: list[str] = []
+
+    async def get_product_findings(self, product_id):
+        return self.findings_count
+
+    async def get_endpoint_id(self, product_id):
+        return 1
+
+    async def get_engagement(self, product, branch):
+        return 7
+
+    async def send_report(self, report):
+        self.uploads.append(report.title)
+        return len(self.uploads)
+
+
+class FakeRocket:
+    # wraps the real digest buffering, posting into a list instead of the chat
+    def __init__(self, deliver: bool = True) -> None:
+        from modules.rocket import Rocket
+
+        self.deliver    = deliver
+        self.sent: list[str] = []
+        self.rocket     = Rocket("http://rocket.invalid", "user", "token", "room")
+        self.rocket.send_message = self.__send_message
+
+    async def __send_message(self, message, thread_id=None):
+        if not self.deliver:
+            return False
+        self.sent.append(message)
+        return True
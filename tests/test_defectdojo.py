@@ -0,0 +1,84 @@
+import asyncio
+import io
+
+from modules.defectdojo import DefectDojo, DefectDojoReport
+
+
+class FakeDefectDojoApi:
+    # tests, imports and reimports as DefectDojo's API would see them
+    def __init__(self) -> None:
+        self.tests: list[dict] = []
+        self.reimports: list[int] = []
+        self.lookups    = 0
+
+    def install(self, dd: DefectDojo) -> None:
+        dd._DefectDojo__request_get = self.get
+        dd._DefectDojo__request_post = self.post
+
+    async def get(self, endpoint, body):
+        await asyncio.sleep(0)
+        self.lookups += 1
+        return {"results": [test for test in self.tests if test["engagement"] == body["engagement"]]}
+
+    async def post(self, endpoint, body=None, data=None):
+        await asyncio.sleep(0.01)
+        fields = {name["name"]: value for name, _, value in data._fields}
+        if "test" in fields:
+            self.reimports.append(int(fields["test"]))
+            return {"test_id": int(fields["test"])}
+        test = {
+            "id": len(self.tests) + 1, "engagement": int(fields["engagement"]),
+            "scan_type": fields["scan_type"], "title": fields.get("test_title"),
+        }
+        self.tests.append(test)
+        return {"test_id": test["id"]}
+
+
+def report(title: str) -> DefectDojoReport:
+    return DefectDojoReport(scan_type="Trivy Scan", endpoint_id=1, file=io.BytesIO(b"{}"),
+                            engagement_id=7, branch="main", report_name=title)
+
+
+def test_scanners_sharing_a_scan_type_get_their_own_tests():
+    async def run():
+        api, dd = FakeDefectDojoApi(), DefectDojo("http://dd.invalid", "token", reimport=True)
+        api.install(dd)
+        first = await dd.send_report(report("scanners/trivy-fs.cfg"))
+        second = await dd.send_report(report("scanners/trivy-config.cfg"))
+        assert first != second
+
+        assert await dd.send_report(report("scanners/trivy-fs.cfg")) == first
+        assert api.reimports == [first]
+    asyncio.run(run())
+
+
+def test_concurrent_first_reports_create_a_single_test():
+    async def run():
+        api, dd = FakeDefectDojoApi(), DefectDojo("http://dd.invalid", "token", reimport=True)
+        api.install(dd)
+        test_ids = await asyncio.gather(*[dd.send_report(report("scanners/trivy-fs.cfg")) for _ in range(3)])
+        assert len(api.tests) == 1
+        assert set(test_ids) == {api.tests[0]["id"]}
+        assert len(api.reimports) == 2
+    asyncio.run(run())
+
+
+def test_lookups_stay_cached_until_the_run_rolls_over():
+    async def run():
+        api, dd = FakeDefectDojoApi(), DefectDojo("http://dd.invalid", "token", reimport=True)
+        api.install(dd)
+        dd.reset_caches("host-2026-10-19")
+        await dd.send_report(report("scanners/trivy-fs.cfg"))
+        await dd.send_report(report("scanners/trivy-fs.cfg"))
+        lookups = api.lookups
+
+        # further daemon cycles within the same daily run
+        for _ in range(3):
+            dd.reset_caches("host-2026-10-19")
+            await dd.send_report(report("scanners/trivy-fs.cfg"))
+        assert api.lookups == lookups
+
+        dd.reset_caches("host-2026-10-20")
+        await dd.send_report(report("scanners/trivy-fs.cfg"))
+        assert api.lookups == lookups + 1
+    asyncio.run(run())
@@ -0,0 +1,92 @@
+import asyncio
+import json
+import os
+from datetime import datetime, timezone
+
+from conftest import FakeDatabase, FakeDefectDojo, FakeRocket, project_row
+from modules.db import Tables, JournalStages, ProjectColumns
+from modules.git import Gitlab
+from modules.defectdojo import MINIMUM_SEVERITY
+from modules.main import Main
+from modules.reports import FindingsDelta, SlimResult, slim_report
+from modules.scanner import ScannerDefinition
+from modules.scheduler import Scheduler
+from modules.workspace import Workspace
+
+RUN_ID = "pipeline-1"
+TRIVY = ScannerDefinition("scanners/trivy-fs.cfg", ScannerDefinition.TARGET_PROJECT,
+                          "trivy fs {PROJECT_PATH} -o {OUTPUT_PATH}", "Trivy Scan", True)
+REPORT = {"Results": [{"Target": "package-lock.json", "Vulnerabilities": [
+    {"VulnerabilityID": "CVE-2021-23337", "PkgName": "lodash", "InstalledVersion": "4.17.20", "Severity": "HIGH"},
+]}]}
+
+
+class FakeScanner:
+    def get_project_scanners(self):
+        return [TRIVY]
+
+
+def scanned_project(tmp_path, previous: dict[str, str]) -> tuple[FakeDatabase, Workspace]:
+    # resumes after the scan, with the report left in the project's workspace
+    db = FakeDatabase({Tables.PROJECTS: [project_row(1)]})
+    db.journal[(RUN_ID, Tables.PROJECTS, 1)] = JournalStages.SCANNED
+    workspace = Workspace(str(tmp_path / "workspace"), reserve_bytes=0, default_bytes=1024)
+    reports_dir = os.path.join(workspace.base_path, "project", "101", "reports")
+    os.makedirs(reports_dir)
+    with open(os.path.join(reports_dir, "0.json"), "w") as f:
+        json.dump(REPORT, f)
+
+    # left by the previous import
+    db.fingerprints[(Tables.PROJECTS, 1, TRIVY.path)] = (
+        SlimResult(0, 0, previous).digest(), previous, datetime.now(timezone.utc)
+    )
+    return db, workspace
+
+
+async def process(db, workspace, dd, rocket) -> None:
+    m = Main(dd, Gitlab("http://gitlab.invalid", "token"), FakeScanner(), db, rocket.rocket, Scheduler(), workspace, "slot-1/aaaa", RUN_ID)
+    try:
+        await m.process_projects_from_db()
+        await m.flush_notifications(RUN_ID)
+    finally:
+        m.close()
+
+
+def current_fingerprints(tmp_path) -> dict[str, str]:
+    with open(tmp_path / "current.json", "w") as f:
+        json.dump(REPORT, f)
+    return slim_report(str(tmp_path / "current.json"), TRIVY.scan_type, MINIMUM_SEVERITY).fingerprints
+
+
+def test_delta_lists_new_and_closed_findings():
+    delta = FindingsDelta.between({"a": "A", "b": "B"}, {"b": "B", "c": "C"})
+    assert (delta.new, delta.closed) == ({"c": "C"}, {"a": "A"})
+    assert not delta.is_empty()
+    assert FindingsDelta.between({"a": "A"}, {"a": "A"}).is_empty()
+
+
+def test_unchanged_findings_skip_upload_and_notification_but_refresh_the_count(tmp_path):
+    async def run():
+        db, workspace = scanned_project(tmp_path, current_fingerprints(tmp_path))
+        dd, rocket = FakeDefectDojo(findings_count=5), FakeRocket()
+        await process(db, workspace, dd, rocket)
+
+        assert dd.uploads == []
+        assert rocket.sent == []
+        # the scheduler ranks targets by it, refreshed on every pass
+        assert (Tables.PROJECTS, 1, ProjectColumns.FINDINGS_COUNT, 5) in db.updates
+        assert db.journal[(RUN_ID, Tables.PROJECTS, 1)] == JournalStages.NOTIFIED
+        assert db.last_run[(Tables.PROJECTS, 1)] == RUN_ID
+    asyncio.run(run())
+
+
+def test_changed_findings_are_uploaded_and_notified_as_a_delta(tmp_path):
+    async def run():
+        db, workspace = scanned_project(tmp_path, {"fixed": "CVE-2020-28500 lodash 4.17.20"})
+        dd, rocket = FakeDefectDojo(findings_count=5), FakeRocket()
+        await process(db, workspace, dd, rocket)
+
+        assert dd.uploads == [TRIVY.path]
+        assert len(rocket.sent) == 1 and "1 new and 1 closed" in rocket.sent[0]
+        assert db.fingerprints[(Tables.PROJECTS, 1, TRIVY.path)][1] == current_fingerprints(tmp_path)
+    asyncio.run(run())
@@ -0,0 +1,50 @@
+import asyncio
+import os
+
+from conftest import FakeDatabase, FakeDefectDojo, FakeRocket
+from modules.db import Tables, JournalStages, ImageRow
+from modules.git import Gitlab
+from modules.main import Main
+from modules.scheduler import Scheduler
+from modules.workspace import Workspace
+
+RUN_ID = "pipeline-1"
+
+
+def image_row(id: int, image_url: str = "registry.invalid/group/app:1.0") -> ImageRow:
+    return ImageRow(id=id, is_active=True, project_id=1, image_url=image_url, engagement_id=10 + id,
+                    last_scan_at=None, scan_interval_days=1, findings_count=None, workspace_bytes=None)
+
+
+class FakeImageScanner:
+    # every tag resolves to the same digest, scans leave no reports behind
+    def __init__(self, workspace: Workspace) -> None:
+        self.workspace  = workspace
+        self.scans      = 0
+        self.allocated_during_scan: list[str] = []
+
+    async def resolve_image(self, project_id, image_url):
+        return image_url, "sha256:0123"
+
+    async def scan_image(self, project_id, image_ref, outputs_base_path):
+        self.scans += 1
+        self.allocated_during_scan = os.listdir(os.path.join(self.workspace.base_path, "image"))
+        await asyncio.sleep(0.05)
+
+
+def test_engagements_of_one_image_share_a_single_workspace_scan(tmp_path):
+    async def run():
+        db = FakeDatabase({Tables.IMAGES: [image_row(1), image_row(2), image_row(3, "registry.invalid/group/app:latest")]})
+        workspace = Workspace(str(tmp_path / "workspace"), reserve_bytes=0, default_bytes=1024)
+        scanner = FakeImageScanner(workspace)
+        m = Main(FakeDefectDojo(), Gitlab("http://gitlab.invalid", "token"), scanner, db, FakeRocket().rocket,
+                 Scheduler(), workspace, "slot-1/aaaa", RUN_ID)
+        await m.process_images_from_db()
+        m.close()
+
+        assert scanner.scans == 1
+        # admitted through the workspace as one allocation, removed once every engagement finished
+        assert len(scanner.allocated_during_scan) == 1
+        assert os.listdir(os.path.join(workspace.base_path, "image")) == []
+        assert all(db.journal[(RUN_ID, Tables.IMAGES, id)] == JournalStages.NOTIFIED for id in (1, 2, 3))
+    asyncio.run(run())
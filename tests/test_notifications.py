@@ -0,0 +1,102 @@
+import asyncio
+
+from conftest import FakeDatabase, FakeDefectDojo, FakeRocket, project_row
+from modules.db import Tables, JournalStages
+from modules.main import Main
+from modules.scheduler import Scheduler
+from modules.workspace import Workspace
+
+RUN_ID = "pipeline-1"
+
+
+def make_main(db, rocket, tmp_path, runner_id) -> Main:
+    workspace = Workspace(str(tmp_path / "workspace"), reserve_bytes=0, default_bytes=1024)
+    return Main(FakeDefectDojo(), None, None, db, rocket.rocket, Scheduler(), workspace, runner_id, RUN_ID)
+
+
+def uploaded_project_db() -> FakeDatabase:
+    # the report is already in DefectDojo, only the notification is left
+    db = FakeDatabase({Tables.PROJECTS: [project_row(1)]})
+    db.journal[(RUN_ID, Tables.PROJECTS, 1)] = JournalStages.UPLOADED
+    return db
+
+
+async def crash_before_flush(m: Main) -> None:
+    # the process dies after the target finished but before the cycle flushed its digests
+    await m.process_projects_from_db()
+    m.close()
+
+
+def test_message_is_resent_after_a_crash_between_release_and_flush(tmp_path):
+    async def run():
+        db = uploaded_project_db()
+        lost = FakeRocket()
+        await crash_before_flush(make_main(db, lost, tmp_path, "slot-1/aaaa"))
+        assert lost.sent == []
+        # unfinished in this run, held by the dead process
+        assert (Tables.PROJECTS, 1) not in db.last_run
+        assert db.leases[(Tables.PROJECTS, 1)][0] == "slot-1/aaaa"
+
+        rocket = FakeRocket()
+        m = make_main(db, rocket, tmp_path, "slot-1/bbbb")
+        await m.recover_leases("slot-1/")
+        await m.process_projects_from_db()
+        await m.flush_notifications(RUN_ID)
+
+        assert len(rocket.sent) == 1 and "group/project-1" in rocket.sent[0]
+        assert db.journal[(RUN_ID, Tables.PROJECTS, 1)] == JournalStages.NOTIFIED
+        assert db.last_run[(Tables.PROJECTS, 1)] == RUN_ID
+        assert (Tables.PROJECTS, 1) not in db.leases
+    asyncio.run(run())
+
+
+def test_other_runner_resumes_once_the_dead_lease_expires(tmp_path):
+    async def run():
+        db = uploaded_project_db()
+        await crash_before_flush(make_main(db, FakeRocket(), tmp_path, "slot-1/aaaa"))
+
+        rocket = FakeRocket()
+        m = make_main(db, rocket, tmp_path, "slot-2/cccc")
+        await m.process_projects_from_db()
+        assert rocket.sent == []
+
+        db.expire_leases()
+        await m.process_projects_from_db()
+        await m.flush_notifications(RUN_ID)
+        assert len(rocket.sent) == 1
+    asyncio.run(run())
+
+
+def test_undelivered_digest_leaves_the_target_for_the_next_pass(tmp_path):
+    async def run():
+        db = uploaded_project_db()
+        rocket = FakeRocket(deliver=False)
+        m = make_main(db, rocket, tmp_path, "slot-1/aaaa")
+        await m.process_projects_from_db()
+        await m.flush_notifications(RUN_ID)
+
+        assert db.journal[(RUN_ID, Tables.PROJECTS, 1)] == JournalStages.UPLOADED
+        assert (Tables.PROJECTS, 1) not in db.last_run
+        assert (Tables.PROJECTS, 1) not in db.leases
+
+        rocket.deliver = True
+        await m.process_projects_from_db()
+        await m.flush_notifications(RUN_ID)
+        assert len(rocket.sent) == 1
+        assert db.last_run[(Tables.PROJECTS, 1)] == RUN_ID
+        m.close()
+    asyncio.run(run())
+
+
+def test_delivered_target_is_not_claimed_again_in_the_run(tmp_path):
+    async def run():
+        db = uploaded_project_db()
+        rocket = FakeRocket()
+        m = make_main(db, rocket, tmp_path, "slot-1/aaaa")
+        await m.process_projects_from_db()
+        await m.flush_notifications(RUN_ID)
+        await m.process_projects_from_db()
+        await m.flush_notifications(RUN_ID)
+        assert len(rocket.sent) == 1
+        m.close()
+    asyncio.run(run())
@@ -0,0 +1,92 @@
+import json
+import os
+
+from modules.reports import (
+    detach_project_path, attach_project_path, slim_report, PROJECT_PATH_PLACEHOLDER
+)
+
+
+def test_cached_report_is_pointed_at_the_restoring_checkout():
+    scanned = "./.tmp/project/101/repo"
+    report = json.dumps({
+        "ArtifactName": scanned,
+        "Results": [{"Target": "package-lock.json", "Path": os.path.abspath(scanned) + "/package-lock.json"}],
+    }).encode()
+
+    cached = detach_project_path(report, scanned)
+    assert scanned.encode() not in cached and os.path.abspath(scanned).encode() not in cached
+    assert PROJECT_PATH_PLACEHOLDER in cached
+
+    restored = json.loads(attach_project_path(cached, "/mnt/tmpfs/project/202/repo"))
+    assert restored["ArtifactName"] == "/mnt/tmpfs/project/202/repo"
+    assert restored["Results"][0]["Path"] == "/mnt/tmpfs/project/202/repo/package-lock.json"
+    assert restored["Results"][0]["Target"] == "package-lock.json"
+
+
+def write_report(tmp_path, report: dict) -> str:
+    path = tmp_path / "report.json"
+    path.write_text(json.dumps(report))
+    return str(path)
+
+
+TRIVY_REPORT = {
+    "ArtifactName": "repo",
+    "Results": [{
+        "Target": "package-lock.json",
+        "Packages": [{"Name": "lodash", "Version": "4.17.20"}],
+        "Vulnerabilities": [
+            {"VulnerabilityID": "CVE-2021-23337", "PkgName": "lodash", "InstalledVersion": "4.17.20",
+             "Severity": "HIGH", "DataSource": {"ID": "ghsa"}, "VendorSeverity": {"ghsa": 3}, "Title": "injection"},
+            {"VulnerabilityID": "CVE-2020-28500", "PkgName": "lodash", "InstalledVersion": "4.17.20", "Severity": "LOW"},
+        ],
+    }],
+}
+
+
+def test_trivy_report_keeps_findings_above_the_threshold_without_bulky_fields(tmp_path):
+    path = write_report(tmp_path, TRIVY_REPORT)
+    result = slim_report(path, "Trivy Scan", "Medium")
+    assert (result.kept, result.dropped) == (1, 1)
+    assert list(result.fingerprints.values()) == ["CVE-2021-23337 lodash 4.17.20"]
+
+    with open(path) as f:
+        slimmed = json.load(f)
+    assert slimmed["ArtifactName"] == "repo"
+    assert "Packages" not in slimmed["Results"][0]
+    assert slimmed["Results"][0]["Vulnerabilities"] == [{
+        "VulnerabilityID": "CVE-2021-23337", "PkgName": "lodash", "InstalledVersion": "4.17.20",
+        "Severity": "HIGH", "Title": "injection",
+    }]
+
+
+def test_fingerprints_do_not_depend_on_dropped_fields(tmp_path):
+    first = slim_report(write_report(tmp_path, TRIVY_REPORT), "Trivy Scan", "Info")
+    changed = json.loads(json.dumps(TRIVY_REPORT))
+    changed["Results"][0]["Vulnerabilities"][0]["VendorSeverity"] = {"nvd": 4}
+    second = slim_report(write_report(tmp_path, changed), "Trivy Scan", "Info")
+    assert first.digest() == second.digest()
+    assert first.kept == 2
+
+
+def test_semgrep_report_maps_severities_and_strips_dataflow(tmp_path):
+    path = write_report(tmp_path, {"results": [
+        {"check_id": "python.lang.security.audit.eval", "path": "app.py", "start": {"line": 3},
+         "extra": {"severity": "ERROR", "dataflow_trace": {"taint_source": []}}},
+        {"check_id": "python.lang.style.todo", "path": "app.py", "start": {"line": 9}, "extra": {"severity": "INFO"}},
+    ], "errors": []})
+    result = slim_report(path, "Semgrep JSON Report", "Medium")
+    assert (result.kept, result.dropped) == (1, 1)
+    assert list(result.fingerprints.values()) == ["eval app.py:3"]
+
+    with open(path) as f:
+        slimmed = json.load(f)
+    assert slimmed["results"][0]["extra"] == {"severity": "ERROR"}
+    assert slimmed["errors"] == []
+
+
+def test_reports_without_a_rule_are_left_alone(tmp_path):
+    path = write_report(tmp_path, {"anything": [1, 2]})
+    assert slim_report(path, "Gitleaks Scan", "High") == None
+    with open(path) as f:
+        assert json.load(f) == {"anything": [1, 2]}
+
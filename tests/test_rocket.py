@@ -0,0 +1,27 @@
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+
+from modules.rocket import Rocket
+
+
+def retry_delay(retry_after: str | None, attempt: int = 0) -> float:
+    rocket = Rocket("http://rocket.invalid", "user", "token", "room")
+    return rocket._Rocket__retry_delay(retry_after, attempt)
+
+
+def test_retry_after_in_seconds_is_honoured():
+    assert retry_delay("7") == 7
+    assert retry_delay("-3") == 0
+
+
+def test_retry_after_as_http_date_is_honoured():
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=30)
+    assert 28 <= retry_delay(format_datetime(retry_at, usegmt=True)) <= 30
+    assert retry_delay("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+
+
+@pytest.mark.parametrize("retry_after", [None, "", "soon"])
+def test_missing_or_malformed_retry_after_backs_off_exponentially(retry_after):
+    assert retry_delay(retry_after, 0) < retry_delay(retry_after, 1) < retry_delay(retry_after, 2)
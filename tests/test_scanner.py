@@ -0,0 +1,73 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from modules.backends import ScannerBackends
+from modules.scanner import ScannRunner, ScannerDefinition
+
+PROJECT_SCANNER = ScannerDefinition("scanners/trivy-fs.cfg", ScannerDefinition.TARGET_PROJECT,
+                                    "trivy fs {PROJECT_PATH} -o {OUTPUT_PATH}", "Trivy Scan", True)
+
+
+def make_runner(tmp_path, commit: str | None, files: list | None = None) -> ScannRunner:
+    runner = ScannRunner("http://gitlab.invalid", "token", {}, ScannerBackends(str(tmp_path / "runtimes")))
+
+    async def fetch_last_commit(session):
+        return commit
+
+    async def fetch_files_list(session, ref):
+        return files
+    runner.fetch_last_commit = fetch_last_commit
+    runner.fetch_files_list = fetch_files_list
+    return runner
+
+
+def write_cached_set(commit: str) -> None:
+    os.makedirs(".cache/scanners", exist_ok=True)
+    with open(f".cache/scanners/{commit}.v3.json", "w") as f:
+        json.dump([{
+            "path": PROJECT_SCANNER.path, "target": PROJECT_SCANNER.target, "command": PROJECT_SCANNER.command,
+            "scan_type": PROJECT_SCANNER.scan_type, "sca": PROJECT_SCANNER.sca,
+        }], f)
+
+
+@pytest.mark.parametrize("commit", [None, "c2"])
+def test_fresh_process_without_a_cached_set_aborts(tmp_path, monkeypatch, commit):
+    # a failed commit lookup and a failed file listing both end up here
+    monkeypatch.chdir(tmp_path)
+    with pytest.raises(RuntimeError):
+        asyncio.run(make_runner(tmp_path, commit).load_scanners())
+
+
+@pytest.mark.parametrize("commit", [None, "c2"])
+def test_fresh_process_falls_back_to_the_cached_set(tmp_path, monkeypatch, commit):
+    monkeypatch.chdir(tmp_path)
+    write_cached_set("c1")
+    runner = make_runner(tmp_path, commit)
+    asyncio.run(runner.load_scanners())
+    assert runner.get_project_scanners() == [PROJECT_SCANNER]
+    # the failed commit is not cached in place of the complete one
+    assert os.listdir(".cache/scanners") == ["c1.v3.json"]
+
+
+def test_parse_reads_target_type_and_sca_flag():
+    definition = ScannerDefinition.parse("scanners/trivy-fs.cfg", [
+        "PROJECT: trivy fs {PROJECT_PATH} -o {OUTPUT_PATH}",
+        "DD_SCAN_TYPE: Trivy Scan",
+        "SCA: true",
+    ])
+    assert definition == PROJECT_SCANNER
+
+
+@pytest.mark.parametrize("lines", [
+    ["PROJECT: trivy fs {PROJECT_PATH}", "DD_SCAN_TYPE: Trivy Scan"],
+    ["IMAGE: trivy image -o {OUTPUT_PATH}", "DD_SCAN_TYPE: Trivy Scan"],
+    ["trivy fs {PROJECT_PATH} -o {OUTPUT_PATH}", "DD_SCAN_TYPE: Trivy Scan"],
+    ["PROJECT: trivy fs {PROJECT_PATH} -o {OUTPUT_PATH}", "DD_SCAN_TYPE: "],
+    ["PROJECT: trivy fs {PROJECT_PATH} -o {OUTPUT_PATH}", "DD_SCAN_TYPE: Trivy Scan", "SCA: maybe"],
+])
+def test_parse_rejects_malformed_configs(lines):
+    with pytest.raises(ValueError):
+        ScannerDefinition.parse("scanners/broken.cfg", lines)
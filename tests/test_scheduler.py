@@ -0,0 +1,18 @@
+from modules.db import Tables
+from modules.scheduler import Scheduler
+
+
+def test_makespan_packs_longest_targets_first():
+    scheduler = Scheduler()
+    assert scheduler.predict_makespan([], 4) == 0
+    assert scheduler.predict_makespan([10, 10, 10], 1) == 30
+    # 7+1 | 5+2 | 4+3 with three workers
+    assert scheduler.predict_makespan([1, 3, 7, 4, 5, 2], 3) == 8
+    assert scheduler.predict_makespan([5], 0) == 5
+
+
+def test_recorded_samples_are_bounded():
+    scheduler = Scheduler()
+    for _ in range(1000):
+        scheduler.record(Tables.PROJECTS, 1.0)
+    assert len(scheduler._Scheduler__durations[Tables.PROJECTS]) == 200
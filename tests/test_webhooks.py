@@ -0,0 +1,92 @@
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from conftest import project_row
+from modules.db import Tables
+from modules.webhooks import Webhooks
+
+SECRET = "s3cret"
+PUSH = {"object_kind": "push", "ref": "refs/heads/main", "project": {"path_with_namespace": "group/project-1"}}
+
+
+class FakeDatabase:
+    async def fetch_rows(self, table, column, value):
+        return [project_row(1)] if value == "group/project-1" else []
+
+
+class FakeMain:
+    # records scans and how many of them overlapped
+    def __init__(self, scan_seconds: float) -> None:
+        self.db             = FakeDatabase()
+        self.scans: list[tuple[Tables, int]] = []
+        self.running        = 0
+        self.max_running    = 0
+        self.__scan_seconds = scan_seconds
+
+    async def process_target(self, table, row_id):
+        self.scans.append((table, row_id))
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(self.__scan_seconds)
+        self.running -= 1
+        return True
+
+
+async def client_for(webhooks: Webhooks) -> TestClient:
+    app = web.Application()
+    app.add_routes(webhooks.routes())
+    client = TestClient(TestServer(app))
+    await client.start_server()
+    return client
+
+
+def test_sources_without_a_secret_are_not_served():
+    async def run():
+        client = await client_for(Webhooks(FakeMain(0), debounce_seconds=0, harbor_secret=SECRET))
+        try:
+            response = await client.post("/webhooks/gitlab", json=PUSH)
+            assert response.status == 404
+        finally:
+            await client.close()
+    asyncio.run(run())
+
+
+def test_malformed_payload_is_rejected():
+    async def run():
+        client = await client_for(Webhooks(FakeMain(0), debounce_seconds=0, gitlab_secret=SECRET))
+        try:
+            response = await client.post("/webhooks/gitlab", data=b"{not json", headers={"X-Gitlab-Token": SECRET})
+            assert response.status == 400
+            response = await client.post("/webhooks/gitlab", json=[PUSH], headers={"X-Gitlab-Token": SECRET})
+            assert response.status == 400
+        finally:
+            await client.close()
+    asyncio.run(run())
+
+
+def test_pushes_are_debounced_and_never_scanned_twice_at_once():
+    async def run():
+        main = FakeMain(scan_seconds=0.1)
+        client = await client_for(Webhooks(main, debounce_seconds=0.05, gitlab_secret=SECRET))
+        try:
+            async def push():
+                response = await client.post("/webhooks/gitlab", json=PUSH, headers={"X-Gitlab-Token": SECRET})
+                assert response.status == 202
+
+            # coalesced into one scan within the debounce window
+            await push()
+            await push()
+            await asyncio.sleep(0.08)
+            assert main.scans == [(Tables.PROJECTS, 1)]
+
+            # pushed while scanning, scanned once more after it
+            await push()
+            await push()
+            await asyncio.sleep(0.3)
+            assert main.scans == [(Tables.PROJECTS, 1)] * 2
+            assert main.max_running == 1
+        finally:
+            await client.close()
+    asyncio.run(run())
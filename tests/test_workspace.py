@@ -0,0 +1,80 @@
+import asyncio
+import os
+import shutil
+
+from modules.workspace import Workspace, disk_footprint
+
+MB = 1024 * 1024
+
+
+def free_bytes(path) -> int:
+    return shutil.disk_usage(path).free
+
+
+def test_admission_waits_for_a_release(tmp_path):
+    async def run():
+        # room for one of the two allocations at a time
+        workspace = Workspace(str(tmp_path), reserve_bytes=free_bytes(tmp_path) - 15 * MB, default_bytes=10 * MB)
+        order = []
+
+        async def hold(key):
+            async with workspace.allocate(key, None) as allocation:
+                assert allocation != None
+                order.append(f"{key} in")
+                await asyncio.sleep(0.05)
+                order.append(f"{key} out")
+
+        await asyncio.gather(hold("first"), hold("second"))
+        assert order == ["first in", "first out", "second in", "second out"]
+    asyncio.run(run())
+
+
+def test_target_that_never_fits_is_skipped(tmp_path):
+    async def run():
+        workspace = Workspace(str(tmp_path), reserve_bytes=free_bytes(tmp_path), default_bytes=MB)
+        async with workspace.allocate("huge", 10 * MB) as allocation:
+            assert allocation == None
+    asyncio.run(run())
+
+
+def test_settled_allocation_gives_back_its_unused_reservation(tmp_path):
+    async def run():
+        workspace = Workspace(str(tmp_path), reserve_bytes=free_bytes(tmp_path) - 15 * MB, default_bytes=10 * MB)
+        async with workspace.allocate("first", None) as first:
+            await workspace.measure(first, settle=True)
+            # admitted without waiting for the first one to finish
+            async with workspace.allocate("second", None) as second:
+                assert second != None
+    asyncio.run(asyncio.wait_for(run(), 1))
+
+
+def test_allocation_directory_is_removed_on_release(tmp_path):
+    async def run():
+        workspace = Workspace(str(tmp_path), reserve_bytes=0, default_bytes=MB)
+        async with workspace.allocate("image/abc_run", None) as allocation:
+            with open(allocation.path("report.json"), "w") as f:
+                f.write("{}")
+            root = allocation.root
+        assert not os.path.exists(root)
+    asyncio.run(run())
+
+
+def test_small_targets_are_placed_on_tmpfs(tmp_path):
+    async def run():
+        workspace = Workspace(str(tmp_path / "disk"), reserve_bytes=0, default_bytes=MB,
+                              tmpfs_path=str(tmp_path / "tmpfs"), tmpfs_max_bytes=4 * MB)
+        async with workspace.allocate("small", MB) as small, workspace.allocate("large", 8 * MB) as large:
+            assert small.volume == "tmpfs"
+            assert large.volume == "disk"
+        # unknown footprints are never placed in memory
+        async with workspace.allocate("unknown", None) as unknown:
+            assert unknown.volume == "disk"
+    asyncio.run(run())
+
+
+def test_hard_links_are_counted_once(tmp_path):
+    with open(tmp_path / "report.json", "wb") as f:
+        f.write(os.urandom(64 * 1024))
+    single = disk_footprint(str(tmp_path))
+    os.link(tmp_path / "report.json", tmp_path / "linked.json")
+    assert disk_footprint(str(tmp_path)) == single